@@ -1,10 +1,30 @@
 import streamlit as st
 import os
-import json
 import tempfile
+import time
+import functools
+import hashlib
+import urllib.parse
 from dotenv import load_dotenv
-from utils.transcription import GladiaAPI
-from utils.text_formatter import GeminiFormatter
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.transcription import GladiaAPI, Transcript, normalize_media_url
+from utils.transcription_backends import LocalWhisperBackend, TranscriptionRouter
+from utils.text_formatter import GeminiFormatter, count_pages
+from utils.segmenter import propose_pages, format_outline, assign_speakers
+from utils.variation_ranker import rank_variations
+from utils.metrics import metrics
+from utils.circuit_breaker import breakers, OPEN, HALF_OPEN
+from utils.jobs import JobTracker
+from utils.startup import lazy_import_times, importtime_report
+from utils.storage import JsonStore
+from utils.project_store import ProjectStore, DEFAULT_DB_PATH
+from utils.search_index import SearchIndex, SEARCHABLE_ARTIFACTS
+from utils.near_duplicate import DuplicateIndex, audio_fingerprint
+from utils.text_store import TextStore, put_texts, get_texts
+from utils.session_snapshot import SessionSnapshots, DEFAULT_SNAPSHOT_DIR, new_token, valid_token
+
+# 再実行ごとのスクリプト実行時間を計測
+rerun_started = time.perf_counter()
 
 # 環境変数を読み込み
 load_dotenv()
@@ -14,38 +34,526 @@ CHARACTERS_FILE = os.path.join(os.path.dirname(__file__), "characters.json")
 TEMPLATES_FILE = os.path.join(os.path.dirname(__file__), "templates.json")
 
 
+@st.cache_resource(show_spinner=False)
+def get_store(path, default_kind):
+    """保存ファイルのストア（プロセス内で共有し、読み込み結果を更新時刻でキャッシュ）"""
+    return JsonStore(path, default=[] if default_kind == "list" else None)
+
+
 def load_characters():
     """JSONファイルからキャラクターを読み込む"""
-    if os.path.exists(CHARACTERS_FILE):
-        try:
-            with open(CHARACTERS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return []
-    return []
+    return get_store(CHARACTERS_FILE, "list").load() or []
+
 
+def add_character(character):
+    """キャラクターを1件追加（変更ログに追記）"""
+    store = get_store(CHARACTERS_FILE, "list")
+    store.apply({"op": "append", "item": character})
+    return store.load()
 
-def save_characters(characters):
-    """キャラクターをJSONファイルに保存"""
-    with open(CHARACTERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(characters, f, ensure_ascii=False, indent=2)
+
+def delete_character(name):
+    """キャラクターを名前で1件削除（変更ログに追記）"""
+    store = get_store(CHARACTERS_FILE, "list")
+    store.apply({"op": "remove", "key": "name", "value": name})
+    return store.load()
 
 
 def load_templates():
     """JSONファイルから誘導文・定型文を読み込む"""
-    if os.path.exists(TEMPLATES_FILE):
-        try:
-            with open(TEMPLATES_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return None
-    return None
+    return get_store(TEMPLATES_FILE, "dict").load()
 
 
 def save_templates(lead_templates, closing_text):
-    """誘導文・定型文をJSONファイルに保存"""
-    with open(TEMPLATES_FILE, "w", encoding="utf-8") as f:
-        json.dump({"lead_templates": lead_templates, "closing_text": closing_text}, f, ensure_ascii=False, indent=2)
+    """誘導文・定型文をJSONファイルに保存（変更がなければ書き込まない）"""
+    store = get_store(TEMPLATES_FILE, "dict")
+    values = {"lead_templates": lead_templates, "closing_text": closing_text}
+    saved = store.load() or {}
+    if all(saved.get(k) == v for k, v in values.items()):
+        return
+    store.apply({"op": "update", "values": values})
+
+
+def storage_errors():
+    """保存ファイルの読み込み時に検出した破損など"""
+    return [store.last_error for store in (get_store(CHARACTERS_FILE, "list"), get_store(TEMPLATES_FILE, "dict"))
+            if store.last_error]
+
+
+@st.cache_resource(show_spinner=False)
+def get_gladia_client(api_key):
+    """Gladiaクライアント（APIキーごとにプロセス内で共有し、接続プールを再利用）"""
+    return GladiaAPI(api_key)
+
+
+def breaker_state_label(row):
+    """サーキットブレーカーの状態の表示"""
+    if row["state"] == OPEN:
+        return f"停止中（あと{row['retry_in']:.0f}秒）"
+    if row["state"] == HALF_OPEN:
+        return "試行中"
+    return "正常"
+
+
+# 文字起こしエンジンの表示名
+TRANSCRIPTION_ENGINES = {
+    "auto": "自動（短いクリップはローカル）",
+    "gladia": "Gladia",
+    "whisper": "ローカル Whisper（CPU）",
+}
+
+
+@st.cache_resource(show_spinner=False)
+def get_transcription_router(gladia_api_key, mode, cpu_threads, local_max_seconds):
+    """文字起こしバックエンドの振り分け（設定ごとにプロセス内で共有し、失敗状況を引き継ぐ）"""
+    backends = {"whisper": LocalWhisperBackend(cpu_threads=cpu_threads)}
+    if gladia_api_key:
+        backends["gladia"] = get_gladia_client(gladia_api_key)
+    return TranscriptionRouter(backends, mode=mode, local_max_seconds=local_max_seconds)
+
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key, model_name=None, hedge=False):
+    """Geminiクライアント（APIキー・モデル・ヘッジの有無ごとにプロセス内で共有）"""
+    return GeminiFormatter(api_key, model_name, hedge=hedge)
+
+
+@st.cache_resource(show_spinner=False)
+def get_project_store():
+    """プロジェクトストア（プロセス内で共有）"""
+    return ProjectStore(os.getenv("PROJECTS_DB_PATH", DEFAULT_DB_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_index():
+    """過去の文字起こし・シナリオの検索インデックス（プロセス内で共有）"""
+    return SearchIndex(os.getenv("PROJECTS_DB_PATH", DEFAULT_DB_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_duplicate_index():
+    """似た入力の検出インデックス（プロセス内で共有）"""
+    return DuplicateIndex(os.getenv("PROJECTS_DB_PATH", DEFAULT_DB_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_text_store():
+    """セッション間で共有するテキストストア（同じ内容のテキストは1つだけ保持）"""
+    return TextStore(idle_seconds=float(os.getenv("TEXT_STORE_IDLE_SECONDS", "600")))
+
+
+def text(key):
+    """セッションに保存したテキスト（参照）を取得"""
+    return get_texts(get_text_store(), st.session_state.get(key))
+
+
+def set_text(key, value):
+    """テキストをテキストストアに保存し、セッションには参照だけを持つ"""
+    st.session_state[key] = put_texts(get_text_store(), value)
+
+
+def load_transcript():
+    """現在の入力の時刻付き文字起こし（動画以外の入力ではNone）"""
+    return Transcript.from_json(text("transcript_timings"))
+
+
+def page_outline(source_text, num_pages, transcript=None, speaker_names=None):
+    """書き直し前のテキストのページ割り（シナリオを再度書き直す場合はNone）"""
+    if not source_text or count_pages(source_text):
+        return None
+    return propose_pages(source_text, num_pages, transcript, speaker_names)
+
+
+def select_speaker_names(transcript, characters):
+    """
+    話者分離した話者とキャラクターの対応を選択（初期値は発話時間の長い話者が主人公）
+
+    Returns:
+        話者番号 -> キャラクター名（話者が1人以下なら空の辞書）
+    """
+    suggested = assign_speakers(transcript, characters)
+    if not suggested:
+        return {}
+    durations = transcript.speaker_durations()
+    names = [c["name"] for c in characters] + [None]
+    st.markdown("**話者の割り当て**（元の動画の話者をキャラクターに対応させます）")
+    columns = st.columns(len(durations))
+    speaker_names = {}
+    for column, speaker in zip(columns, sorted(durations)):
+        default = suggested.get(speaker)
+        with column:
+            name = st.selectbox(
+                f"話者{speaker + 1}（{durations[speaker]:.0f}秒）",
+                options=names,
+                index=names.index(default) if default in names else len(names) - 1,
+                format_func=lambda x: "割り当てない" if x is None else x,
+                key=f"speaker_map_{speaker}",
+            )
+        if name is not None:
+            speaker_names[speaker] = name
+    return speaker_names
+
+
+def source_key(data):
+    """入力（ファイル・テキスト）のハッシュ。同じ入力のプロジェクト検索に使用"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def character_set_label(characters):
+    """キャラクター構成（主人公が先頭）"""
+    return " / ".join(c["name"] for c in characters)
+
+
+def start_project(source_type, key, filename):
+    """入力ごとに新しいプロジェクトを作成"""
+    st.session_state.project_id = get_project_store().create_project(
+        filename=filename or "output",
+        source_type=source_type,
+        source_key=key,
+        character_set=character_set_label(st.session_state.characters),
+    )
+
+
+def record_artifact(kind, content, meta=None, filename=None):
+    """パイプラインの各段階の成果物を現在のプロジェクトに保存"""
+    project_id = st.session_state.get("project_id")
+    if project_id is None or not content:
+        return
+    store = get_project_store()
+    store.save_artifact(project_id, kind, content, meta)
+    store.update_project(project_id, filename=filename)
+    if kind == "transcribed_text":
+        get_duplicate_index().add_text(project_id, content)
+    if kind in SEARCHABLE_ARTIFACTS:
+        get_search_index().add(f"project:{project_id}:{kind}", SEARCHABLE_ARTIFACTS[kind],
+                               filename or st.session_state.filename or "output", content, project_id)
+
+
+def find_stored_duplicate(stage, transcript=None, fingerprint=None):
+    """
+    似た入力の保存済みプロジェクト（整形済みテキストかシナリオがあるもの）を検索
+
+    Returns:
+        project_id, similarity, filename の辞書（見つからなければNone）
+    """
+    index = get_duplicate_index()
+    exclude = st.session_state.get("project_id")
+    if fingerprint is not None:
+        matches = index.find_audio(fingerprint, exclude=exclude)
+    else:
+        matches = index.find_text(transcript, exclude=exclude)
+    store = get_project_store()
+    for match in matches:
+        project = store.project_summary(match["project_id"])
+        if project and {"formatted_text", "adopted_scenario"} & project["artifact_kinds"]:
+            metrics.count("duplicate_hits", "app", stage)
+            return {**match, "filename": project["filename"]}
+    return None
+
+
+def find_same_source(key):
+    """
+    同じ入力（URL）から作成した保存済みプロジェクト（整形済みテキストかシナリオがあるもの）
+
+    Returns:
+        project_id, similarity, filename の辞書（見つからなければNone）
+    """
+    store = get_project_store()
+    project = store.find_by_source(key)
+    if project is None or project["id"] == st.session_state.get("project_id"):
+        return None
+    summary = store.project_summary(project["id"])
+    if summary and {"formatted_text", "adopted_scenario"} & summary["artifact_kinds"]:
+        metrics.count("duplicate_hits", "app", "url")
+        return {"project_id": project["id"], "similarity": 1.0, "filename": project["filename"]}
+    return None
+
+
+def url_filename(url):
+    """URLのファイル名部分（なければホスト名）"""
+    parts = urllib.parse.urlsplit(url)
+    name = os.path.splitext(os.path.basename(urllib.parse.unquote(parts.path.rstrip("/"))))[0]
+    return name or parts.hostname
+
+
+def diarization_options(prefix=""):
+    """話者分離の設定（2人以上の会話動画は話者を区別して、セリフをキャラクターに割り当てる）"""
+    col_diarize, col_speakers = st.columns(2)
+    with col_diarize:
+        diarization = st.checkbox("話者を区別する（会話動画）", value=len(st.session_state.characters) > 1,
+                                  key=f"{prefix}diarization")
+    with col_speakers:
+        num_speakers = st.selectbox("話者数", options=[0, 2, 3, 4],
+                                    format_func=lambda x: "自動" if x == 0 else f"{x}人",
+                                    key=f"{prefix}num_speakers", disabled=not diarization)
+    return diarization, num_speakers or None
+
+
+def accept_transcript(transcript, source_type, key, filename, check_duplicates, progress_bar, fingerprint=None):
+    """
+    Gladia の文字起こし結果を保存して整形
+
+    似た文字起こしのプロジェクトが保存済みの場合は、整形の前に確認のため再実行する
+    """
+    transcribed = transcript.text
+    set_text("transcribed_text", transcribed)
+    # 発話ごとの時刻はページ割りに使う
+    set_text("transcript_timings", transcript.to_json() if len(transcript) else None)
+    start_project(source_type, key, filename)
+    record_artifact("transcript_timings", text("transcript_timings"))
+    if fingerprint:
+        get_duplicate_index().add_audio(st.session_state.project_id, fingerprint)
+    match = find_stored_duplicate("transcript", transcript=transcribed) if check_duplicates else None
+    record_artifact("transcribed_text", transcribed)
+    if match:
+        st.session_state.duplicate_pending = {
+            "stage": "transcript", "key": key, "match": match, "source_type": source_type,
+            "project_id": st.session_state.project_id, "transcribed": transcribed,
+            "filename": filename,
+        }
+        st.rerun(scope="fragment")
+    format_transcript(source_type, transcribed, progress_bar=progress_bar)
+
+
+def format_transcript(source_type, transcribed, filename=None, progress_bar=None):
+    """文字起こし・読み込んだテキストを整形してファイル名を決める"""
+    def progress(value):
+        if progress_bar is not None:
+            progress_bar.progress(value)
+
+    if source_type in ("video", "url"):
+        progress(60)
+        formatted = gemini.format_text(transcribed)
+        if not formatted:
+            return
+        set_text("formatted_text", formatted)
+        progress(80)
+        filename = gemini.generate_filename(formatted)
+        st.session_state.filename = filename or "output"
+    else:
+        progress(40)
+        # Geminiで句読点追加＋句点改行の整形
+        formatted = gemini.format_text(transcribed) if gemini else None
+        set_text("formatted_text", formatted or transcribed)
+        progress(80)
+        st.session_state.filename = filename
+    record_artifact("formatted_text", text("formatted_text"), filename=st.session_state.filename)
+    progress(100)
+    st.success("Complete!")
+
+
+def record_rewrite(kind, content, meta):
+    """書き直し結果を保存し、プロジェクトのキャラクター構成を更新"""
+    record_artifact(kind, content, {"characters": meta["characters"], **meta["settings"]}, current_filename())
+    project_id = st.session_state.get("project_id")
+    if project_id is not None:
+        get_project_store().update_project(project_id, character_set=meta["characters"])
+
+
+def restore_project(project_id):
+    """保存済みプロジェクトを画面に読み込む（APIは呼ばない）"""
+    project = get_project_store().load_project(project_id)
+    if project is None:
+        return False
+    artifacts = project["artifacts"]
+    updated = project["artifact_updated_at"]
+    ss = st.session_state
+
+    # 編集中のウィジェット状態をクリアして読み込んだ内容を表示させる
+    for k in ["text_editor", "text_editor_widget", "filename_input", "rewritten_editor", "sns_content_editor"]:
+        if k in ss:
+            del ss[k]
+    for k in [k for k in ss.keys() if str(k).startswith("var_editor_")]:
+        del ss[k]
+
+    ss.project_id = project_id
+    ss.filename = project["filename"]
+    set_text("transcribed_text", artifacts.get("transcribed_text"))
+    set_text("transcript_timings", artifacts.get("transcript_timings"))
+    set_text("adopted_scenario", artifacts.get("adopted_scenario"))
+    set_text("formatted_text", text("adopted_scenario") or artifacts.get("formatted_text") or text("transcribed_text"))
+    set_text("generated_sns_content", artifacts.get("sns_content"))
+
+    # 書き直し結果は、採用より後に生成された最新のもののみ表示
+    set_text("rewritten_text", None)
+    set_text("rewrite_variations", None)
+    ss.selected_variation = None
+    adopted_at = updated.get("adopted_scenario", 0)
+    latest = max(("rewritten_text", "variations"), key=lambda k: updated.get(k, 0))
+    if updated.get(latest, 0) > adopted_at:
+        if latest == "rewritten_text":
+            set_text("rewritten_text", artifacts[latest])
+        else:
+            set_text("rewrite_variations", artifacts[latest])
+    return True
+
+
+# スナップショットに保存する作業状態（テキストはテキストストアの参照）
+SNAPSHOT_TEXT_FIELDS = ("transcribed_text", "transcript_timings", "formatted_text", "text_editor",
+                        "rewritten_text", "rewrite_variations", "adopted_scenario", "generated_sns_content")
+SNAPSHOT_FIELDS = ("filename", "filename_input", "project_id", "selected_variation", "sns_content_editor",
+                   "rewrite_politeness", "rewrite_emotion", "rewrite_style", "custom_instruction",
+                   "num_pages", "num_variations", "selected_questioners")
+
+
+@st.cache_resource(show_spinner=False)
+def get_snapshots():
+    """セッションのスナップショット（プロセス内で共有。起動時に古いものを削除）"""
+    snapshots = SessionSnapshots(os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR),
+                                 text_fields=SNAPSHOT_TEXT_FIELDS + ("sns_content_editor",))
+    snapshots.prune()
+    return snapshots
+
+
+def save_session_snapshot():
+    """
+    前回のスナップショットから変わった作業状態だけを保存
+
+    テキストもファイル名もまだない（設定の初期値だけの）セッションは保存しない（初回表示でファイルを作らない）
+    """
+    token = st.session_state.get("session_token")
+    if token is None:
+        return
+    values = {field: text(field) for field in SNAPSHOT_TEXT_FIELDS}
+    values.update({field: st.session_state.get(field) for field in SNAPSHOT_FIELDS})
+    if "snapshot_fingerprints" not in st.session_state and not any(
+            values[field] for field in SNAPSHOT_TEXT_FIELDS + ("filename", "filename_input", "project_id")):
+        return
+    st.session_state.snapshot_fingerprints = get_snapshots().save(
+        token, values, st.session_state.get("snapshot_fingerprints"))
+
+
+def restore_session_snapshot(token):
+    """スナップショットから作業状態を復元（APIは呼ばない）。復元した場合はTrue"""
+    restored = get_snapshots().load(token)
+    if restored is None:
+        return False
+    values, fingerprints = restored
+    for field, value in values.items():
+        if field in SNAPSHOT_TEXT_FIELDS:
+            set_text(field, value)
+        elif field in SNAPSHOT_FIELDS and value is not None:
+            st.session_state[field] = value
+    st.session_state.snapshot_fingerprints = fingerprints
+    return True
+
+
+def fragment_rerun():
+    """フラグメントだけが再実行されているか（スクリプト全体の再実行ではTrueにならない）"""
+    ctx = get_script_run_ctx()
+    return bool(ctx is not None and ctx.fragment_ids_this_run)
+
+
+def timed_section(name):
+    """
+    セクションの描画時間を記録するデコレータ（フラグメント単位の再実行時間の計測用）
+
+    フラグメントだけが再実行された場合は、描画後に作業状態のスナップショットも保存する
+    （スクリプト全体の再実行では、最後に1回だけ保存する）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe("app", f"section:{name}", time.perf_counter() - started)
+                if fragment_rerun():
+                    save_session_snapshot()
+        return wrapper
+    return decorator
+
+
+@st.cache_data(show_spinner=False)
+def character_card_html(char, index):
+    """キャラクターカードのHTML（内容が変わらない限り再生成しない）"""
+    is_protagonist = (index == 0)
+    if is_protagonist:
+        role_badge = '<span class="role-badge-protagonist">回答者・主人公</span>'
+        card_class = "char-card-protagonist"
+    else:
+        role_badge = '<span class="role-badge-questioner">質問者</span>'
+        card_class = "char-card"
+
+    return f"""<div class="{card_class}">
+<span class="char-number">#{index + 1}</span>
+<strong style="color: {'#00f2ea' if is_protagonist else '#fe2c55'}; font-size: 18px; margin-left: 8px;">{char['name']}</strong>
+{role_badge}
+<span style="color: #888; margin-left: 12px;">{char['gender']} / {char['age']}</span>
+<br><span style="color: #aaa;">見た目:</span> {char['appearance']}
+　<span style="color: #aaa;">雰囲気:</span> {char['atmosphere']}
+<br><span style="color: #aaa;">背景:</span> {char['background']}
+　<span style="color: #aaa;">口調:</span> {char['tone']}
+</div>"""
+
+
+def current_filename():
+    """セクション3で編集されたファイル名"""
+    return st.session_state.get("filename_input") or st.session_state.filename or "output"
+
+
+def rewrite_signature():
+    """書き直しの入力・設定（実行中の書き直しが古くなったかの判定に使用）"""
+    ss = st.session_state
+    return (
+        hash(text("text_editor")), ss.get("rewrite_politeness"), ss.get("rewrite_emotion"),
+        ss.get("rewrite_style"), ss.get("custom_instruction"),
+        tuple(c["name"] for c in ss.characters[:1]), tuple(ss.get("selected_questioners") or ()),
+        hash(ss.get("lead_templates")), ss.get("num_pages"), ss.get("num_variations"),
+    )
+
+
+def cancel_stale_jobs():
+    """テキストや設定が変わった実行中の生成ジョブを中止"""
+    jobs = st.session_state.jobs
+    if jobs.cancel_stale("rewrite", rewrite_signature()):
+        st.info("設定が変更されたため、実行中の書き直しを中止しました")
+    if jobs.cancel_stale("sns", hash(text("text_editor"))):
+        st.info("テキストが変更されたため、実行中のSNS生成を中止しました")
+
+
+# 実行中のジョブの完了を確認する間隔（秒）
+JOB_POLL_SECONDS = 0.5
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_status(kind, label):
+    """
+    実行中のジョブの経過表示（このフラグメントだけが定期的に再実行される）
+
+    完了したらページを再実行し、ジョブを開始したセクションで結果を反映させる
+    """
+    job = st.session_state.jobs.get(kind)
+    if job is None or job.done():
+        st.rerun()
+    st.info(f"{label}... {job.elapsed():.0f}秒経過（CANCELで中止）")
+
+
+def wait_for_job(kind, label):
+    """
+    実行中の生成ジョブの状態を表示し、完了していれば取り出す（CANCELボタンで中止可能）
+
+    実行中はスクリプトを止めずに経過表示だけを定期的に更新するので、他のセクションの操作で
+    再実行されても、完了した時点で結果が反映される
+
+    Returns:
+        完了したジョブ（実行中・実行中のジョブがない・中止した場合はNone）
+    """
+    jobs = st.session_state.jobs
+    job = jobs.get(kind)
+    if job is None:
+        return None
+    if not job.done():
+        if st.button("CANCEL", key=f"cancel_{kind}"):
+            jobs.cancel(kind)
+            st.warning(f"{label}を中止しました")
+            return None
+        job_status(kind, label)
+        return None
+    return jobs.pop(kind)
 
 
 # ページ設定
@@ -394,21 +902,23 @@ st.markdown("""
 
 # セッションステートの初期化
 if 'transcribed_text' not in st.session_state:
-    st.session_state.transcribed_text = None
+    set_text("transcribed_text", None)
 if 'formatted_text' not in st.session_state:
-    st.session_state.formatted_text = None
+    set_text("formatted_text", None)
 if 'filename' not in st.session_state:
     st.session_state.filename = None
 if 'rewritten_text' not in st.session_state:
-    st.session_state.rewritten_text = None
+    set_text("rewritten_text", None)
 if 'rewrite_variations' not in st.session_state:
-    st.session_state.rewrite_variations = None
+    set_text("rewrite_variations", None)
 if 'selected_variation' not in st.session_state:
     st.session_state.selected_variation = None
 if 'adopted_scenario' not in st.session_state:
-    st.session_state.adopted_scenario = None
+    set_text("adopted_scenario", None)
 if 'generated_sns_content' not in st.session_state:
-    st.session_state.generated_sns_content = None
+    set_text("generated_sns_content", None)
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = JobTracker()  # 実行中の生成リクエスト
 if 'characters' not in st.session_state:
     st.session_state.characters = load_characters()  # JSONファイルから読み込み
 if 'closing_text' not in st.session_state or 'lead_templates' not in st.session_state:
@@ -443,6 +953,17 @@ if 'closing_text' not in st.session_state or 'lead_templates' not in st.session_
 
 ・「次が決まっていないのにお金がない」という不安は、焦りを生み、ブラック企業への誤入社を招くリスクがあります。しかし、会社を辞めた後に使える国の公的制度をフル活用すれば、数ヶ月から1年は生活費の心配を減らすことが可能です。経済的な余裕は、精神的な「盾」となります。目先の生活に追われず、じっくり会社を見極める時間を確保することで、変な会社に捕まらずに納得のいく再就職を目指せます。"""
 
+# セッショントークン（URLの ?session=）。サーバーが再起動しても同じURLで作業状態を復元できる
+if 'session_token' not in st.session_state:
+    token = st.query_params.get("session")
+    if valid_token(token):
+        if restore_session_snapshot(token):
+            st.toast("前回の作業状態を復元しました")
+    else:
+        token = new_token()
+        st.query_params["session"] = token
+    st.session_state.session_token = token
+
 # API設定（折りたたみ式）- タイトルの上に配置
 with st.expander("API設定", expanded=False):
     # プレースホルダーテキストは空白として扱う
@@ -471,227 +992,543 @@ with st.expander("API設定", expanded=False):
 
     st.markdown('テキスト入力のみの場合、Gladia APIは不要です')
 
+    hedge_requests = st.toggle("遅い応答に同じリクエストをもう1つ送る（整形・ファイル名生成）", value=False,
+                               key="hedge_requests",
+                               help="普段の応答時間（直近の90%）を超えたら同じリクエストを送り、先に返った方を使います。"
+                                    "追加のリクエストは全体の1割までです")
+
+    # 文字起こしエンジン（短いクリップはローカルのWhisperで処理するとアップロード・待ち時間がない）
+    engine_col, threads_col, local_max_col = st.columns(3)
+    with engine_col:
+        transcription_engine = st.selectbox("文字起こしエンジン", list(TRANSCRIPTION_ENGINES),
+                                            format_func=TRANSCRIPTION_ENGINES.get, key="transcription_engine")
+    with threads_col:
+        whisper_threads = st.number_input("Whisperのスレッド数", min_value=1, max_value=64,
+                                          value=os.cpu_count() or 4, step=1, key="whisper_threads")
+    with local_max_col:
+        local_max_seconds = st.number_input("ローカルで処理する長さ（秒以下）", min_value=0, max_value=3600,
+                                            value=90, step=10, key="local_max_seconds")
+    if not LocalWhisperBackend.installed():
+        st.caption("ローカル Whisper を使うには faster-whisper をインストールしてください（pip install faster-whisper）。"
+                   "未インストールの場合はGladiaで文字起こしします")
+    router = get_transcription_router(gladia_api_key, transcription_engine, whisper_threads, local_max_seconds)
+    st.dataframe(
+        [{
+            "エンジン": TRANSCRIPTION_ENGINES.get(r["backend"], r["backend"]),
+            "利用可能": "○" if r["available"] else "×",
+            "状態": "正常" if r["healthy"] else f"停止中（あと{r['retry_in']:.0f}秒）",
+            "連続失敗": r["failures"],
+        } for r in router.health()],
+        hide_index=True,
+    )
+
+    # APIごとのサーキットブレーカー（障害が続いている間は呼び出さずにすぐ失敗させる）
+    breaker_rows = breakers.snapshot()
+    if breaker_rows:
+        st.markdown("**API接続状態**")
+        st.dataframe(
+            [{
+                "API": r["name"],
+                "状態": breaker_state_label(r),
+                "直近の呼び出し": r["calls"],
+                "失敗率": f"{r['failure_rate']:.0%}",
+            } for r in breaker_rows],
+            hide_index=True,
+        )
+
+    # API呼び出しの計測結果
+    metrics_rows = metrics.summary()
+    if metrics_rows:
+        st.markdown("**API計測（直近の呼び出し）**")
+        st.dataframe(
+            [{
+                "API": f"{r['backend']}.{r['method']}",
+                "回数": r["calls"],
+                "エラー": r["errors"],
+                "p50(秒)": round(r["p50"], 2),
+                "p95(秒)": round(r["p95"], 2),
+                "入力トークン": r["prompt_tokens"],
+                "出力トークン": r["response_tokens"],
+                "同時呼び出しの共有": r["coalesced"],
+                "ヘッジ": r["hedged"],
+            } for r in metrics_rows],
+            hide_index=True,
+        )
+        st.download_button(
+            label="DOWNLOAD METRICS",
+            data=metrics.to_prometheus(),
+            file_name="metrics.prom",
+            mime="text/plain",
+            key="download_metrics"
+        )
+
+    # セッションのテキストの保持状況
+    text_stats = get_text_store().stats()
+    st.caption(f"テキストストア: {text_stats['texts']}件 / {text_stats['chars']:,}文字 → "
+               f"{text_stats['stored_bytes'] / 1024:,.0f}KB（退避 {text_stats['spilled']}件）")
+
+    # 起動プロファイル（遅延読み込みしたモジュールと読み込み時間）
+    with st.popover("起動プロファイル"):
+        loaded = lazy_import_times()
+        if loaded:
+            st.markdown("**遅延読み込み済みモジュール**")
+            st.dataframe([{"モジュール": r["module"], "読み込み(ms)": round(r["ms"])} for r in loaded],
+                         hide_index=True)
+        else:
+            st.markdown("Gemini SDK・HTTPクライアントはまだ読み込まれていません")
+        if st.button("読み込み時間を計測（-X importtime）", key="run_importtime"):
+            with st.spinner("計測中..."):
+                rows = importtime_report(["streamlit", "utils.text_formatter", "utils.transcription",
+                                          "google.generativeai", "httpx"])
+            st.dataframe([{"モジュール": r["module"], "累積(ms)": round(r["cumulative_ms"], 1),
+                           "単体(ms)": round(r["self_ms"], 1)} for r in rows], hide_index=True)
+
 # タイトル
 st.markdown('<h1 translate="no">TikTok Scenario Rewriter</h1>', unsafe_allow_html=True)
 st.markdown("キャラ設定 → 入力 → 整形 → 誘導文設定 → **AI書き直し** → SNS生成 → DL")
 
-# APIクライアントの初期化
-gladia = GladiaAPI(gladia_api_key) if gladia_api_key else None
-gemini = GeminiFormatter(gemini_api_key) if gemini_api_key else None
+# APIクライアントの取得（再実行ごとに作り直さず、キャッシュ済みのものを使う）
+gladia = get_gladia_client(gladia_api_key) if gladia_api_key else None
+gemini = get_gemini_client(gemini_api_key, hedge=hedge_requests) if gemini_api_key else None
+
+# 障害で停止中のAPI（呼び出しはすぐ失敗するか、代替に切り替わる）
+for breaker_row in breakers.snapshot():
+    if breaker_row["state"] == OPEN:
+        fallback = "代替モデルで生成します" if breaker_row["name"].startswith("gemini") else "他に使える文字起こしエンジンがあればそちらを使います"
+        st.warning(f"{breaker_row['name']} は障害のため一時停止中です（あと{breaker_row['retry_in']:.0f}秒で再試行）。{fallback}")
 
 # ===========================================
-# セクション1: キャラクター設定
+# 過去のプロジェクト
 # ===========================================
-st.header("1. キャラクター設定")
-st.markdown("最大5人のキャラクターを登録できます。**最初に登録した人物が回答者（主人公）**になります。2人目以降は質問者です。")
-
-# --- 登録済みキャラクター表示 ---
-if st.session_state.characters:
-    st.subheader(f"登録済みキャラクター（{len(st.session_state.characters)}人）")
-    for i, char in enumerate(st.session_state.characters):
-        is_protagonist = (i == 0)
-        if is_protagonist:
-            role_badge = '<span class="role-badge-protagonist">回答者・主人公</span>'
-            card_class = "char-card-protagonist"
-        else:
-            role_badge = '<span class="role-badge-questioner">質問者</span>'
-            card_class = "char-card"
+@st.fragment
+@timed_section("projects")
+def render_projects():
+    """保存済みプロジェクトの検索・読み込み"""
+    with st.expander("過去のプロジェクト", expanded=False):
+        store = get_project_store()
+        col_f, col_d, col_c = st.columns([2, 1, 2])
+        with col_f:
+            filename_filter = st.text_input("ファイル名", key="project_filter_filename")
+        with col_d:
+            period = st.selectbox("期間", ["すべて", "今日", "7日以内", "30日以内"], key="project_filter_period")
+        with col_c:
+            character_set = st.selectbox("キャラクター構成", ["すべて"] + store.character_sets(),
+                                         key="project_filter_characters")
+
+        days = {"今日": 1, "7日以内": 7, "30日以内": 30}.get(period)
+        projects = store.list_projects(
+            filename=filename_filter.strip() or None,
+            since=time.time() - days * 86400 if days else None,
+            character_set=None if character_set == "すべて" else character_set,
+        )
+        if not projects:
+            st.info("保存済みのプロジェクトはありません")
+            return
+
+        selected = st.selectbox(
+            "プロジェクト",
+            options=[p["id"] for p in projects],
+            format_func=lambda pid: next(
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(p['updated_at']))}  {p['filename']}"
+                + (f"（{p['character_set']}）" if p["character_set"] else "")
+                for p in projects if p["id"] == pid
+            ),
+            key="project_select"
+        )
+        if st.button("LOAD", key="load_project_btn"):
+            if restore_project(selected):
+                st.session_state.input_completed = True
+                st.rerun()
+            else:
+                st.error("プロジェクトの読み込みに失敗しました")
 
-        card_html = f"""<div class="{card_class}">
-<span class="char-number">#{i + 1}</span>
-<strong style="color: {'#00f2ea' if is_protagonist else '#fe2c55'}; font-size: 18px; margin-left: 8px;">{char['name']}</strong>
-{role_badge}
-<span style="color: #888; margin-left: 12px;">{char['gender']} / {char['age']}</span>
-<br><span style="color: #aaa;">見た目:</span> {char['appearance']}
-　<span style="color: #aaa;">雰囲気:</span> {char['atmosphere']}
-<br><span style="color: #aaa;">背景:</span> {char['background']}
-　<span style="color: #aaa;">口調:</span> {char['tone']}
-</div>"""
-        st.markdown(card_html, unsafe_allow_html=True)
-        if st.button(f"削除: {char['name']}", key=f"del_char_{i}"):
-            st.session_state.characters.pop(i)
-            save_characters(st.session_state.characters)
-            st.rerun()
-
-# --- 新規キャラクター登録フォーム ---
-if len(st.session_state.characters) < 5:
-    role_label = "回答者（主人公）" if len(st.session_state.characters) == 0 else "質問者"
-    st.subheader(f"キャラクター登録（次の登録は「{role_label}」になります）")
-
-    with st.form("char_register_form", clear_on_submit=True):
-        col_n, col_a, col_g = st.columns([2, 1, 1])
-        with col_n:
-            new_name = st.text_input("名前", placeholder="例：太郎")
-        with col_a:
-            new_age = st.selectbox("年代", ["10代", "20代", "30代", "40代", "50代", "60代以上"], index=1)
-        with col_g:
-            new_gender = st.selectbox("性別", ["男性", "女性", "その他"])
-
-        col_ap, col_at = st.columns(2)
-        with col_ap:
-            new_appearance = st.text_input("見た目", placeholder="例：短髪、メガネ、スーツ姿")
-        with col_at:
-            new_atmosphere = st.text_input("雰囲気", placeholder="例：明るく元気、頼れる兄貴")
-
-        col_bg, col_tn = st.columns(2)
-        with col_bg:
-            new_background = st.text_input("背景", placeholder="例：IT企業の新入社員、趣味はゲーム")
-        with col_tn:
-            new_tone = st.text_input("口調", placeholder="例：タメ口、テンション高め、語尾に「っす」")
-
-        submitted = st.form_submit_button("REGISTER")
-
-    if submitted:
-        if not new_name.strip():
-            st.error("名前を入力してください")
-        elif any(c["name"] == new_name.strip() for c in st.session_state.characters):
-            st.error(f"「{new_name.strip()}」は既に登録されています")
-        else:
-            st.session_state.characters.append({
-                "name": new_name.strip(),
-                "age": new_age,
-                "gender": new_gender,
-                "appearance": new_appearance.strip(),
-                "atmosphere": new_atmosphere.strip(),
-                "background": new_background.strip(),
-                "tone": new_tone.strip(),
-            })
-            save_characters(st.session_state.characters)
-            st.rerun()
-else:
-    st.info("キャラクター登録の上限（5人）に達しています。追加するには既存のキャラクターを削除してください。")
 
-# ===========================================
-# セクション2: 入力ソース選択
-# ===========================================
-st.header("2. 入力ソース選択")
+render_projects()
+
+
+@st.fragment
+@timed_section("sns_batch")
+def render_sns_batch():
+    """保存済みプロジェクトの採用済みシナリオから、SNSコンテンツをまとめて生成"""
+    with st.expander("SNSコンテンツの一括生成", expanded=False):
+        # 一覧の取得は使うときだけ（再実行のたびにDBを読まない）
+        if st.toggle("採用済みシナリオのあるプロジェクトを表示", key="sns_batch_open"):
+            store = get_project_store()
+            only_missing = st.checkbox("SNSコンテンツが未作成のものだけ", value=True, key="sns_batch_only_missing")
+            projects = store.projects_with_artifact("adopted_scenario", "sns_content" if only_missing else None)
+            if not projects:
+                st.info("対象のプロジェクトはありません")
+            else:
+                names = {p["id"]: f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(p['updated_at']))}"
+                                  f"  {p['filename']}" for p in projects}
+                options = list(names)
+                selected = st.multiselect("プロジェクト", options=options, default=options, format_func=names.get,
+                                          key="sns_batch_select")
+                st.caption(f"{GeminiFormatter.METADATA_BATCH_SIZE}件ずつ1回のリクエストにまとめて生成します"
+                           "（まとめて生成できなかったものは1件ずつ生成し直します）")
+
+                if st.button("GENERATE SNS（一括）", key="sns_batch_btn"):
+                    scenarios = store.latest_contents(selected, "adopted_scenario")
+                    project_ids = [i for i in selected if scenarios.get(i)]
+                    if not gemini_api_key:
+                        st.error("API設定でGemini APIキーを入力してください")
+                    elif not project_ids:
+                        st.error("プロジェクトを選択してください")
+                    else:
+                        st.session_state.jobs.start(
+                            "sns_batch", tuple(project_ids),
+                            gemini.generate_metadata_batch_async([scenarios[i] for i in project_ids]),
+                            meta={"project_ids": project_ids})
+
+        job = wait_for_job("sns_batch", "SNSコンテンツを一括生成中")
+        if job is not None and not job.cancelled():
+            project_ids = job.meta["project_ids"]
+            succeeded = 0
+            for project_id, content in zip(project_ids, job.result()):
+                if content:
+                    get_project_store().save_artifact(project_id, "sns_content", content)
+                    succeeded += 1
+            if succeeded:
+                st.success(f"{succeeded}/{len(project_ids)}件のSNSコンテンツを生成しました")
+            if succeeded < len(project_ids):
+                st.error(f"{len(project_ids) - succeeded}件のSNSコンテンツの生成に失敗しました")
+
+
+render_sns_batch()
+
+
+@st.fragment
+@timed_section("search")
+def render_search():
+    """過去の文字起こし・シナリオの全文検索"""
+    with st.expander("過去の文字起こし・シナリオを検索", expanded=False):
+        index = get_search_index()
+        col_q, col_k = st.columns([3, 1])
+        with col_q:
+            query = st.text_input("キーワード（スペース区切りで絞り込み）", key="search_query",
+                                  placeholder="例：給付金 申請")
+        with col_k:
+            kind = st.selectbox("種類", [None, "transcript", "scenario"],
+                                format_func=lambda k: {None: "すべて", "transcript": "文字起こし",
+                                                       "scenario": "採用シナリオ"}[k],
+                                key="search_kind")
+        if not query.strip():
+            st.caption(f"インデックス済み: {index.count()}件")
+            return
+
+        started = time.perf_counter()
+        results = index.search(query, kind=kind)
+        st.caption(f"{len(results)}件（{(time.perf_counter() - started) * 1000:.0f}ms）")
+        for i, r in enumerate(results):
+            label = "採用シナリオ" if r["kind"] == "scenario" else "文字起こし"
+            st.markdown(f"**{r['title']}**（{label}）  \n{r['snippet']}")
+            if r["project_id"] is not None and st.button("LOAD", key=f"search_load_{i}"):
+                if restore_project(r["project_id"]):
+                    st.session_state.input_completed = True
+                    st.rerun()
+                else:
+                    st.error("プロジェクトの読み込みに失敗しました")
 
-tab1, tab2, tab3 = st.tabs(["動画から生成", "ファイルから生成", "テキスト入力"])
 
-with tab1:
-    st.subheader("動画アップロード")
+render_search()
 
-    uploaded_file = st.file_uploader(
-        "動画ファイルを選択してください",
-        type=["mp4", "mov", "avi", "mkv", "webm"],
-        key="video_uploader"
-    )
+# ===========================================
+# セクション1: キャラクター設定
+# ===========================================
+@st.fragment
+@timed_section("characters")
+def render_characters():
+    """セクション1: キャラクター設定"""
+    st.header("1. キャラクター設定")
+    st.markdown("最大5人のキャラクターを登録できます。**最初に登録した人物が回答者（主人公）**になります。2人目以降は質問者です。")
 
-    if uploaded_file is not None:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_file_path = tmp_file.name
+    for error in storage_errors():
+        st.error(f"保存ファイルエラー: {error}")
 
-        st.info(f"アップロードされたファイル: {uploaded_file.name}")
+    # --- 登録済みキャラクター表示 ---
+    if st.session_state.characters:
+        st.subheader(f"登録済みキャラクター（{len(st.session_state.characters)}人）")
+        for i, char in enumerate(st.session_state.characters):
+            st.markdown(character_card_html(char, i), unsafe_allow_html=True)
+            if st.button(f"削除: {char['name']}", key=f"del_char_{i}"):
+                st.session_state.characters = delete_character(char["name"])
+                st.rerun()
 
-        if st.button("START", key="transcribe_btn"):
-            if not gladia_api_key or not gemini_api_key:
-                st.error("API設定でGladia APIキーとGemini APIキーを入力してください")
-                st.stop()
+    # --- 新規キャラクター登録フォーム ---
+    if len(st.session_state.characters) < 5:
+        role_label = "回答者（主人公）" if len(st.session_state.characters) == 0 else "質問者"
+        st.subheader(f"キャラクター登録（次の登録は「{role_label}」になります）")
+
+        with st.form("char_register_form", clear_on_submit=True):
+            col_n, col_a, col_g = st.columns([2, 1, 1])
+            with col_n:
+                new_name = st.text_input("名前", placeholder="例：太郎")
+            with col_a:
+                new_age = st.selectbox("年代", ["10代", "20代", "30代", "40代", "50代", "60代以上"], index=1)
+            with col_g:
+                new_gender = st.selectbox("性別", ["男性", "女性", "その他"])
+
+            col_ap, col_at = st.columns(2)
+            with col_ap:
+                new_appearance = st.text_input("見た目", placeholder="例：短髪、メガネ、スーツ姿")
+            with col_at:
+                new_atmosphere = st.text_input("雰囲気", placeholder="例：明るく元気、頼れる兄貴")
+
+            col_bg, col_tn = st.columns(2)
+            with col_bg:
+                new_background = st.text_input("背景", placeholder="例：IT企業の新入社員、趣味はゲーム")
+            with col_tn:
+                new_tone = st.text_input("口調", placeholder="例：タメ口、テンション高め、語尾に「っす」")
+
+            submitted = st.form_submit_button("REGISTER")
+
+        if submitted:
+            if not new_name.strip():
+                st.error("名前を入力してください")
+            elif any(c["name"] == new_name.strip() for c in st.session_state.characters):
+                st.error(f"「{new_name.strip()}」は既に登録されています")
+            else:
+                st.session_state.characters = add_character({
+                    "name": new_name.strip(),
+                    "age": new_age,
+                    "gender": new_gender,
+                    "appearance": new_appearance.strip(),
+                    "atmosphere": new_atmosphere.strip(),
+                    "background": new_background.strip(),
+                    "tone": new_tone.strip(),
+                })
+                st.rerun()
+    else:
+        st.info("キャラクター登録の上限（5人）に達しています。追加するには既存のキャラクターを削除してください。")
 
-            progress_bar = st.progress(0)
 
-            progress_bar.progress(10)
-            audio_url = gladia.upload_file(tmp_file_path)
 
-            if audio_url:
-                progress_bar.progress(30)
-                transcribed = gladia.transcribe(audio_url, language="ja")
+render_characters()
 
-                if transcribed:
-                    st.session_state.transcribed_text = transcribed
-                    progress_bar.progress(60)
-                    formatted = gemini.format_text(transcribed)
+# ===========================================
+# セクション2: 入力ソース選択
+# ===========================================
+@st.fragment
+@timed_section("input_sources")
+def render_input_sources():
+    """セクション2: 入力ソース選択"""
+    st.header("2. 入力ソース選択")
+
+    # 入力完了後の再実行で完了メッセージを表示
+    if st.session_state.pop("input_completed", False):
+        st.success("Complete!")
+    formatted_before = st.session_state.get("formatted_text")
+
+    # 似た入力が保存済みの場合は、APIを呼ぶ前に保存済みの結果を使うか確認する
+    pending = st.session_state.get("duplicate_pending")
+    if pending:
+        match = pending["match"]
+        if pending["stage"] == "url":
+            st.warning(f"同じURLを処理したプロジェクトが見つかりました: {match['filename']}")
+        else:
+            target = "音声" if pending["stage"] == "audio" else "文字起こし"
+            st.warning(f"{target}が似たプロジェクトが見つかりました: {match['filename']}（類似度 {match['similarity']:.0%}）")
+        col_use, col_new = st.columns(2)
+        with col_use:
+            if st.button("保存済みの結果を使う", key="use_duplicate"):
+                del st.session_state.duplicate_pending
+                if restore_project(match["project_id"]):
+                    metrics.count("duplicate_reuses", "app", pending["stage"])
+                    st.session_state.input_completed = True
+                    st.rerun()
+                st.error("プロジェクトの読み込みに失敗しました")
+        with col_new:
+            if st.button("新しく処理する", key="ignore_duplicate"):
+                del st.session_state.duplicate_pending
+                st.session_state.duplicate_ignored = pending["key"]
+                if pending["stage"] in ("audio", "url"):
+                    # アップロード済みの動画・入力済みのURLで文字起こしから再開
+                    st.session_state["resume_video" if pending["stage"] == "audio" else "resume_url"] = True
+                    st.rerun(scope="fragment")
+                else:
+                    st.session_state.project_id = pending["project_id"]
+                    set_text("transcribed_text", pending["transcribed"])
+                    with st.spinner("整形中..."):
+                        format_transcript(pending["source_type"], pending["transcribed"], pending["filename"])
 
-                    if formatted:
-                        st.session_state.formatted_text = formatted
-                        progress_bar.progress(80)
-                        filename = gemini.generate_filename(formatted)
-                        st.session_state.filename = filename or "output"
-                        progress_bar.progress(100)
-                        st.success("Complete!")
+    tab1, tab_url, tab2, tab3 = st.tabs(["動画から生成", "URLから生成", "ファイルから生成", "テキスト入力"])
 
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
+    with tab1:
+        st.subheader("動画アップロード")
 
-with tab2:
-    st.subheader("テキストファイルアップロード")
+        uploaded_file = st.file_uploader(
+            "動画ファイルを選択してください",
+            type=["mp4", "mov", "avi", "mkv", "webm"],
+            key="video_uploader"
+        )
 
-    text_file = st.file_uploader(
-        "テキストファイルを選択してください (.txt)",
-        type=["txt"],
-        key="text_file_uploader"
-    )
+        if uploaded_file is not None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_file:
+                tmp_file.write(uploaded_file.read())
+                tmp_file_path = tmp_file.name
 
-    if text_file is not None:
-        st.info(f"アップロードされたファイル: {text_file.name}")
+            st.info(f"アップロードされたファイル: {uploaded_file.name}")
+            diarization, num_speakers = diarization_options()
+            if diarization and transcription_engine == "whisper":
+                st.caption("ローカル Whisper は話者分離に対応していないため、話者ラベルは付きません")
 
-        if st.button("START", key="text_process_btn"):
+            # 確認のための再実行（st.rerun）でも一時ファイルを削除する
             try:
-                progress_bar = st.progress(0)
-
-                progress_bar.progress(20)
-                raw_text = text_file.read().decode('utf-8', errors='replace')
-
-                if raw_text.strip():
-                    st.session_state.transcribed_text = raw_text
-                    progress_bar.progress(40)
-
-                    # Geminiで句読点追加＋句点改行の整形
-                    if gemini:
-                        formatted_text = gemini.format_text(raw_text)
-                        if formatted_text:
-                            st.session_state.formatted_text = formatted_text
-                        else:
-                            st.session_state.formatted_text = raw_text
+                if st.button("START", key="transcribe_btn") or st.session_state.pop("resume_video", False):
+                    if not gemini_api_key or not router.order(None, diarization):
+                        st.error("API設定でGladia APIキーとGemini APIキーを入力してください"
+                                 "（ローカル Whisper の場合は faster-whisper とGemini APIキー）")
+                        st.stop()
+
+                    video_key = source_key(uploaded_file.getvalue())
+                    check_duplicates = st.session_state.get("duplicate_ignored") != video_key
+                    fingerprint = audio_fingerprint(tmp_file_path)
+                    match = find_stored_duplicate("audio", fingerprint=fingerprint) if fingerprint and check_duplicates else None
+                    if match:
+                        st.session_state.duplicate_pending = {"stage": "audio", "key": video_key, "match": match}
+                        st.rerun(scope="fragment")
+
+                    progress_bar = st.progress(0)
+
+                    progress_bar.progress(10)
+                    transcript, engine = router.transcribe_file(tmp_file_path, language="ja", diarization=diarization,
+                                                                num_speakers=num_speakers)
+
+                    if transcript is not None:
+                        progress_bar.progress(30)
+                        st.toast(f"文字起こしエンジン: {TRANSCRIPTION_ENGINES.get(engine, engine)}")
+                        accept_transcript(transcript, "video", video_key,
+                                          os.path.splitext(uploaded_file.name)[0], check_duplicates,
+                                          progress_bar, fingerprint)
                     else:
-                        st.session_state.formatted_text = raw_text
-                    progress_bar.progress(80)
+                        st.error("文字起こしに失敗しました")
+            finally:
+                if os.path.exists(tmp_file_path):
+                    os.unlink(tmp_file_path)
+
+    with tab_url:
+        st.subheader("URLから生成")
+        st.caption("公開されている動画・音声のURLを指定すると、Gladiaが直接取得して文字起こしします（ダウンロード・アップロード不要）")
+
+        media_url = st.text_input("動画・音声のURL", placeholder="https://...", key="media_url_input")
+        url_diarization, url_num_speakers = diarization_options("url_")
 
-                    filename = os.path.splitext(text_file.name)[0]
-                    st.session_state.filename = filename
-                    progress_bar.progress(100)
-                    st.success("Complete!")
+        if st.button("START", key="url_transcribe_btn") or st.session_state.pop("resume_url", False):
+            url = normalize_media_url(media_url)
+            if not gladia_api_key or not gemini_api_key:
+                st.error("API設定でGladia APIキーとGemini APIキーを入力してください")
+            elif url is None:
+                metrics.count("invalid_url", "app", "url")
+                st.error("http:// または https:// で始まる公開URLを入力してください")
+            else:
+                url_key = source_key(url)
+                check_duplicates = st.session_state.get("duplicate_ignored") != url_key
+                # 同じURLを処理済みなら、文字起こしの前に保存済みの結果を使うか確認する
+                match = find_same_source(url_key) if check_duplicates else None
+                if match:
+                    st.session_state.duplicate_pending = {"stage": "url", "key": url_key, "match": match}
+                    st.rerun(scope="fragment")
+
+                progress_bar = st.progress(10)
+                transcript = gladia.transcribe_detailed(url, language="ja", diarization=url_diarization,
+                                                        num_speakers=url_num_speakers)
+                if transcript is not None and transcript.text:
+                    progress_bar.progress(50)
+                    accept_transcript(transcript, "url", url_key, url_filename(url), check_duplicates, progress_bar)
                 else:
-                    st.error("テキストファイルが空です")
-            except Exception as e:
-                st.error(f"テキスト読み込みエラー: {str(e)}")
-
-with tab3:
-    st.subheader("テキストを直接入力")
-
-    direct_text = st.text_area(
-        "テキストを貼り付けてください（そのまま整形済みテキストとして使用します）",
-        height=250,
-        placeholder="ここにテキストを貼り付け...\n\n例：\n大暴露、退職前にもらえる給付金11選。\n国はゼニゲバなので、200万円以上得する情報は一切教えてくれません。",
-        key="direct_text_input"
-    )
+                    st.error("文字起こしに失敗しました。URLが公開されていて、動画・音声を直接取得できるか確認してください")
+
+    with tab2:
+        st.subheader("テキストファイルアップロード")
+
+        text_file = st.file_uploader(
+            "テキストファイルを選択してください (.txt)",
+            type=["txt"],
+            key="text_file_uploader"
+        )
+
+        if text_file is not None:
+            st.info(f"アップロードされたファイル: {text_file.name}")
+
+            if st.button("START", key="text_process_btn"):
+                try:
+                    progress_bar = st.progress(0)
+
+                    progress_bar.progress(20)
+                    raw_text = text_file.read().decode('utf-8', errors='replace')
+
+                    if raw_text.strip():
+                        set_text("transcribed_text", raw_text)
+                        set_text("transcript_timings", None)
+                        text_key = source_key(raw_text)
+                        filename = os.path.splitext(text_file.name)[0]
+                        start_project("text_file", text_key, filename)
+                        match = None
+                        if st.session_state.get("duplicate_ignored") != text_key:
+                            match = find_stored_duplicate("transcript", transcript=raw_text)
+                        record_artifact("transcribed_text", raw_text)
+                        if match:
+                            st.session_state.duplicate_pending = {
+                                "stage": "transcript", "key": text_key, "match": match, "source_type": "text_file",
+                                "project_id": st.session_state.project_id, "transcribed": raw_text,
+                                "filename": filename,
+                            }
+                            st.rerun(scope="fragment")
+                        format_transcript("text_file", raw_text, filename, progress_bar)
+                    else:
+                        st.error("テキストファイルが空です")
+                except Exception as e:
+                    st.error(f"テキスト読み込みエラー: {str(e)}")
+
+    with tab3:
+        st.subheader("テキストを直接入力")
+
+        direct_text = st.text_area(
+            "テキストを貼り付けてください（そのまま整形済みテキストとして使用します）",
+            height=250,
+            placeholder="ここにテキストを貼り付け...\n\n例：\n大暴露、退職前にもらえる給付金11選。\n国はゼニゲバなので、200万円以上得する情報は一切教えてくれません。",
+            key="direct_text_input"
+        )
+
+        if st.button("START", key="direct_text_btn"):
+            if direct_text.strip():
+                set_text("transcribed_text", direct_text)
+                set_text("transcript_timings", None)
+                set_text("formatted_text", direct_text)
 
-    if st.button("START", key="direct_text_btn"):
-        if direct_text.strip():
-            st.session_state.transcribed_text = direct_text
-            st.session_state.formatted_text = direct_text
+                # ファイル名生成
+                if gemini:
+                    filename = gemini.generate_filename(direct_text)
+                    st.session_state.filename = filename or "output"
+                else:
+                    clean = direct_text.strip().replace('\n', '')[:20]
+                    st.session_state.filename = clean if clean else "output"
+                start_project("direct_text", source_key(direct_text), st.session_state.filename)
+                record_artifact("formatted_text", direct_text)
 
-            # ファイル名生成
-            if gemini:
-                filename = gemini.generate_filename(direct_text)
-                st.session_state.filename = filename or "output"
+                st.success("Complete!")
             else:
-                clean = direct_text.strip().replace('\n', '')[:20]
-                st.session_state.filename = clean if clean else "output"
+                st.error("テキストを入力してください")
 
-            st.success("Complete!")
-        else:
-            st.error("テキストを入力してください")
+    # 整形済みテキストが更新されたらページ全体を再実行してセクション3以降に反映
+    if st.session_state.get("formatted_text") is not formatted_before:
+        st.session_state.input_completed = True
+        st.rerun()
+
+
+render_input_sources()
 
 # ===========================================
 # セクション3: 整形済みテキスト表示・編集
 # ===========================================
-if st.session_state.formatted_text:
+@st.fragment
+@timed_section("text_editor")
+def render_text_editor():
+    """セクション3: 整形済みテキスト表示・編集"""
     st.header("3. テキスト編集")
 
     if "text_editor" not in st.session_state:
-        st.session_state.text_editor = st.session_state.formatted_text
+        set_text("text_editor", text("formatted_text"))
 
     if "filename" not in st.session_state or not st.session_state.filename:
         st.session_state.filename = "output"
@@ -700,12 +1537,13 @@ if st.session_state.formatted_text:
     # text_areaの値を明示的に取得して保存
     current_text = st.text_area(
         "整形されたテキスト（編集可能）",
-        value=st.session_state.get("text_editor", st.session_state.formatted_text),
+        value=text("text_editor"),
         height=400,
         key="text_editor_widget"
     )
     # 編集されたテキストをセッションに保存
-    st.session_state.text_editor = current_text
+    set_text("text_editor", current_text)
+    cancel_stale_jobs()
 
     st.download_button(
         label="DOWNLOAD TEXT",
@@ -716,11 +1554,16 @@ if st.session_state.formatted_text:
     )
 
     # ファイル名入力
-    final_filename = st.text_input("ファイル名（編集可能）", value=st.session_state.filename, key="filename_input")
+    st.text_input("ファイル名（編集可能）", value=st.session_state.filename, key="filename_input")
 
-    # ===========================================
-    # セクション4: 誘導文・定型文設定
-    # ===========================================
+
+# ===========================================
+# セクション4: 誘導文・定型文設定
+# ===========================================
+@st.fragment
+@timed_section("templates")
+def render_templates():
+    """セクション4: 誘導文・定型文設定"""
     st.header("4. 誘導文・定型文設定")
     st.markdown("シナリオ末尾に自然につなげる誘導文と、最後に必ず付加する定型文を設定します。")
 
@@ -744,10 +1587,16 @@ if st.session_state.formatted_text:
 
     # 変更があればファイルに保存
     save_templates(lead_templates, closing_text)
+    cancel_stale_jobs()
 
-    # ===========================================
-    # セクション5: AI書き直し（メイン機能）
-    # ===========================================
+
+# ===========================================
+# セクション5: AI書き直し（メイン機能）
+# ===========================================
+@st.fragment
+@timed_section("rewrite")
+def render_rewrite():
+    """セクション5: AI書き直し"""
     st.header("5. AI書き直し")
 
     st.markdown("シナリオ全体を書き直します。テーマは維持しつつ、キャラクターの会話・説明形式に変換します。")
@@ -835,17 +1684,31 @@ if st.session_state.formatted_text:
     with col_vars:
         num_variations = st.selectbox(
             "比較パターン数",
-            options=[1, 2, 3],
-            format_func=lambda x: {1: "1パターン", 2: "2パターン（比較用）", 3: "3パターン（比較用）"}.get(x, str(x)),
+            options=list(range(1, GeminiFormatter.MAX_VARIATIONS + 1)),
+            format_func=lambda x: "1パターン" if x == 1 else f"{x}パターン（比較用）",
             key="num_variations",
             help="異なる切り口でシナリオを同時生成し、比較して選べます"
         )
 
+    # 話す速さに合わせたページ割り（プロンプトに渡してページ配分をモデル任せにしない）
+    transcript = load_transcript()
+    speaker_names = select_speaker_names(transcript, selected_chars_for_rewrite)
+    pages = page_outline(text("text_editor"), num_pages, transcript, speaker_names)
+    outline = format_outline(pages) if pages else None
+    speakers_assigned = bool(outline and speaker_names)
+    if pages:
+        basis = "動画の発話時刻" if transcript is not None else "文字数からの見積もり"
+        with st.expander(f"ページ割りの目安（{len(pages)}ページ / {basis}）", expanded=False):
+            st.text(outline)
+
+    # 実行中の書き直しは、設定が変わったら中止する
+    cancel_stale_jobs()
+
     # 書き直しボタン
     if st.button("REWRITE", key="rewrite_btn"):
         if not gemini_api_key:
             st.error("API設定でGemini APIキーを入力してください")
-        elif not st.session_state.text_editor:
+        elif not text("text_editor"):
             st.error("テキストが見つかりません")
         elif not selected_chars_for_rewrite:
             st.error("キャラクターを登録してください")
@@ -863,70 +1726,90 @@ if st.session_state.formatted_text:
 
             if num_variations == 1:
                 # 1パターンの場合は rewrite_scenario を使用
-                with st.spinner("AIがシナリオを書き直し中..."):
-                    result = gemini.rewrite_scenario(
-                        st.session_state.text_editor,
-                        politeness=p, emotion=e, style=s,
-                        custom_instruction=ci,
-                        characters=selected_chars_for_rewrite,
-                        lead_templates=lt,
-                        num_pages=num_pages
-                    )
-                    if result:
-                        # 定型文を末尾に付加
-                        if ct:
-                            result = result.rstrip() + "\n" + ct
-                        # 前回のウィジェット状態をクリア
-                        for k in ["rewritten_editor"]:
-                            if k in st.session_state:
-                                del st.session_state[k]
-                        st.session_state.rewritten_text = result
-                        st.session_state.rewrite_variations = None
-                        st.session_state.selected_variation = None
-                        st.rerun()
-                    else:
-                        st.error("書き直しに失敗しました")
+                coro = gemini.rewrite_scenario_async(
+                    text("text_editor"),
+                    politeness=p, emotion=e, style=s,
+                    custom_instruction=ci,
+                    characters=selected_chars_for_rewrite,
+                    lead_templates=lt,
+                    num_pages=num_pages,
+                    outline=outline,
+                    speakers_assigned=speakers_assigned
+                )
             else:
                 # 複数パターンの場合は generate_variations を使用
-                with st.spinner(f"AIが{num_variations}パターン生成中..."):
-                    variations = gemini.generate_variations(
-                        st.session_state.text_editor,
-                        num_variations=num_variations,
-                        politeness=p, emotion=e, style=s,
-                        custom_instruction=ci,
-                        characters=selected_chars_for_rewrite,
-                        lead_templates=lt,
-                        num_pages=num_pages
-                    )
-                    if variations:
-                        # 各パターンに定型文を末尾付加
-                        if ct:
-                            variations = [v.rstrip() + "\n" + ct for v in variations]
-                        st.session_state.rewrite_variations = variations
-                        st.session_state.rewritten_text = None
-                        st.session_state.selected_variation = None
-                        st.rerun()
-                    else:
-                        st.error("バリエーション生成に失敗しました")
+                coro = gemini.generate_variations_async(
+                    text("text_editor"),
+                    num_variations=num_variations,
+                    politeness=p, emotion=e, style=s,
+                    custom_instruction=ci,
+                    characters=selected_chars_for_rewrite,
+                    lead_templates=lt,
+                    num_pages=num_pages,
+                    outline=outline,
+                    speakers_assigned=speakers_assigned
+                )
+            # 前回の書き直しが実行中ならキャンセルして置き換える
+            st.session_state.jobs.start("rewrite", rewrite_signature(), coro,
+                                        meta={"num_variations": num_variations, "closing_text": ct,
+                                              "characters": character_set_label(selected_chars_for_rewrite),
+                                              "settings": {"politeness": p, "emotion": e, "style": s,
+                                                           "custom_instruction": ci, "num_pages": num_pages}})
+
+    rewrite_label = "AIがシナリオを書き直し中" if num_variations == 1 else f"AIが{num_variations}パターン生成中"
+    rewrite_job = wait_for_job("rewrite", rewrite_label)
+    if rewrite_job is not None and not rewrite_job.cancelled():
+        ct = rewrite_job.meta["closing_text"]
+        if rewrite_job.meta["num_variations"] == 1:
+            result = rewrite_job.result()
+            if result:
+                # 定型文を末尾に付加
+                if ct:
+                    result = result.rstrip() + "\n" + ct
+                # 前回のウィジェット状態をクリア
+                for k in ["rewritten_editor"]:
+                    if k in st.session_state:
+                        del st.session_state[k]
+                set_text("rewritten_text", result)
+                set_text("rewrite_variations", None)
+                st.session_state.selected_variation = None
+                record_rewrite("rewritten_text", result, rewrite_job.meta)
+                st.rerun()
+            else:
+                st.error("書き直しに失敗しました")
+        else:
+            variations = rewrite_job.result()
+            if variations:
+                # 各パターンに定型文を末尾付加
+                if ct:
+                    variations = [v.rstrip() + "\n" + ct for v in variations]
+                set_text("rewrite_variations", variations)
+                set_text("rewritten_text", None)
+                st.session_state.selected_variation = None
+                record_rewrite("variations", variations, rewrite_job.meta)
+                st.rerun()
+            else:
+                st.error("バリエーション生成に失敗しました")
 
     # 書き直し結果の表示
-    if st.session_state.rewritten_text:
+    if text("rewritten_text"):
         st.subheader("書き直し結果")
         rewritten_edit = st.text_area(
             "書き直されたテキスト（編集可能）",
-            value=st.session_state.rewritten_text,
+            value=text("rewritten_text"),
             height=400,
             key="rewritten_editor"
         )
-        st.session_state.rewritten_text = rewritten_edit
+        set_text("rewritten_text", rewritten_edit)
 
         col_apply, col_download, col_clear = st.columns(3)
         with col_apply:
             if st.button("この結果を採用", key="apply_rewrite"):
-                st.session_state.adopted_scenario = st.session_state.rewritten_text
-                st.session_state.text_editor = st.session_state.rewritten_text
-                st.session_state.formatted_text = st.session_state.rewritten_text
-                st.session_state.rewritten_text = None
+                set_text("adopted_scenario", text("rewritten_text"))
+                record_artifact("adopted_scenario", text("adopted_scenario"), filename=current_filename())
+                set_text("text_editor", text("rewritten_text"))
+                set_text("formatted_text", text("rewritten_text"))
+                set_text("rewritten_text", None)
                 if "rewritten_editor" in st.session_state:
                     del st.session_state["rewritten_editor"]
                 st.rerun()
@@ -934,28 +1817,53 @@ if st.session_state.formatted_text:
             st.download_button(
                 label="DOWNLOAD REWRITE",
                 data=rewritten_edit,
-                file_name=f"{final_filename}_rewrite.txt",
+                file_name=f"{current_filename()}_rewrite.txt",
                 mime="text/plain",
                 key="download_rewrite"
             )
         with col_clear:
             if st.button("結果をクリア", key="clear_rewrite"):
-                st.session_state.rewritten_text = None
+                set_text("rewritten_text", None)
                 if "rewritten_editor" in st.session_state:
                     del st.session_state["rewritten_editor"]
                 st.rerun()
 
-    elif st.session_state.rewrite_variations:
+    elif text("rewrite_variations"):
         st.subheader("書き直し結果（複数パターン）")
 
-        variations = st.session_state.rewrite_variations
+        variations = text("rewrite_variations")
         num_vars = len(variations)
 
+        # ローカルで採点しておすすめのパターンを示す（判定用にモデルを呼び出さない。編集後の内容で採点）
+        rank_start = time.perf_counter()
+        ranking = rank_variations([st.session_state.get(f"var_editor_{i}", v) for i, v in enumerate(variations)],
+                                  text("text_editor") or "", st.session_state.get("num_pages", 15))
+        rank_ms = (time.perf_counter() - rank_start) * 1000
+        ranks = {s.index: rank for rank, s in enumerate(ranking, 1)}
+        best = ranking[0].index if ranking else None
+        if best is not None:
+            st.caption(f"おすすめ: パターン {best + 1}（形式・元テキストの表現・長さのバランスで採点 / {rank_ms:.0f}ms）")
+            with st.expander("採点の内訳", expanded=False):
+                st.dataframe(
+                    [{
+                        "順位": rank,
+                        "パターン": s.index + 1,
+                        "スコア": round(s.score * 100),
+                        "形式": round(s.format * 100),
+                        "表現の使用": round(s.coverage * 100),
+                        "バランス": round(s.balance * 100),
+                        "指摘": " / ".join(s.issues) or "なし",
+                    } for rank, s in enumerate(ranking, 1)],
+                    hide_index=True,
+                )
+
         # 横並びで表示
         cols = st.columns(num_vars)
         for i, (col, var) in enumerate(zip(cols, variations)):
             with col:
-                st.markdown(f"**パターン {i + 1}**")
+                st.markdown(f"**パターン {i + 1}**" + ("（おすすめ）" if i == best else ""))
+                if i in ranks:
+                    st.caption(f"{ranks[i]}位 / {round(ranking[ranks[i] - 1].score * 100)}点")
                 st.text_area(
                     f"パターン {i + 1}",
                     value=var,
@@ -966,55 +1874,68 @@ if st.session_state.formatted_text:
                 if st.button(f"パターン {i + 1} を採用", key=f"select_var_{i}"):
                     selected_var = st.session_state.get(f"var_editor_{i}", var)
                     st.session_state.selected_variation = i
-                    st.session_state.adopted_scenario = selected_var
-                    st.session_state.rewritten_text = selected_var
-                    st.session_state.rewrite_variations = None
-                    st.session_state.text_editor = selected_var
-                    st.session_state.formatted_text = selected_var
+                    set_text("adopted_scenario", selected_var)
+                    record_artifact("adopted_scenario", selected_var, {"variation": i + 1}, current_filename())
+                    set_text("rewritten_text", selected_var)
+                    set_text("rewrite_variations", None)
+                    set_text("text_editor", selected_var)
+                    set_text("formatted_text", selected_var)
                     st.rerun()
                 st.download_button(
                     label=f"DOWNLOAD P{i + 1}",
                     data=var,
-                    file_name=f"{final_filename}_pattern{i + 1}.txt",
+                    file_name=f"{current_filename()}_pattern{i + 1}.txt",
                     mime="text/plain",
                     key=f"download_var_{i}"
                 )
 
     # 採用済みシナリオのダウンロード（常に表示）
-    if st.session_state.adopted_scenario:
+    if text("adopted_scenario"):
         st.markdown("---")
         st.subheader("採用済みシナリオ")
         st.download_button(
             label="DOWNLOAD SCENARIO",
-            data=st.session_state.adopted_scenario,
-            file_name=f"{final_filename}_scenario.txt",
+            data=functools.partial(get_text_store().get, st.session_state.adopted_scenario),
+            file_name=f"{current_filename()}_scenario.txt",
             mime="text/plain",
             key="download_adopted_scenario"
         )
 
-    # ===========================================
-    # セクション6: タイトル・紹介文・ハッシュタグ生成
-    # ===========================================
+
+# ===========================================
+# セクション6: タイトル・紹介文・ハッシュタグ生成
+# ===========================================
+@st.fragment
+@timed_section("sns")
+def render_sns():
+    """セクション6・7: SNSコンテンツ生成・まとめてダウンロード"""
     st.header("6. タイトル・紹介文・ハッシュタグ生成")
 
+    # 実行中のSNS生成は、対象テキストが変わったら中止する
+    cancel_stale_jobs()
+
     if st.button("GENERATE SNS", key="generate_sns_content_btn"):
         if not gemini_api_key:
             st.error("API設定でGemini APIキーを入力してください")
-        elif not st.session_state.text_editor:
+        elif not text("text_editor"):
             st.error("テキストが見つかりません")
         else:
-            progress_bar = st.progress(0)
-            progress_bar.progress(30)
-            sns_content = gemini.generate_metadata(st.session_state.text_editor)
-            progress_bar.progress(90)
-            if sns_content:
-                st.session_state.generated_sns_content = sns_content
-                progress_bar.progress(100)
-
-    if st.session_state.generated_sns_content:
+            st.session_state.jobs.start("sns", hash(text("text_editor")),
+                                        gemini.generate_metadata_async(text("text_editor")))
+
+    sns_job = wait_for_job("sns", "SNSコンテンツ生成中")
+    if sns_job is not None and not sns_job.cancelled():
+        sns_content = sns_job.result()
+        if sns_content:
+            set_text("generated_sns_content", sns_content)
+            record_artifact("sns_content", sns_content, filename=current_filename())
+        else:
+            st.error("SNSコンテンツの生成に失敗しました")
+
+    if text("generated_sns_content"):
         st.subheader("生成されたコンテンツ（編集可能）")
         if "sns_content_editor" not in st.session_state:
-            st.session_state.sns_content_editor = st.session_state.generated_sns_content
+            st.session_state.sns_content_editor = text("generated_sns_content")
         st.text_area("タイトル・紹介文・ハッシュタグ", height=400, key="sns_content_editor")
 
         # ===========================================
@@ -1022,26 +1943,48 @@ if st.session_state.formatted_text:
         # ===========================================
         st.header("7. まとめてダウンロード")
 
-        # 全テキストをまとめる
-        full_parts = []
+        # 全テキストはダウンロードされたときだけまとめる（再実行ごとに連結したコピーを作らない）
+        scenario_ref = st.session_state.adopted_scenario
+        sns_text = st.session_state.sns_content_editor
+
+        def full_text():
+            full_parts = []
 
-        # 採用済みシナリオ
-        if st.session_state.adopted_scenario:
-            full_parts.append("【シナリオ】\n" + st.session_state.adopted_scenario)
+            # 採用済みシナリオ
+            scenario = get_text_store().get(scenario_ref)
+            if scenario:
+                full_parts.append("【シナリオ】\n" + scenario)
 
-        # SNSコンテンツ
-        full_parts.append("【SNSコンテンツ】\n" + st.session_state.sns_content_editor)
+            # SNSコンテンツ
+            full_parts.append("【SNSコンテンツ】\n" + sns_text)
 
-        full_text = "\n\n" + ("=" * 50) + "\n\n".join(full_parts)
+            return "\n\n" + ("=" * 50) + "\n\n".join(full_parts)
 
         st.download_button(
             label="DOWNLOAD ALL",
             data=full_text,
-            file_name=f"{final_filename}_full.txt",
+            file_name=f"{current_filename()}_full.txt",
             mime="text/plain",
             key="download_full_text"
         )
 
+
+
+# セクション3以降は整形済みテキストがある場合のみ表示
+if text("formatted_text"):
+    render_text_editor()
+    render_templates()
+    render_rewrite()
+    render_sns()
+
 # フッター
 st.markdown("---")
 st.markdown("Made with Streamlit, Gladia API & Gemini API | **TikTok Scenario Rewriter**")
+
+# 作業状態のスナップショットを保存（スクリプト全体の再実行ごとに1回）
+save_session_snapshot()
+
+# しばらく使われていないテキストをディスクに退避
+get_text_store().spill_idle()
+
+metrics.observe("app", "rerun", time.perf_counter() - rerun_started)
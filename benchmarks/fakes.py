@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+
+def load_recording(name: str) -> dict:
+    """recordings/ 配下の記録済みレスポンスを読み込む"""
+    with open(os.path.join(RECORDINGS_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FaultInjector:
+    """レイテンシとエラーの注入（乱数シード固定で再現可能）"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = 0, slow_rate: float = 0.0, slow_factor: float = 20.0,
+                 drop_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # 一括リクエストの出力から項目を落とす割合（項目ごとの失敗）
+        self.drop_rate = drop_rate
+        # slow_rate の割合の呼び出しだけ slow_factor 倍遅くする（テールレイテンシ）
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait_time(self, scale: float) -> float:
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                scale *= self.slow_factor
+        return max(0.0, (self.latency + jitter) * scale)
+
+    def delay(self, scale: float = 1.0):
+        wait = self._wait_time(scale)
+        if wait:
+            time.sleep(wait)
+
+    async def adelay(self, scale: float = 1.0):
+        wait = self._wait_time(scale)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def should_fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def should_drop(self) -> bool:
+        if not self.drop_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.drop_rate
+
+
+def synthetic_speech_wav(path: str, seconds: float, rate: int = 16000):
+    """発話と無音が交互に続く16bitモノラルのWAV（0.8秒の音 + 0.4秒の無音。20回ごとに1.5秒の無音）"""
+    import numpy as np
+    import wave
+
+    t = np.arange(int(0.8 * rate)) / rate
+    voiced = (0.3 * 32767 * np.sin(2 * np.pi * (180 + 40 * np.sin(t * 3)) * t)).astype("<i2")
+    sentence = np.concatenate([voiced, np.zeros(int(0.4 * rate), dtype="<i2")])
+    paragraph = np.concatenate([np.tile(sentence, 20), np.zeros(int(1.5 * rate), dtype="<i2")])
+    total = int(seconds * rate)
+    samples = np.tile(paragraph, total // len(paragraph) + 1)[:total]
+    # 区間ごとに内容が変わるよう弱いノイズを足す（同じ内容の区間はまとめられてしまうため）
+    noise = np.random.default_rng(0).integers(-200, 200, total, dtype=np.int16)
+    samples = (samples + noise).astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+
+
+# ===========================================
+# Gladia
+# ===========================================
+class FakeGladiaServer:
+    """
+    記録済みレスポンスを再生するGladia APIの代替
+
+    アップロード → 文字起こしジョブ作成 → ポーリング（queued / processing / done）を再現する。
+    transport() を GladiaAPI / AsyncGladiaAPI に渡して使う。
+    seconds_per_mb を指定すると、アップロードしたファイルの大きさに比例して文字起こしに時間がかかる
+    """
+
+    def __init__(self, faults: Optional[FaultInjector] = None, recording: Optional[dict] = None,
+                 seconds_per_mb: float = 0.0):
+        self.faults = faults or FaultInjector()
+        self.recording = recording or load_recording("gladia")
+        self.seconds_per_mb = seconds_per_mb
+        self._upload_sizes = {}
+        self._ready_at = {}
+        self._job_ids = itertools.count(1)
+        self._upload_ids = itertools.count(1)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.requests_served = 0
+
+    def handle(self, method: str, path: str, body: bytes = b""):
+        """(ステータスコード, JSON, レイテンシ倍率) を返す"""
+        with self._lock:
+            self.requests_served += 1
+
+        if path.endswith("/upload"):
+            # アップロードは転送時間ぶん長めに待つ
+            if self.faults.should_fail():
+                return 500, {"message": "injected upload failure"}, 3.0
+            # 実際のAPIと同様にアップロードごとに別のURLを返す
+            upload = dict(self.recording["upload"])
+            upload["audio_url"] = f"{upload['audio_url']}-{next(self._upload_ids)}"
+            with self._lock:
+                self._upload_sizes[upload["audio_url"]] = len(body)
+            return 200, upload, 3.0
+
+        if method == "POST" and path.endswith("/pre-recorded"):
+            if self.faults.should_fail():
+                return 503, {"message": "injected transcription failure"}, 1.0
+            job_id = f"{self.recording['pre_recorded']['id']}-{next(self._job_ids)}"
+            audio_url = json.loads(body or b"{}").get("audio_url")
+            with self._lock:
+                self._jobs[job_id] = iter(self.recording["poll_states"])
+                size_mb = self._upload_sizes.get(audio_url, 0) / (1 << 20)
+                self._ready_at[job_id] = time.monotonic() + size_mb * self.seconds_per_mb
+            return 201, {**self.recording["pre_recorded"], "id": job_id}, 1.0
+
+        if method == "GET" and "/pre-recorded/" in path:
+            job_id = path.rsplit("/", 1)[-1]
+            with self._lock:
+                states = self._jobs.get(job_id)
+                status = next(states, "done") if states else None
+                if status == "done" and time.monotonic() < self._ready_at.get(job_id, 0.0):
+                    status = "processing"
+            if status is None:
+                return 404, {"message": f"job {job_id} not found"}, 0.2
+            if self.faults.should_fail():
+                return 200, {"id": job_id, "status": "error", "error": "injected job failure"}, 0.2
+            body = {"id": job_id, "status": status}
+            if status == "done":
+                body["result"] = self.recording["result"]
+            return 200, body, 0.2
+
+        return 404, {"message": f"unknown endpoint {method} {path}"}, 0.0
+
+    def transport(self) -> httpx.MockTransport:
+        """httpx用のモックトランスポート（待機はイベントループを塞がない）"""
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            body = await request.aread()
+            status, payload, scale = self.handle(request.method, request.url.path, body)
+            await self.faults.adelay(scale)
+            return httpx.Response(status, json=payload)
+
+        return httpx.MockTransport(handler)
+
+
+# ===========================================
+# Gemini
+# ===========================================
+class FakeAPIError(Exception):
+    """Gemini APIエラーの代替（google.api_core.exceptions.ServiceUnavailable 相当）"""
+
+    code = 503
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+
+class _Candidate:
+    def __init__(self, text: str, finish_reason: str):
+        self.text = text
+        self.finish_reason = finish_reason
+
+
+class FakeGenerateContentResponse:
+    """GenerateContentResponse の代替"""
+
+    def __init__(self, text: str, prompt_tokens: int, response_tokens: int, finish_reason: str = "STOP"):
+        self.text = text
+        self.candidates = [_Candidate(text, finish_reason)]
+        self.usage_metadata = _Usage(prompt_tokens, response_tokens)
+        self.prompt_feedback = None
+
+
+# utils.text_formatter が続きの生成を頼むときの指示（「パターン2の「--- P7 ---」から続きを出力」）
+_CONTINUATION = re.compile(r"(?:パターン(\d+)の)?「--- P(\d+) ---」から続きを出力")
+# 一括リクエストの各項目の区切り（「=== ITEM 1 ===」）
+_BATCH_ITEM = re.compile(r"^=== ITEM (\d+) ===$", re.MULTILINE)
+
+
+class FakeGenerativeModel:
+    """
+    記録済みレスポンスを再生するGenerativeModelの代替
+
+    プロンプト中の目印（marker）でメソッドを判別し、対応する記録を返す。
+    レイテンシは出力トークン数に比例させる（1000トークンで latency 秒）。
+    generation_config の max_output_tokens（なければ output_limit）を超える出力は途中で切り（finish_reason は
+    MAX_TOKENS）、stop_sequences の手前で止める。続きの生成を頼まれたら、記録の指定されたページから返す。
+    「=== ITEM 番号 ===」で区切った一括リクエストには、項目ごとに記録を繰り返して返す（faults.drop_rate の割合で項目を落とす）。
+    call_overhead は出力の長さによらない1回の呼び出しごとの待ち時間（通信・入力の処理）
+    """
+
+    def __init__(self, model_name: str = "gemini-2.0-flash", faults: Optional[FaultInjector] = None,
+                 recording: Optional[dict] = None, output_limit: Optional[int] = None, call_overhead: float = 0.0):
+        self.model_name = model_name
+        self.faults = faults or FaultInjector()
+        self.responses = (recording or load_recording("gemini"))["responses"]
+        self.output_limit = output_limit
+        self.call_overhead = call_overhead
+        self.calls = 0
+
+    def _lookup(self, prompt: str) -> dict:
+        for entry in self.responses:
+            if entry["marker"] in prompt:
+                return entry
+        raise FakeAPIError("no recorded response matches the prompt")
+
+    def _respond(self, prompt: str, generation_config=None):
+        """(入力トークン数, 出力, 出力トークン数, finish_reason)"""
+        entry = self._lookup(prompt)
+        text = entry["text"]
+        match = _CONTINUATION.search(prompt)
+        if match:
+            variation, page = int(match.group(1) or 1), int(match.group(2))
+            parts = text.split("===VARIATION===")
+            start = sum(len(part) + len("===VARIATION===") for part in parts[:variation - 1])
+            header = re.search(rf"^-{{3}}\s*P{page}\s*-{{3}}\s*$", parts[min(variation, len(parts)) - 1],
+                               re.MULTILINE)
+            text = text[start + (header.start() if header else 0):].lstrip()
+        tokens = max(1, round(entry["response_tokens"] * len(text) / len(entry["text"])))
+        items = _BATCH_ITEM.findall(prompt)
+        if items:
+            kept = [item for item in items if not self.faults.should_drop()]
+            text = "\n\n".join(f"=== ITEM {item} ===\n{entry['text']}" for item in kept)
+            tokens = max(1, entry["response_tokens"] * len(kept))
+
+        config = generation_config or {}
+        for stop in config.get("stop_sequences") or []:
+            if stop in text:
+                tokens = max(1, round(tokens * text.index(stop) / len(text)))
+                text = text[:text.index(stop)]
+        limit = config.get("max_output_tokens") or self.output_limit
+        if self.output_limit:
+            limit = min(limit, self.output_limit)
+        if limit and tokens > limit:
+            return entry["prompt_tokens"], text[:len(text) * limit // tokens], limit, "MAX_TOKENS"
+        return entry["prompt_tokens"], text, tokens, "STOP"
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        self.calls += 1
+        prompt_tokens, text, tokens, finish_reason = self._respond(prompt, generation_config)
+        if self.call_overhead:
+            time.sleep(self.call_overhead)
+        self.faults.delay(scale=max(0.2, tokens / 1000))
+        if self.faults.should_fail():
+            raise FakeAPIError("503 injected Gemini failure")
+        return FakeGenerateContentResponse(text, prompt_tokens, tokens, finish_reason)
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        self.calls += 1
+        prompt_tokens, text, tokens, finish_reason = self._respond(prompt, generation_config)
+        if self.call_overhead:
+            await asyncio.sleep(self.call_overhead)
+        await self.faults.adelay(scale=max(0.2, tokens / 1000))
+        if self.faults.should_fail():
+            raise FakeAPIError("503 injected Gemini failure")
+        return FakeGenerateContentResponse(text, prompt_tokens, tokens, finish_reason)
+
+
+class FakeGenAI:
+    """utils.text_formatter が使う google.generativeai モジュールの代替"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None, output_limit: Optional[int] = None,
+                 call_overhead: float = 0.0):
+        self.faults = faults or FaultInjector()
+        self.recording = load_recording("gemini")
+        # モデルの出力トークン数の上限（長いシナリオが途中で切れる場合の再現用）
+        self.output_limit = output_limit
+        self.call_overhead = call_overhead
+        self.models = []
+
+    def configure(self, api_key=None, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name, **kwargs):
+        model = FakeGenerativeModel(model_name, faults=self.faults, recording=self.recording,
+                                    output_limit=self.output_limit, call_overhead=self.call_overhead)
+        self.models.append(model)
+        return model
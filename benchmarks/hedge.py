@@ -0,0 +1,103 @@
+"""
+ヘッジ（遅い応答に同じリクエストをもう1つ送る）のテールレイテンシベンチマーク
+
+一部の呼び出しだけ極端に遅くなるGeminiの代替で generate_filename を繰り返し呼び出し、
+ヘッジなし / ありのレイテンシ分布（p50 / p90 / p99）とヘッジした割合を比べる。
+
+使い方:
+    python -m benchmarks.hedge
+    python -m benchmarks.hedge --calls 1000 --slow-rate 0.05 --slow-factor 30
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FaultInjector, FakeGenAI  # noqa: E402
+
+TEXT = "退職したら給付金がもらえる。知らないと損する。"
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))]
+
+
+async def run_calls(gemini, calls: int, concurrency: int, offset: int) -> list:
+    """generate_filename_async を calls 回（同時 concurrency 件まで）呼び出し、1回ごとの所要時間を返す"""
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index):
+        async with limit:
+            start = time.perf_counter()
+            # 同じプロンプトはまとめられてしまうため、呼び出しごとに変える
+            await gemini.generate_filename_async(f"{TEXT}（{offset + index}）")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ヘッジのテールレイテンシベンチマーク")
+    parser.add_argument("--calls", type=int, default=500, help="計測する呼び出し回数")
+    parser.add_argument("--warmup", type=int, default=30, help="p90を求めるための事前の呼び出し回数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5, help="基本レイテンシ（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="レイテンシの揺らぎ（±秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.02, help="極端に遅くなる呼び出しの割合")
+    parser.add_argument("--slow-factor", type=float, default=20.0, help="遅くなる呼び出しの倍率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import utils.text_formatter as text_formatter
+    from utils.async_runner import run_sync
+    from utils.hedging import gemini_hedge_policy
+    from utils.metrics import metrics
+
+    metrics.json_log_path = None
+    metrics.prom_path = None
+    text_formatter.genai = FakeGenAI(FaultInjector(latency=args.latency, jitter=args.jitter, seed=args.seed,
+                                                   slow_rate=args.slow_rate, slow_factor=args.slow_factor))
+    # 代替モデルへの切り替えが混ざらないよう、代替モデルは使わない
+    plain = text_formatter.GeminiFormatter("benchmark-key", fallback_model_name=None)
+    hedging = text_formatter.GeminiFormatter("benchmark-key", fallback_model_name=None, hedge=True)
+
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    results = {}
+    try:
+        sys.stdout = devnull
+        run_sync(run_calls(plain, args.warmup, args.concurrency, 0))
+        for label, gemini in (("ヘッジなし", plain), ("ヘッジあり", hedging)):
+            hedged_before = metrics.counter("hedged")
+            wins_before = metrics.counter("hedge_wins")
+            latencies = run_sync(run_calls(gemini, args.calls, args.concurrency, len(results) * args.calls + args.warmup))
+            results[label] = {
+                "latencies": latencies,
+                "hedged": metrics.counter("hedged") - hedged_before,
+                "wins": metrics.counter("hedge_wins") - wins_before,
+            }
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    print(f"generate_filename × {args.calls}回（{args.slow_rate:.0%}が{args.slow_factor:.0f}倍遅い）"
+          f"  ヘッジ予算 {gemini_hedge_policy.budget:.0%}")
+    for label, r in results.items():
+        latencies = r["latencies"]
+        print(f"  {label}  p50 {percentile(latencies, 0.5):6.2f}秒  p90 {percentile(latencies, 0.9):6.2f}秒  "
+              f"p99 {percentile(latencies, 0.99):6.2f}秒  最大 {max(latencies):6.2f}秒  "
+              f"ヘッジ {r['hedged']}回（{r['hedged'] / len(latencies):.1%}, 先に返った {r['wins']}回）")
+    before = percentile(results["ヘッジなし"]["latencies"], 0.99)
+    after = percentile(results["ヘッジあり"]["latencies"], 0.99)
+    print(f"  p99: {before:.2f}秒 → {after:.2f}秒（{(1 - after / before):.0%}短縮）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
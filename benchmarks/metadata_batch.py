@@ -0,0 +1,99 @@
+"""
+SNSメタデータ（タイトル・紹介文・ハッシュタグ）の一括生成ベンチマーク
+
+記録済みレスポンスを再生するGeminiの代替で、複数のシナリオのメタデータを
+1件ずつ生成する場合（generate_metadata）と、まとめて生成する場合（generate_metadata_batch）の
+処理件数/秒・呼び出し回数・送ったプロンプトの文字数を比べる。
+--drop-rate を指定すると、一括生成の出力から項目を落とし、1件ずつの生成し直しも含めて計測する。
+
+使い方:
+    python -m benchmarks.metadata_batch
+    python -m benchmarks.metadata_batch --items 40 --batch-size 10 --drop-rate 0.1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FaultInjector, FakeGenAI, load_recording  # noqa: E402
+
+
+def scenarios(count: int) -> list:
+    """記録済みのシナリオに番号を付けたもの（同じ内容だと同時呼び出しがまとめられるため）"""
+    base = next(r["text"] for r in load_recording("gemini")["responses"] if r["method"] == "rewrite_scenario")
+    return [f"{base}\n（{i + 1}本目）" for i in range(count)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="SNSメタデータの一括生成ベンチマーク")
+    parser.add_argument("--items", type=int, default=24, help="メタデータを生成するシナリオの数")
+    parser.add_argument("--batch-size", type=int, default=8, help="1リクエストにまとめる件数")
+    parser.add_argument("--latency", type=float, default=0.5, help="出力1000トークンあたりのレイテンシ（秒）")
+    parser.add_argument("--call-overhead", type=float, default=0.3, help="1回の呼び出しごとの待ち時間（秒）")
+    parser.add_argument("--drop-rate", type=float, default=0.05, help="一括生成の出力から落とす項目の割合")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import utils.text_formatter as text_formatter
+    from utils.metrics import metrics
+
+    metrics.json_log_path = None
+    metrics.prom_path = None
+    fake = FakeGenAI(FaultInjector(latency=args.latency, drop_rate=args.drop_rate, seed=args.seed),
+                     call_overhead=args.call_overhead)
+    text_formatter.genai = fake
+    texts = scenarios(args.items)
+
+    def calls() -> int:
+        return sum(model.calls for model in fake.models)
+
+    runs = {
+        "1件ずつ": (lambda gemini: [gemini.generate_metadata(t) for t in texts],
+                  lambda gemini: sum(len(gemini._generate_metadata_prompt(t)) for t in texts)),
+        f"{args.batch_size}件ずつまとめて": (
+            lambda gemini: gemini.generate_metadata_batch(texts, args.batch_size),
+            lambda gemini: sum(len(gemini._generate_metadata_batch_prompt([texts[i] for i in batch]))
+                               for batch in gemini._metadata_batches(texts, args.batch_size))),
+    }
+
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    results = {}
+    try:
+        for label, (run, prompt_chars) in runs.items():
+            gemini = text_formatter.GeminiFormatter("benchmark-key", fallback_model_name=None)
+            calls_before = calls()
+            fallbacks_before = metrics.counter("batch_fallbacks")
+            sys.stdout = devnull
+            start = time.perf_counter()
+            try:
+                outputs = run(gemini)
+            finally:
+                sys.stdout = stdout
+            wall_time = time.perf_counter() - start
+            results[label] = {
+                "wall_time": wall_time,
+                "succeeded": sum(1 for output in outputs if output),
+                "calls": calls() - calls_before,
+                "fallbacks": metrics.counter("batch_fallbacks") - fallbacks_before,
+                "prompt_chars": prompt_chars(gemini),
+            }
+    finally:
+        devnull.close()
+
+    print(f"SNSメタデータ × {args.items}件（呼び出しごとの待ち {args.call_overhead}秒、"
+          f"一括生成で項目が落ちる割合 {args.drop_rate:.0%}）")
+    for label, r in results.items():
+        print(f"  {label:<12} {r['succeeded']}/{args.items} 成功  {r['wall_time']:6.2f}秒  "
+              f"{r['succeeded'] / r['wall_time']:6.2f}件/秒  呼び出し {r['calls']}回"
+              f"（1件ずつの生成し直し {r['fallbacks']}件）  プロンプト {r['prompt_chars']:,}文字")
+    single, batch = results.values()
+    print(f"  処理件数/秒: {single['succeeded'] / single['wall_time']:.2f} → "
+          f"{batch['succeeded'] / batch['wall_time']:.2f}（{single['wall_time'] / batch['wall_time']:.1f}倍）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
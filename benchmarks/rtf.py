@@ -0,0 +1,99 @@
+"""
+文字起こしバックエンドのRTF（実時間比 = 処理時間 / 音声の長さ）ベンチマーク
+
+合成した音声で、Gladia（記録済みレスポンスを再生する代替。アップロード・ジョブ作成・ポーリングの待ちを再現）と
+ローカルの faster-whisper（インストールされている場合のみ）の処理時間を比べる。
+RTFが1未満なら音声の長さより速く文字起こしできている。
+
+使い方:
+    python -m benchmarks.rtf                                  # 15 / 60 / 180秒の音声
+    python -m benchmarks.rtf --durations 30 --latency 1.0 --poll-interval 3
+    python -m benchmarks.rtf --model base --threads 4 --batch-size 8
+    python -m benchmarks.rtf --gladia-only                    # faster-whisper なしで Gladia だけ計測
+
+faster-whisper がインストールされていない場合は、比較ができないため --gladia-only なしでは終了コード 1 で終わる
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FaultInjector, FakeGladiaServer, synthetic_speech_wav  # noqa: E402
+
+
+def measure(backend, path: str) -> dict:
+    start = time.perf_counter()
+    transcript = backend.transcribe_file(path, language="ja")
+    return {"wall_time": time.perf_counter() - start, "ok": transcript is not None}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="文字起こしバックエンドのRTFベンチマーク")
+    parser.add_argument("--durations", type=float, nargs="+", default=[15, 60, 180], help="音声の長さ（秒）")
+    parser.add_argument("--latency", type=float, default=0.5, help="Gladia代替の基本レイテンシ（秒）")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Gladiaのポーリング間隔（秒）")
+    parser.add_argument("--model", default="small", help="Whisperのモデルサイズ")
+    parser.add_argument("--threads", type=int, default=0, help="Whisperのスレッド数（0でCPU数）")
+    parser.add_argument("--batch-size", type=int, default=8, help="Whisperのバッチサイズ（1でバッチなし）")
+    parser.add_argument("--local-max-seconds", type=float, default=90, help="自動振り分けでローカルにする長さ")
+    parser.add_argument("--gladia-only", action="store_true",
+                        help="faster-whisper がなくても Gladia だけ計測する（比較はしない）")
+    args = parser.parse_args(argv)
+
+    import utils.transcription as transcription
+    from utils.metrics import metrics
+    from utils.audio_splitter import media_duration
+    from utils.transcription_backends import LocalWhisperBackend, TranscriptionRouter
+
+    metrics.json_log_path = None
+    metrics.prom_path = None
+
+    server = FakeGladiaServer(faults=FaultInjector(latency=args.latency))
+    gladia = transcription.GladiaAPI("benchmark-key", transport=server.transport())
+    gladia.poll_interval = args.poll_interval
+    backends = {"gladia": gladia}
+    local = LocalWhisperBackend(model_size=args.model, cpu_threads=args.threads, batch_size=args.batch_size)
+    if local.available():
+        backends["whisper"] = local
+    elif args.gladia_only:
+        print("faster-whisper が見つからないため、Gladia だけを計測します（ローカル Whisper との比較はしません）")
+    else:
+        print("faster-whisper が見つからないため、ローカル Whisper とのRTFの比較ができません。"
+              "pip install faster-whisper でインストールするか、--gladia-only で Gladia だけを計測してください",
+              file=sys.stderr)
+        return 1
+    router = TranscriptionRouter(backends, local_max_seconds=args.local_max_seconds)
+
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    try:
+        for seconds in args.durations:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
+                path = tmp_file.name
+            try:
+                synthetic_speech_wav(path, seconds)
+                audio_seconds = media_duration(path) or seconds
+                print(f"\n[{audio_seconds:.0f}秒の音声] 自動振り分け: {router.order(audio_seconds)[0]}")
+                if "whisper" in backends:
+                    # モデルの読み込みは初回のみなので、計測の前に済ませておく
+                    local._pipeline()
+                for name, backend in backends.items():
+                    sys.stdout = devnull
+                    try:
+                        result = measure(backend, path)
+                    finally:
+                        sys.stdout = stdout
+                    status = "" if result["ok"] else "  （失敗）"
+                    print(f"  {name:<8} {result['wall_time']:8.2f}秒  RTF {result['wall_time'] / audio_seconds:.3f}{status}")
+            finally:
+                os.unlink(path)
+    finally:
+        devnull.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
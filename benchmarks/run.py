@@ -0,0 +1,269 @@
+"""
+オフラインベンチマーク
+
+記録済みレスポンスを再生するGladia / Geminiの代替を使って、
+ネットワークやAPIクォータを使わずにパイプライン全体の所要時間とメモリを計測する。
+
+使い方:
+    python -m benchmarks.run                          # 全ワークロード
+    python -m benchmarks.run --workload single --latency 0.2 --error-rate 0.1
+    python -m benchmarks.run --workload long --seconds-per-mb 0.5   # 長い音声（分割なし / 分割して並列）
+    python -m benchmarks.run --workload truncated     # 出力の上限で切れたシナリオを続きから生成
+    python -m benchmarks.run --output bench.json      # 結果をJSONで保存
+    python -m benchmarks.run --baseline bench.json    # 前回結果より20%以上遅ければ終了コード1
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FaultInjector, FakeGladiaServer, FakeGenAI  # noqa: E402
+
+
+class StageTimer:
+    """ステージごとの所要時間を集計"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - start
+            self.counts[name] += 1
+
+
+def install_fakes(faults: FaultInjector, seconds_per_mb: float = 0.0, output_limit: int = None):
+    """utils のAPIクライアントが使うHTTP / SDKを代替に差し替える"""
+    import utils.transcription as transcription
+    import utils.text_formatter as text_formatter
+    from utils.circuit_breaker import breakers
+    from utils.metrics import metrics
+
+    # 前のワークロードで開いたサーキットブレーカーを持ち越さない
+    breakers.reset()
+    server = FakeGladiaServer(faults=faults, seconds_per_mb=seconds_per_mb)
+    text_formatter.genai = FakeGenAI(faults=faults, output_limit=output_limit)
+    # ベンチマーク中はメトリクスをファイルに書き出さない
+    metrics.json_log_path = None
+    metrics.prom_path = None
+
+    gladia = transcription.GladiaAPI("benchmark-key", transport=server.transport())
+    gladia.poll_interval = faults.latency * 0.5
+    gemini = text_formatter.GeminiFormatter("benchmark-key")
+    return gladia, gemini
+
+
+CHARACTERS = [
+    {"name": "太郎", "age": "30代", "gender": "男性", "appearance": "スーツ姿", "atmosphere": "頼れる兄貴",
+     "background": "元人事", "tone": "タメ口"},
+    {"name": "花子", "age": "20代", "gender": "女性", "appearance": "ショートヘア", "atmosphere": "明るい",
+     "background": "新入社員", "tone": "丁寧語"},
+]
+
+
+def run_video_pipeline(gladia, gemini, timer: StageTimer, video_path: str, num_variations: int = 1):
+    """app.py の「動画から生成」→ 書き直し → SNS生成 と同じ順序で呼び出す"""
+    with timer.stage("upload"):
+        audio_url = gladia.upload_file(video_path)
+    if not audio_url:
+        return False
+    with timer.stage("transcribe"):
+        transcribed = gladia.transcribe(audio_url, language="ja")
+    if not transcribed:
+        return False
+    with timer.stage("format_text"):
+        formatted = gemini.format_text(transcribed)
+    if not formatted:
+        return False
+    with timer.stage("generate_filename"):
+        gemini.generate_filename(formatted)
+
+    if num_variations == 1:
+        with timer.stage("rewrite_scenario"):
+            scenario = gemini.rewrite_scenario(formatted, characters=CHARACTERS, num_pages=15)
+    else:
+        with timer.stage("generate_variations"):
+            variations = gemini.generate_variations(formatted, num_variations=num_variations,
+                                                    characters=CHARACTERS, num_pages=15)
+        scenario = variations[0] if variations else None
+    if not scenario:
+        return False
+    with timer.stage("generate_metadata"):
+        return gemini.generate_metadata(scenario) is not None
+
+
+WORKLOADS = {
+    "single": {"videos": 1, "num_variations": 1},
+    "batch": {"videos": 10, "num_variations": 1},
+    "variations": {"videos": 1, "num_variations": 3},
+    # 文字起こしのみを1つのイベントループで同時実行（動画はそれぞれ別の内容）
+    "concurrent": {"videos": 100, "num_variations": 0},
+    # 同じ動画の文字起こしを同時実行（1回のアップロード・文字起こしにまとめられる）
+    "duplicate": {"videos": 100, "num_variations": 0},
+    # 20分の音声の文字起こし（Gladiaの処理時間はファイルの大きさに比例）。1つのジョブで処理する場合と
+    # 無音の位置で2分ごとに分割して同時に処理する場合
+    "long": {"videos": 1, "num_variations": 0, "audio_seconds": 1200, "segment_seconds": 0},
+    "long_split": {"videos": 1, "num_variations": 0, "audio_seconds": 1200, "segment_seconds": 120},
+    # モデルの出力上限（2000トークン）で3パターン生成（5400トークン）が途中で切れる場合。続きから生成して完成させる
+    "truncated": {"videos": 1, "num_variations": 3, "output_limit": 2000},
+}
+
+
+async def run_concurrent_transcriptions(gladia, timer: StageTimer, video_paths: list) -> int:
+    """AsyncGladiaAPI で video_paths の文字起こしを同時に実行"""
+    import asyncio
+
+    async def one(video_path):
+        audio_url = await gladia.client.upload_file(video_path)
+        return bool(audio_url and await gladia.client.transcribe(audio_url, language="ja"))
+
+    with timer.stage("transcribe_concurrent"):
+        results = await asyncio.gather(*(one(path) for path in video_paths))
+    return sum(results)
+
+
+def run_workload(name: str, latency: float, jitter: float, error_rate: float, seed: int,
+                 batch_size: int = None, seconds_per_mb: float = 0.25) -> dict:
+    spec = dict(WORKLOADS[name])
+    if name in ("batch", "concurrent", "duplicate") and batch_size:
+        spec["videos"] = batch_size
+
+    faults = FaultInjector(latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    long_audio = "audio_seconds" in spec
+    gladia, gemini = install_fakes(faults, seconds_per_mb if long_audio else 0.0, spec.get("output_limit"))
+    timer = StageTimer()
+
+    # concurrent は動画ごとに別の内容（同じ内容だとまとめられてしまうため）
+    video_paths = []
+    for _ in range(spec["videos"] if name == "concurrent" else 1):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav" if long_audio else ".mp4") as tmp_file:
+            if not long_audio:
+                tmp_file.write(os.urandom(256 * 1024))
+            video_paths.append(tmp_file.name)
+    if long_audio:
+        from benchmarks.fakes import synthetic_speech_wav
+        synthetic_speech_wav(video_paths[0], spec["audio_seconds"])
+        gladia.client.segment_seconds = spec["segment_seconds"]
+        # 分割しない場合もポーリングの上限回数内に終わるようにする
+        gladia.poll_interval = max(gladia.poll_interval, 0.25)
+    video_path = video_paths[0]
+    from utils.metrics import metrics
+    coalesced_before = metrics.counter("coalesced")
+    continuations_before = metrics.counter("continuations")
+    mismatches_before = metrics.counter("page_count_mismatch")
+
+    # 標準出力・標準エラーのログを抑制して計測
+    devnull = open(os.devnull, "w")
+    stdout, stderr = sys.stdout, sys.stderr
+    tracemalloc.start()
+    start = time.perf_counter()
+    succeeded = 0
+    try:
+        sys.stdout = sys.stderr = devnull
+        if long_audio:
+            with timer.stage("transcribe_file"):
+                succeeded = int(gladia.transcribe_file(video_path) is not None)
+        elif name in ("concurrent", "duplicate"):
+            from utils.async_runner import run_sync
+            paths = video_paths if name == "concurrent" else [video_path] * spec["videos"]
+            succeeded = run_sync(run_concurrent_transcriptions(gladia, timer, paths))
+        else:
+            for _ in range(spec["videos"]):
+                if run_video_pipeline(gladia, gemini, timer, video_path, spec["num_variations"]):
+                    succeeded += 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        wall_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        devnull.close()
+        for path in video_paths:
+            os.unlink(path)
+
+    return {
+        "workload": name,
+        "videos": spec["videos"],
+        "succeeded": succeeded,
+        "wall_time": wall_time,
+        "peak_memory_kb": peak / 1024,
+        "coalesced": metrics.counter("coalesced") - coalesced_before,
+        "continuations": metrics.counter("continuations") - continuations_before,
+        "page_count_mismatch": metrics.counter("page_count_mismatch") - mismatches_before,
+        "stages": {stage: {"total": total, "count": timer.counts[stage]}
+                   for stage, total in timer.totals.items()},
+    }
+
+
+def print_report(results: list):
+    for r in results:
+        print(f"\n[{r['workload']}] {r['succeeded']}/{r['videos']} 成功  "
+              f"合計 {r['wall_time']:.3f}秒  ピークメモリ {r['peak_memory_kb']:.0f}KB"
+              f"  まとめた同時呼び出し {r.get('coalesced', 0)}回")
+        if r.get("continuations") or r.get("page_count_mismatch"):
+            print(f"  続きの生成 {r.get('continuations', 0)}回  ページ数の不一致 {r.get('page_count_mismatch', 0)}件")
+        for stage, s in r["stages"].items():
+            print(f"  {stage:<22} {s['total']:8.3f}秒  ({s['count']}回, 平均 {s['total'] / s['count']:.3f}秒)")
+
+
+def compare_with_baseline(results: list, baseline_path: str, tolerance: float) -> bool:
+    """ベースラインより tolerance 以上遅くなったワークロードがあれば False"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["workload"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        base = baseline.get(r["workload"])
+        if not base:
+            continue
+        ratio = r["wall_time"] / base["wall_time"] if base["wall_time"] else 1.0
+        mark = "OK" if ratio <= 1 + tolerance else "REGRESSION"
+        print(f"{r['workload']:<12} {base['wall_time']:.3f}秒 → {r['wall_time']:.3f}秒 ({ratio:.2f}x) {mark}")
+        if mark != "OK":
+            ok = False
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="オフラインベンチマーク（記録済みレスポンスを再生）")
+    parser.add_argument("--workload", choices=list(WORKLOADS) + ["all"], default="all")
+    parser.add_argument("--latency", type=float, default=0.05, help="基本レイテンシ（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="レイテンシの揺らぎ（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラー注入率（0〜1）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=None, help="batch / concurrent / duplicate ワークロードの動画数")
+    parser.add_argument("--seconds-per-mb", type=float, default=0.25,
+                        help="long / long_split ワークロードでGladiaの処理にかかる時間（秒/MB）")
+    parser.add_argument("--output", help="結果のJSON出力先")
+    parser.add_argument("--baseline", help="比較対象の結果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="許容する速度低下の割合")
+    args = parser.parse_args(argv)
+
+    names = list(WORKLOADS) if args.workload == "all" else [args.workload]
+    results = [run_workload(name, args.latency, args.jitter, args.error_rate, args.seed, args.batch_size,
+                            args.seconds_per_mb)
+               for name in names]
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        print()
+        return 0 if compare_with_baseline(results, args.baseline, args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from utils.hedging import hedged
+
+
+class _Policy:
+    def record_call(self):
+        pass
+
+    def delay(self, backend, method):
+        return 0.01
+
+    def acquire(self):
+        return True
+
+
+def _factory(*behaviours):
+    calls = iter(behaviours)
+
+    def factory():
+        return next(calls)()
+    return factory
+
+
+async def _cancelled_later():
+    # ヘッジが出た後で、外から（ここでは自分で）キャンセルされる
+    await asyncio.sleep(0.03)
+    asyncio.current_task().cancel()
+    await asyncio.sleep(1)
+
+
+async def _slow_result():
+    await asyncio.sleep(0.05)
+    return "ok"
+
+
+async def _failure():
+    raise ValueError("失敗")
+
+
+def test_externally_cancelled_attempt_falls_back_to_hedge():
+    result = asyncio.run(hedged(_factory(_cancelled_later, _slow_result), _Policy(), "gemini", "format_text"))
+
+    assert result == "ok"
+
+
+def test_error_of_other_attempt_is_raised_when_both_fail():
+    with pytest.raises(ValueError):
+        asyncio.run(hedged(_factory(_cancelled_later, _failure), _Policy(), "gemini", "format_text"))
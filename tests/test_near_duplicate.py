@@ -0,0 +1,31 @@
+import random
+
+from utils.near_duplicate import MinHasher, fingerprint_similarity, shingles, _MERSENNE_PRIME
+
+
+def test_signature_matches_reference_formula():
+    text = "退職したら失業保険の申請を忘れずに。知らないと損する給付金があります。"
+    hasher = MinHasher(num_perm=16)
+    rng = random.Random(1)
+    params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(16)]
+
+    expected = [min((a * h + b) % _MERSENNE_PRIME for h in shingles(text)) for a, b in params]
+    assert hasher.signature(text) == expected
+
+
+def test_signature_similarity_of_trimmed_text():
+    hasher = MinHasher()
+    text = "".join(chr(0x3041 + (i * 7919) % 80) for i in range(2000))
+
+    assert MinHasher.similarity(hasher.signature(text), hasher.signature(text[100:])) > 0.8
+    assert hasher.signature("") is None
+
+
+def test_fingerprint_similarity_finds_offset():
+    rng = random.Random(0)
+    fp = [rng.randrange(0, 1 << 32) for _ in range(400)]
+
+    assert fingerprint_similarity(fp, fp[20:]) == 1.0
+    assert fingerprint_similarity(fp, [rng.randrange(0, 1 << 32) for _ in range(400)]) < 0.6
+    # fpcalc が符号付きで出力した値も同じように比べる
+    assert fingerprint_similarity([x - (1 << 32) if x >= 1 << 31 else x for x in fp], fp) == 1.0
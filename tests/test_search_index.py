@@ -0,0 +1,47 @@
+import os
+
+from utils.search_index import SearchIndex
+
+
+def _index(tmp_path):
+    index = SearchIndex(str(tmp_path / "projects.db"))
+    index.add("project:1:formatted_text", "transcript", "退職", "退職したら失業保険の申請を忘れずに。", 1)
+    index.add("project:2:adopted_scenario", "scenario", "給付", "【テロップ】給付金11選", 2)
+    return index
+
+
+def test_two_character_terms_use_bigram_index(tmp_path):
+    index = _index(tmp_path)
+
+    assert [r["project_id"] for r in index.search("申請")] == [1]
+    assert [r["project_id"] for r in index.search("退職 失業保険")] == [1]
+    assert index.search("申請 給付") == []
+    assert "**給付**" in index.search("給付")[0]["snippet"]
+
+
+def test_bigram_index_is_built_for_existing_documents(tmp_path):
+    index = _index(tmp_path)
+    conn = index._connect()
+    conn.execute("DROP TABLE documents_bigram")
+    conn.commit()
+
+    assert [r["project_id"] for r in SearchIndex(index.db_path).search("申請")] == [1]
+
+
+def test_unreadable_file_does_not_abort_index_directory(tmp_path, monkeypatch):
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    (directory / "a.txt").write_text("退職金の話", encoding="utf-8")
+    (directory / "b.txt").write_text("申請の話", encoding="utf-8")
+    stat = os.stat
+
+    def failing_stat(path, *args, **kwargs):
+        if str(path).endswith("a.txt"):
+            raise PermissionError(path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr("utils.search_index.os.stat", failing_stat)
+    index = SearchIndex(str(tmp_path / "projects.db"))
+
+    assert index.index_directory(str(directory)) == 1
+    assert [r["title"] for r in index.search("申請")] == ["b"]
@@ -0,0 +1,42 @@
+import os
+
+from utils.session_snapshot import SessionSnapshots
+
+
+def _snapshots(tmp_path, **kwargs):
+    return SessionSnapshots(str(tmp_path), text_fields=["formatted_text"], **kwargs)
+
+
+def test_save_and_load(tmp_path):
+    snapshots = _snapshots(tmp_path)
+    snapshots.save("token1234", {"formatted_text": "退職したら", "num_pages": 8})
+
+    values, _ = _snapshots(tmp_path).load("token1234")
+    assert values == {"formatted_text": "退職したら", "num_pages": 8}
+
+
+def test_prune_keeps_referenced_texts_without_creating_lock_files(tmp_path):
+    snapshots = _snapshots(tmp_path)
+    snapshots.save("token1234", {"formatted_text": "退職したら"})
+    snapshots.save("token1234", {"formatted_text": "給付金"}, {"formatted_text": "x"})
+    os.remove(tmp_path / "token1234.json.lock")
+    blob = snapshots._put_blob("どこからも参照されないテキスト")
+
+    assert _snapshots(tmp_path).prune() == 0
+    assert not (tmp_path / "token1234.json.lock").exists()
+    assert not (tmp_path / "blobs" / f"{blob}.z").exists()
+    assert _snapshots(tmp_path).load("token1234")[0] == {"formatted_text": "給付金"}
+
+
+def test_idle_stores_are_released(tmp_path):
+    snapshots = _snapshots(tmp_path, idle_seconds=0)
+    snapshots.save("token1234", {"num_pages": 8})
+    snapshots.save("token5678", {"num_pages": 8})
+
+    assert list(snapshots._stores) == ["token5678"]
+
+
+def test_unserializable_value_does_not_raise(tmp_path):
+    snapshots = _snapshots(tmp_path)
+
+    assert snapshots.save("token1234", {"num_pages": object()}) == {}
@@ -0,0 +1,84 @@
+import json
+
+from utils.storage import JsonStore
+
+
+def _store(tmp_path, **kwargs):
+    return JsonStore(str(tmp_path / "characters.json"), default=[], **kwargs)
+
+
+def test_log_replay(tmp_path):
+    store = _store(tmp_path)
+    store.apply({"op": "append", "item": {"name": "a"}})
+    store.apply({"op": "append", "item": {"name": "b"}})
+    store.apply({"op": "remove", "key": "name", "value": "a"})
+
+    # 別のインスタンス（別プロセス相当）からも変更ログを再生して読める
+    assert _store(tmp_path).load() == [{"name": "b"}]
+
+
+def test_torn_tail_line_does_not_swallow_later_changes(tmp_path):
+    store = _store(tmp_path)
+    store.apply({"op": "append", "item": {"name": "a"}})
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "append", "item": {"na')
+    store.apply({"op": "append", "item": {"name": "b"}})
+    store.apply({"op": "append", "item": {"name": "c"}})
+
+    assert _store(tmp_path).load() == [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+
+
+def test_complete_tail_line_without_newline_is_kept(tmp_path):
+    store = _store(tmp_path)
+    store.apply({"op": "append", "item": {"name": "a"}})
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "append", "item": {"name": "b"}}))
+    store.apply({"op": "append", "item": {"name": "c"}})
+
+    assert _store(tmp_path).load() == [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+
+
+def test_compaction(tmp_path):
+    store = _store(tmp_path, compact_every=3)
+    for name in "abcd":
+        store.apply({"op": "append", "item": {"name": name}})
+
+    # 3件目でスナップショットに反映され、4件目は新しいログに書かれる
+    with open(store.path, encoding="utf-8") as f:
+        assert json.load(f) == [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+    assert _store(tmp_path).load() == [{"name": n} for n in "abcd"]
+
+
+def test_crash_between_snapshot_write_and_log_removal(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    store.apply({"op": "append", "item": {"name": "a"}})
+    store.apply({"op": "append", "item": {"name": "b"}})
+
+    def crash(path):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr("utils.storage.os.remove", crash)
+    try:
+        store.compact()
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+
+    # スナップショットに反映済みのログは再生しない（append が二重にならない）
+    restarted = _store(tmp_path)
+    assert restarted.load() == [{"name": "a"}, {"name": "b"}]
+    restarted.apply({"op": "append", "item": {"name": "c"}})
+    assert _store(tmp_path).load() == [{"name": n} for n in "abc"]
+
+
+def test_corrupt_snapshot_is_moved_aside_and_log_replayed(tmp_path):
+    store = _store(tmp_path)
+    store.apply({"op": "append", "item": {"name": "a"}})
+    with open(store.path, "w", encoding="utf-8") as f:
+        f.write("[{")
+
+    restarted = _store(tmp_path)
+    assert restarted.load() == [{"name": "a"}]
+    assert restarted.last_error
+    restarted.apply({"op": "append", "item": {"name": "b"}})
+    assert _store(tmp_path).load() == [{"name": "a"}, {"name": "b"}]
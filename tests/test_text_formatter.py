@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from utils.text_formatter import MAX_OUTPUT_TOKENS, TOKENS_PER_PAGE, PageTokenEstimate, scenario_generation_config
+
+
+def _response(tokens, finish_reason="STOP"):
+    return SimpleNamespace(usage_metadata=SimpleNamespace(candidates_token_count=tokens),
+                           candidates=[SimpleNamespace(finish_reason=finish_reason)])
+
+
+def _scenario(pages):
+    return "\n".join(f"--- P{i} ---\n（ト書き: 教室）\n【太郎】セリフ" for i in range(1, pages + 1))
+
+
+def test_budget_without_measurements_leaves_room_per_page():
+    estimate = PageTokenEstimate()
+
+    assert estimate.per_page() == TOKENS_PER_PAGE
+    assert scenario_generation_config(15)["max_output_tokens"] <= MAX_OUTPUT_TOKENS
+    assert scenario_generation_config(5, 3)["max_output_tokens"] == MAX_OUTPUT_TOKENS
+
+
+def test_budget_follows_measured_usage():
+    estimate = PageTokenEstimate()
+    estimate.observe(_response(3000), _scenario(10))
+    # 出力の上限で切れたものは実測値に含めない
+    estimate.observe(_response(8192, "MAX_TOKENS"), _scenario(5))
+
+    assert estimate.per_page() == 450
+
+
+def test_scenario_config_uses_shared_estimate(monkeypatch):
+    estimate = PageTokenEstimate()
+    estimate.observe(_response(1000), _scenario(10))
+    monkeypatch.setattr("utils.text_formatter.page_tokens", estimate)
+
+    assert scenario_generation_config(8)["max_output_tokens"] == 8 * 150 + 256
@@ -0,0 +1,30 @@
+import os
+
+from utils.text_store import TextStore
+
+
+def test_default_spill_dir_is_not_shared():
+    first, second = TextStore(), TextStore()
+
+    assert first.spill_dir != second.spill_dir
+    assert os.path.isdir(first.spill_dir)
+
+
+def test_spilled_text_round_trip():
+    store = TextStore(idle_seconds=0)
+    ref = store.put("退職前にもらえる給付金" * 200)
+
+    assert store.spill_idle(force=True) == 1
+    assert os.listdir(store.spill_dir)
+    assert store.get(ref) == "退職前にもらえる給付金" * 200
+
+
+def test_missing_spilled_file_returns_none():
+    store = TextStore(idle_seconds=0)
+    ref = store.put("退職前にもらえる給付金")
+    store.spill_idle(force=True)
+    for name in os.listdir(store.spill_dir):
+        os.remove(os.path.join(store.spill_dir, name))
+
+    assert store.get(ref) is None
+    assert store.get(ref) is None
@@ -0,0 +1,61 @@
+import pytest
+
+from utils.circuit_breaker import HALF_OPEN
+from utils.transcription import Transcript, TranscriptionBackend
+from utils.transcription_backends import TranscriptionRouter
+
+
+class FailingBackend(TranscriptionBackend):
+    name = "gladia"
+
+    def __init__(self):
+        self.calls = 0
+
+    def transcribe_file(self, file_path, language="ja", diarization=False, num_speakers=None):
+        self.calls += 1
+        return None
+
+
+class WorkingBackend(TranscriptionBackend):
+    name = "whisper"
+
+    def transcribe_file(self, file_path, language="ja", diarization=False, num_speakers=None):
+        transcript = Transcript()
+        transcript.text = "こんにちは"
+        return transcript
+
+
+def test_backend_must_implement_transcribe_file():
+    with pytest.raises(TypeError):
+        TranscriptionBackend()
+
+
+def test_router_respects_half_open_probe_limit(tmp_path):
+    failing = FailingBackend()
+    router = TranscriptionRouter({"gladia": failing}, mode="gladia", failure_threshold=1, cooldown=60)
+    path = str(tmp_path / "missing.wav")
+
+    assert router.transcribe_file(path) == (None, None)
+    assert failing.calls == 1
+    # 停止中は呼ばない
+    assert router.transcribe_file(path) == (None, None)
+    assert failing.calls == 1
+
+    # half-open では試行枠（1回）を使っている間、他の呼び出しは通さない
+    breaker = router._breakers["gladia"]
+    breaker._opened_at -= 61
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert router.transcribe_file(path) == (None, None)
+    assert failing.calls == 1
+
+
+def test_router_falls_back_past_open_backend(tmp_path):
+    failing = FailingBackend()
+    router = TranscriptionRouter({"gladia": failing, "whisper": WorkingBackend()}, failure_threshold=1)
+    path = str(tmp_path / "missing.wav")
+
+    transcript, name = router.transcribe_file(path)
+    assert (transcript.text, name, failing.calls) == ("こんにちは", "whisper", 1)
+    transcript, name = router.transcribe_file(path)
+    assert (name, failing.calls) == ("whisper", 1)
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    プロセス共通のイベントループ（専用スレッドで常駐）を取得
+
+    非同期クライアントのコネクションプールやセマフォはこのループに紐付くため、
+    同期APIからの呼び出しはすべてこのループ上で実行する
+    """
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="async-runner", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def submit(coro) -> Future:
+    """コルーチンを共通ループで実行し、concurrent.futures.Future を返す（キャンセル可能）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro, timeout: Optional[float] = None):
+    """コルーチンを共通ループで実行して結果を待つ（同期APIのラッパー用）"""
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
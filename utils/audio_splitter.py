@@ -0,0 +1,210 @@
+import importlib.util
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils.startup import timed_import
+
+# 分割・無音検出に使う音声の形式（16kHz モノラル 16bit）
+SAMPLE_RATE = 16000
+# 無音検出のフレーム長（秒）
+FRAME_SECONDS = 0.03
+# 無音とみなす音量（ノイズフロアからの差, dB）
+SILENCE_MARGIN_DB = 12.0
+
+
+class AudioChunk(NamedTuple):
+    path: str
+    offset: float
+    duration: float
+
+
+def media_duration(file_path: str, timeout: float = 30) -> Optional[float]:
+    """
+    動画・音声の長さ（秒）
+
+    WAVは標準ライブラリ、それ以外は ffprobe、なければ PyAV（faster-whisper の依存）で取得する。
+    どれも使えなければNone
+    """
+    if file_path.lower().endswith(".wav"):
+        try:
+            with wave.open(file_path, "rb") as w:
+                return w.getnframes() / w.getframerate()
+        except (OSError, wave.Error, ZeroDivisionError) as e:
+            print(f"長さの取得エラー（wave）: {e}")
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is not None:
+        try:
+            completed = subprocess.run([ffprobe, "-v", "error", "-show_entries", "format=duration",
+                                        "-of", "default=noprint_wrappers=1:nokey=1", file_path],
+                                       capture_output=True, text=True, timeout=timeout)
+            return float(completed.stdout.strip())
+        except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+            print(f"長さの取得エラー（ffprobe）: {e}")
+    if importlib.util.find_spec("av") is not None:
+        try:
+            import av
+            with av.open(file_path) as container:
+                if container.duration:
+                    return container.duration / av.time_base
+        except Exception as e:
+            print(f"長さの取得エラー（PyAV）: {e}")
+    return None
+
+
+def _decode_wav(file_path: str):
+    """16bit PCM の WAV を (モノラルのサンプル, サンプルレート) で読み込む"""
+    import numpy as np
+    with wave.open(file_path, "rb") as w:
+        if w.getsampwidth() != 2:
+            return None
+        channels, rate = w.getnchannels(), w.getframerate()
+        samples = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+    if channels > 1:
+        samples = samples[::channels]
+    return samples, rate
+
+
+def decode_audio(file_path: str, timeout: float = 600):
+    """
+    動画・音声を (16bit モノラルのサンプル配列, サンプルレート) にデコード
+
+    WAVは標準ライブラリ、それ以外は ffmpeg、なければ PyAV を使う。どれも使えなければNone
+    """
+    with timed_import("numpy"):
+        import numpy as np
+    if file_path.lower().endswith(".wav"):
+        try:
+            decoded = _decode_wav(file_path)
+            if decoded is not None:
+                return decoded
+        except (OSError, wave.Error) as e:
+            print(f"音声デコードエラー（wave）: {e}")
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        try:
+            completed = subprocess.run([ffmpeg, "-nostdin", "-v", "error", "-i", file_path, "-vn",
+                                        "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+                                       capture_output=True, timeout=timeout, check=True)
+            return np.frombuffer(completed.stdout, dtype="<i2"), SAMPLE_RATE
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"音声デコードエラー（ffmpeg）: {e}")
+    if importlib.util.find_spec("av") is not None:
+        try:
+            import av
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+            chunks = []
+            with av.open(file_path) as container:
+                for frame in container.decode(audio=0):
+                    chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(frame))
+            return (np.concatenate(chunks) if chunks else np.zeros(0, dtype="<i2")), SAMPLE_RATE
+        except Exception as e:
+            print(f"音声デコードエラー（PyAV）: {e}")
+    return None
+
+
+def find_silences(samples, rate: int, min_silence: float = 0.3) -> List[Tuple[float, float]]:
+    """
+    無音区間の (開始秒, 終了秒) のリスト
+
+    FRAME_SECONDS ごとの音量（RMS, dB）を求め、ノイズフロア（下位10%）から SILENCE_MARGIN_DB 以内の
+    フレームが min_silence 秒以上続く区間を無音とする
+    """
+    import numpy as np
+    frame = max(1, int(rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    # 長い音声でもメモリを抑えるため、float に変換するのはブロックごと
+    power = np.empty(count, dtype=np.float64)
+    block = 10000
+    for begin in range(0, count, block):
+        end = min(count, begin + block)
+        frames = samples[begin * frame:end * frame].astype(np.float32).reshape(end - begin, frame)
+        power[begin:end] = np.einsum("ij,ij->i", frames, frames) / frame
+    db = 10 * np.log10(power + 1.0)
+    threshold = np.percentile(db, 10) + SILENCE_MARGIN_DB
+
+    silences = []
+    quiet = np.concatenate(([False], db < threshold, [False]))
+    edges = np.flatnonzero(quiet[1:] != quiet[:-1])
+    for begin, end in zip(edges[::2], edges[1::2]):
+        if (end - begin) * FRAME_SECONDS >= min_silence:
+            silences.append((float(begin * frame / rate), float(end * frame / rate)))
+    return silences
+
+
+def plan_segments(silences: List[Tuple[float, float]], total: float, target_seconds: float,
+                  max_seconds: float) -> List[Tuple[float, float]]:
+    """
+    無音区間の中央で区切った (開始秒, 終了秒) のリスト
+
+    各区間がなるべく target_seconds に近く、max_seconds を超えないよう、長い無音を優先して区切る。
+    区切れる無音がなければ max_seconds の位置で区切る
+    """
+    segments = []
+    start = 0.0
+    min_seconds = target_seconds / 2
+    lengths = {(s + e) / 2: e - s for s, e in silences}
+    while total - start > max_seconds:
+        ideal = start + target_seconds
+        candidates = [mid for mid in lengths if start + min_seconds <= mid <= start + max_seconds]
+        if candidates:
+            cut = min(candidates, key=lambda mid: abs(mid - ideal) - 10 * min(lengths[mid], 1.0))
+        else:
+            cut = start + max_seconds
+        segments.append((start, cut))
+        start = cut
+    segments.append((start, total))
+    return segments
+
+
+def split_audio(file_path: str, target_seconds: float = 120, max_seconds: Optional[float] = None,
+                out_dir: Optional[str] = None) -> Optional[List[AudioChunk]]:
+    """
+    長い音声を無音の位置で区切り、区間ごとのWAVファイルに書き出す
+
+    max_seconds（省略時は target_seconds の1.5倍）以下の音声は分割せず、元のファイル1つを返す。
+
+    Returns:
+        AudioChunk のリスト（offset は元の音声での開始秒）。デコードできなければNone
+    """
+    max_seconds = max_seconds or target_seconds * 1.5
+    # 長さが分かれば、短い音声はデコードせずに済ませる
+    duration = media_duration(file_path)
+    if duration is not None and duration <= max_seconds:
+        return [AudioChunk(file_path, 0.0, duration)]
+    decoded = decode_audio(file_path)
+    if decoded is None:
+        return None
+    samples, rate = decoded
+    total = len(samples) / rate
+    if total <= max_seconds:
+        return [AudioChunk(file_path, 0.0, total)]
+
+    segments = plan_segments(find_silences(samples, rate), total, target_seconds, max_seconds)
+    out_dir = out_dir or tempfile.mkdtemp(prefix="audio_chunks_")
+    chunks = []
+    for index, (start, end) in enumerate(segments):
+        path = os.path.join(out_dir, f"chunk_{index:03d}.wav")
+        with wave.open(path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(samples[int(start * rate):int(end * rate)].tobytes())
+        chunks.append(AudioChunk(path, start, end - start))
+    print(f"音声を{len(chunks)}区間に分割しました（{total:.0f}秒）")
+    return chunks
+
+
+def remove_chunks(chunks: Optional[List[AudioChunk]], original: str):
+    """split_audio が書き出したファイルを削除（元のファイルは残す）"""
+    for chunk in chunks or []:
+        if chunk.path != original and os.path.exists(chunk.path):
+            os.remove(chunk.path)
+            directory = os.path.dirname(chunk.path)
+            if not os.listdir(directory):
+                os.rmdir(directory)
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+from utils.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 例外の型（MRO）にこれらの名前があればバックエンド側の障害とみなす（httpx / google-auth の通信エラーなど）
+_TRANSIENT_ERROR_NAMES = ("TransportError", "TimeoutException", "NetworkError", "ServiceUnavailable",
+                          "DeadlineExceeded", "InternalServerError", "ResourceExhausted", "TooManyRequests")
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    バックエンドの障害（タイムアウト・通信エラー・429・5xx）か
+
+    リクエスト内容の誤り（400番台）などはバックエンドが正常に応答しているので含めない
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return any(cls.__name__ in _TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} は障害のため一時停止中です（あと{retry_in:.0f}秒で再試行）")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    バックエンドごとのサーキットブレーカー
+
+    - closed: 通常どおり呼び出す。直近 window 回（min_calls 回以上）の失敗率が failure_rate 以上になったら open
+    - open: open_seconds の間は呼び出さずにすぐ失敗させる（タイムアウトを待たない）
+    - half_open: open_seconds 経過後、half_open_probes 回だけ試しに呼び出す。成功すれば closed、失敗すれば再び open
+    allow() が True を返した呼び出しは、結果を record() するか、結果がない場合（キャンセル）は release() する
+    """
+
+    def __init__(self, name: str, window: int = 20, failure_rate: float = 0.5, min_calls: int = 5,
+                 open_seconds: float = 30.0, half_open_probes: int = 1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _advance(self, now: float):
+        """open の期間が過ぎていれば half_open に移る（ロック内で呼ぶ）"""
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+        elif self._state == HALF_OPEN and self._probes and now - self._opened_at >= self.open_seconds * 2:
+            # 結果が返ってこない試行（プロセス外で止まったなど）で half_open のまま止まらないようにする
+            self._probes = 0
+            self._opened_at = now - self.open_seconds
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._results.clear()
+        metrics.count("circuit_opened", self.name, "breaker")
+        print(f"{self.name} の呼び出しを{self.open_seconds:.0f}秒間停止します（失敗が続いたため）")
+
+    def allow(self) -> bool:
+        """呼び出してよいか"""
+        with self._lock:
+            self._advance(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def record(self, success: bool):
+        """呼び出しの結果を記録"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success:
+                    self._state = CLOSED
+                    self._results.clear()
+                    print(f"{self.name} の呼び出しを再開します")
+                else:
+                    self._open(now)
+                return
+            if self._state == OPEN:
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._open(now)
+
+    def release(self):
+        """結果のないまま終わった呼び出し（キャンセルなど）の試行枠を返す"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._state
+
+    def retry_in(self) -> float:
+        """次に試行できるまでの秒数"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def snapshot(self) -> dict:
+        """状態（画面表示用）"""
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            calls = len(self._results)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "calls": calls,
+                "failure_rate": self._results.count(False) / calls if calls else 0.0,
+                "retry_in": max(0.0, self._opened_at + self.open_seconds - now) if self._state == OPEN else 0.0,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._results.clear()
+            self._probes = 0
+
+
+class CircuitBreakers:
+    """名前ごとのサーキットブレーカー（プロセス内で共有）"""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **self.defaults)
+                self._breakers[name] = breaker
+            return breaker
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.snapshot() for breaker in breakers]
+
+    def reset(self):
+        """すべて closed に戻す"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        for breaker in breakers:
+            breaker.reset()
+
+
+# プロセス共通のインスタンス
+breakers = CircuitBreakers()
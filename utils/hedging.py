@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Optional
+
+from utils.metrics import metrics
+
+
+class HedgePolicy:
+    """
+    遅い呼び出しに複製（ヘッジ）を出すかの判断
+
+    - 待つ時間: メソッドの直近のレイテンシの quantile 分位点（min_delay 以上）。
+      計測が min_samples 回未満のメソッドはヘッジしない
+    - 予算: 呼び出し1回ごとに budget ずつ貯まり、ヘッジ1回で1を使う（最大 burst まで貯まる）。
+      ヘッジの割合は長期的に budget 以下になる
+    """
+
+    def __init__(self, quantile: float = 0.9, budget: float = 0.15, burst: float = 3.0,
+                 min_samples: int = 10, min_delay: float = 0.1):
+        self.quantile = quantile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self, backend: str, method: str) -> Optional[float]:
+        """ヘッジを出すまでの秒数（ヘッジしない場合はNone）"""
+        if metrics.sample_count(backend, method) < self.min_samples:
+            return None
+        latency = metrics.quantile(backend, method, self.quantile)
+        return max(self.min_delay, latency) if latency is not None else None
+
+    def record_call(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def acquire(self) -> bool:
+        """予算が残っていればヘッジ1回分を使う"""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+async def hedged(factory: Callable[[], Awaitable], policy: HedgePolicy, backend: str, method: str):
+    """
+    factory() の呼び出しが policy の待ち時間を超えたら同じ呼び出しをもう1つ出し、先に成功した方の結果を返す
+
+    遅い方はキャンセルする。片方が失敗した（外からキャンセルされた場合も含む）場合はもう片方を待ち、
+    両方失敗したら後の例外を送出する
+    """
+    policy.record_call()
+    delay = policy.delay(backend, method)
+    first = asyncio.ensure_future(factory())
+    tasks = [first]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if policy.acquire():
+                    metrics.count("hedged", backend, method)
+                    print(f"{backend}.{method} が{delay:.1f}秒以上かかっているため同じリクエストをもう1つ送ります")
+                    tasks.append(asyncio.ensure_future(factory()))
+                else:
+                    metrics.count("hedge_skipped", backend, method)
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    # 外からキャンセルされた試行は失敗として扱い、もう片方を待つ
+                    error = error or asyncio.CancelledError()
+                    continue
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.count("hedge_wins", backend, method)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# Gemini の呼び出しで共有する予算
+gemini_hedge_policy = HedgePolicy()
@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import Future
+from typing import Optional, Hashable
+
+from utils.async_runner import submit
+
+
+class GenerationJob:
+    """実行中の生成リクエスト（共通イベントループ上のタスク）"""
+
+    def __init__(self, kind: str, signature: Hashable, future: Future, meta: Optional[dict] = None):
+        self.kind = kind
+        self.signature = signature
+        self.future = future
+        self.meta = meta or {}
+        self.started_at = time.time()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def cancel(self) -> bool:
+        """タスクをキャンセル（実行中のAPIリクエストも中断される）"""
+        return self.future.cancel()
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    def result(self):
+        """結果を取得（失敗時はNone）"""
+        if self.future.cancelled():
+            return None
+        try:
+            return self.future.result()
+        except Exception as e:
+            print(f"生成ジョブエラー ({self.kind}): {type(e).__name__}: {e}")
+            return None
+
+
+class JobTracker:
+    """
+    セッションごとの生成ジョブ管理
+
+    種類（kind）ごとに1つだけ実行し、新しいリクエストや設定変更で古いものをキャンセルする
+    """
+
+    def __init__(self):
+        self._jobs = {}
+
+    def start(self, kind: str, signature: Hashable, coro, meta: Optional[dict] = None) -> GenerationJob:
+        """ジョブを開始（同じ種類の実行中ジョブはキャンセル）"""
+        if self.cancel(kind):
+            print(f"実行中の{kind}ジョブを新しいリクエストで置き換えました")
+        job = GenerationJob(kind, signature, submit(coro), meta)
+        self._jobs[kind] = job
+        return job
+
+    def get(self, kind: str) -> Optional[GenerationJob]:
+        return self._jobs.get(kind)
+
+    def running(self, kind: str) -> bool:
+        job = self._jobs.get(kind)
+        return job is not None and not job.done()
+
+    def cancel(self, kind: str) -> bool:
+        """実行中のジョブをキャンセル。キャンセルした場合はTrue"""
+        job = self._jobs.pop(kind, None)
+        if job is None or job.done():
+            return False
+        return job.cancel()
+
+    def cancel_stale(self, kind: str, signature: Hashable) -> bool:
+        """実行中のジョブの設定が現在の設定と異なればキャンセル。キャンセルした場合はTrue"""
+        job = self._jobs.get(kind)
+        if job is None or job.done() or job.signature == signature:
+            return False
+        return self.cancel(kind)
+
+    def pop(self, kind: str) -> Optional[GenerationJob]:
+        """完了したジョブを取り出す"""
+        job = self._jobs.get(kind)
+        if job is None or not job.done():
+            return None
+        return self._jobs.pop(kind)
+
+    def cancel_all(self):
+        for kind in list(self._jobs):
+            self.cancel(kind)
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Optional, List
+
+# 出力先（環境変数で上書き可能 / 空文字で無効化）
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_JSON_LOG_PATH = os.path.join(_BASE_DIR, "logs", "metrics.jsonl")
+DEFAULT_PROM_PATH = os.path.join(_BASE_DIR, "logs", "metrics.prom")
+# JSONログがこのサイズ（MB）を超えたら .1 に退避して新しく書き始める（0でローテーションしない）
+DEFAULT_JSON_LOG_MAX_MB = 10
+
+
+class CallRecord:
+    """外部API呼び出し1回分の計測結果"""
+
+    __slots__ = ("backend", "method", "started_at", "duration", "status", "error_class",
+                 "prompt_tokens", "response_tokens", "retries", "cache_hit")
+
+    def __init__(self, backend: str, method: str):
+        self.backend = backend
+        self.method = method
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = "ok"
+        self.error_class = None
+        self.prompt_tokens = None
+        self.response_tokens = None
+        self.retries = 0
+        self.cache_hit = False
+
+    def fail(self, error_class: str):
+        """呼び出し元で例外を握りつぶす場合などに失敗として記録"""
+        self.status = "error"
+        self.error_class = error_class
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Metrics:
+    """
+    外部API呼び出しのレイテンシ・トークン数・リトライ・キャッシュヒット・エラーを集計
+
+    - 1呼び出しごとにJSON Lines形式でログ出力（json_log_max_bytes を超えたら .1 にローテーション。世代は1つだけ）
+    - Prometheusテキスト形式で集計結果を出力（ファイル / 文字列）
+    """
+
+    def __init__(self, json_log_path: Optional[str] = None, prom_path: Optional[str] = None,
+                 window: int = 1000, prom_interval: float = 10.0,
+                 json_log_max_bytes: int = DEFAULT_JSON_LOG_MAX_MB * 1024 * 1024):
+        self.json_log_path = json_log_path
+        self.json_log_max_bytes = json_log_max_bytes
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._calls = defaultdict(int)  # (backend, method, status) -> 件数
+        self._errors = defaultdict(int)  # (backend, method, error_class) -> 件数
+        self._tokens = defaultdict(int)  # (backend, method, kind) -> トークン数
+        self._counters = defaultdict(int)  # (name, backend, method) -> 件数
+        self._duration_sum = defaultdict(float)
+        self._last_prom_write = 0.0
+
+    @contextmanager
+    def track(self, backend: str, method: str):
+        """
+        with文で囲んだ区間を1回の呼び出しとして計測
+
+        例外はエラー（キャンセルは "cancelled"）として記録した上でそのまま再送出する
+        """
+        record = CallRecord(backend, method)
+        start = time.perf_counter()
+        try:
+            yield record
+        except asyncio.CancelledError:
+            record.status = "cancelled"
+            raise
+        except BaseException as e:
+            record.fail(type(e).__name__)
+            raise
+        finally:
+            record.duration = time.perf_counter() - start
+            self.record(record)
+
+    def record(self, record: CallRecord):
+        """計測結果を集計に追加してログ出力"""
+        key = (record.backend, record.method)
+        with self._lock:
+            # 途中でキャンセルした呼び出し（ヘッジで負けた方など）はレイテンシの分布に含めない
+            if record.status != "cancelled":
+                self._durations[key].append(record.duration)
+            self._duration_sum[key] += record.duration
+            self._calls[key + (record.status,)] += 1
+            if record.error_class:
+                self._errors[key + (record.error_class,)] += 1
+            if record.prompt_tokens:
+                self._tokens[key + ("prompt",)] += record.prompt_tokens
+            if record.response_tokens:
+                self._tokens[key + ("response",)] += record.response_tokens
+            if record.retries:
+                self._counters[("retries",) + key] += record.retries
+            if record.cache_hit:
+                self._counters[("cache_hits",) + key] += 1
+
+        self._write_json_log(record.to_dict())
+        self._maybe_write_prometheus()
+
+    def observe(self, backend: str, method: str, duration: float):
+        """with文を使わずに所要時間だけを記録（画面の再実行時間など）"""
+        record = CallRecord(backend, method)
+        record.duration = duration
+        self.record(record)
+
+    def count(self, name: str, backend: str, method: str, n: int = 1):
+        """任意のカウンタ（キャッシュヒット数など）を加算"""
+        with self._lock:
+            self._counters[(name, backend, method)] += n
+
+    def counter(self, name: str, backend: Optional[str] = None, method: Optional[str] = None) -> int:
+        """カウンタの値（backend / method を省略するとその名前のカウンタの合計）"""
+        with self._lock:
+            return sum(n for (counter_name, b, m), n in self._counters.items()
+                       if counter_name == name and backend in (None, b) and method in (None, m))
+
+    def sample_count(self, backend: str, method: str) -> int:
+        """quantile の計算に使う直近の呼び出し数"""
+        with self._lock:
+            return len(self._durations.get((backend, method), ()))
+
+    def quantile(self, backend: str, method: str, q: float) -> Optional[float]:
+        """直近の呼び出しのレイテンシ分位点（秒）"""
+        with self._lock:
+            values = sorted(self._durations.get((backend, method), ()))
+        if not values:
+            return None
+        index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+        return values[index]
+
+    def summary(self) -> List[dict]:
+        """メソッドごとの集計（件数・エラー数・p50/p95・トークン数・まとめられた同時呼び出し数・ヘッジ数）"""
+        with self._lock:
+            keys = sorted(self._durations.keys())
+        rows = []
+        for backend, method in keys:
+            with self._lock:
+                ok = self._calls.get((backend, method, "ok"), 0)
+                error = self._calls.get((backend, method, "error"), 0)
+                cancelled = self._calls.get((backend, method, "cancelled"), 0)
+                prompt_tokens = self._tokens.get((backend, method, "prompt"), 0)
+                response_tokens = self._tokens.get((backend, method, "response"), 0)
+                coalesced = self._counters.get(("coalesced", backend, method), 0)
+                hedged = self._counters.get(("hedged", backend, method), 0)
+            rows.append({
+                "backend": backend,
+                "method": method,
+                "calls": ok + error + cancelled,
+                "errors": error,
+                "p50": self.quantile(backend, method, 0.5),
+                "p95": self.quantile(backend, method, 0.95),
+                "prompt_tokens": prompt_tokens,
+                "response_tokens": response_tokens,
+                "coalesced": coalesced,
+                "hedged": hedged,
+            })
+        return rows
+
+    def to_prometheus(self) -> str:
+        """Prometheusテキスト形式で集計結果を出力"""
+        lines = [
+            "# HELP external_call_duration_seconds Latency of external API calls",
+            "# TYPE external_call_duration_seconds summary",
+        ]
+        with self._lock:
+            durations = {k: sorted(v) for k, v in self._durations.items()}
+            duration_sum = dict(self._duration_sum)
+            calls = dict(self._calls)
+            errors = dict(self._errors)
+            tokens = dict(self._tokens)
+            counters = dict(self._counters)
+
+        for (backend, method), values in sorted(durations.items()):
+            labels = f'backend="{backend}",method="{method}"'
+            for q in (0.5, 0.9, 0.95, 0.99):
+                index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+                lines.append(f'external_call_duration_seconds{{{labels},quantile="{q}"}} {values[index]:.6f}')
+            total = sum(v for k, v in calls.items() if k[:2] == (backend, method))
+            lines.append(f"external_call_duration_seconds_sum{{{labels}}} {duration_sum.get((backend, method), 0.0):.6f}")
+            lines.append(f"external_call_duration_seconds_count{{{labels}}} {total}")
+
+        lines.append("# TYPE external_calls_total counter")
+        for (backend, method, status), n in sorted(calls.items()):
+            lines.append(f'external_calls_total{{backend="{backend}",method="{method}",status="{status}"}} {n}')
+
+        lines.append("# TYPE external_call_errors_total counter")
+        for (backend, method, error_class), n in sorted(errors.items()):
+            lines.append(f'external_call_errors_total{{backend="{backend}",method="{method}",error_class="{error_class}"}} {n}')
+
+        lines.append("# TYPE external_call_tokens_total counter")
+        for (backend, method, kind), n in sorted(tokens.items()):
+            lines.append(f'external_call_tokens_total{{backend="{backend}",method="{method}",kind="{kind}"}} {n}')
+
+        for (name, backend, method), n in sorted(counters.items()):
+            lines.append(f'external_call_{name}_total{{backend="{backend}",method="{method}"}} {n}')
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Optional[str] = None):
+        """Prometheusテキストをファイルに書き出し（node_exporterのtextfile collector向け）"""
+        path = path or self.prom_path
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"メトリクス書き出しエラー: {e}")
+
+    def _maybe_write_prometheus(self):
+        if not self.prom_path:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_prom_write < self.prom_interval:
+                return
+            self._last_prom_write = now
+        self.write_prometheus()
+
+    def _write_json_log(self, entry: dict):
+        if not self.json_log_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.json_log_path), exist_ok=True)
+            line = json.dumps(entry, ensure_ascii=False)
+            with self._lock:
+                with open(self.json_log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                    size = f.tell()
+                if self.json_log_max_bytes and size >= self.json_log_max_bytes:
+                    os.replace(self.json_log_path, self.json_log_path + ".1")
+        except OSError as e:
+            print(f"メトリクスログ書き込みエラー: {e}")
+
+
+# プロセス共通のメトリクス
+metrics = Metrics(
+    json_log_path=os.getenv("METRICS_LOG_PATH", DEFAULT_JSON_LOG_PATH) or None,
+    prom_path=os.getenv("METRICS_PROM_PATH", DEFAULT_PROM_PATH) or None,
+    json_log_max_bytes=int(float(os.getenv("METRICS_LOG_MAX_MB", DEFAULT_JSON_LOG_MAX_MB)) * 1024 * 1024),
+)
+
+
+def record_usage(record: CallRecord, response):
+    """Geminiレスポンスのusage_metadataからトークン数を記録"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    record.prompt_tokens = getattr(usage, "prompt_token_count", None)
+    record.response_tokens = getattr(usage, "candidates_token_count", None)
@@ -0,0 +1,285 @@
+import hashlib
+import json
+import random
+import shutil
+import sqlite3
+import struct
+import subprocess
+import threading
+import time
+import unicodedata
+from typing import Optional, List
+
+from utils.project_store import DEFAULT_DB_PATH
+from utils.startup import timed_import
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS minhash_signatures (
+    project_id INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS minhash_bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    project_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_minhash_bands_bucket ON minhash_bands(band, bucket);
+CREATE INDEX IF NOT EXISTS idx_minhash_bands_project_id ON minhash_bands(project_id);
+
+CREATE TABLE IF NOT EXISTS audio_fingerprints (
+    project_id INTEGER PRIMARY KEY,
+    duration REAL NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_duration ON audio_fingerprints(duration);
+"""
+
+# 句読点・記号・空白は比較から除外する（整形や再エンコードで変わりやすいため）
+_IGNORED_CATEGORIES = ("P", "Z", "S", "C")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# 署名を計算するときに一度に扱うシングルの数（num_perm × この数の配列を作る）
+_SHINGLE_CHUNK = 4096
+
+
+def normalize(text: str) -> str:
+    """比較用に正規化（NFKC・小文字化・句読点と空白の除去）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith(_IGNORED_CATEGORIES))
+
+
+def shingles(text: str, k: int = 5) -> set:
+    """文字 k-gram の集合（ハッシュ値）"""
+    text = normalize(text)
+    if len(text) < k:
+        return {_hash64(text)} if text else set()
+    return {_hash64(text[i:i + k]) for i in range(len(text) - k + 1)}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _mod_mersenne(np, x):
+    """x mod (2^61 - 1)（x は 2^64 未満の uint64 配列）"""
+    p = np.uint64(_MERSENNE_PRIME)
+    x = (x & p) + (x >> np.uint64(61))
+    return np.where(x >= p, x - p, x)
+
+
+def _mul_add_mod(np, a, h, b):
+    """
+    (a * h + b) mod (2^61 - 1) を uint64 のままオーバーフローなしで計算
+
+    a, b: (num_perm, 1) の 2^61 - 1 未満の値、h: (1, n) の 2^61 - 1 未満の値。
+    32ビットずつに分けて掛け、2^61 ≡ 1 を使って桁を畳み込む
+    """
+    low = np.uint64(0xFFFFFFFF)
+    a1, a0 = a >> np.uint64(32), a & low
+    h1, h0 = h >> np.uint64(32), h & low
+    # a*h = a1*h1*2^64 + (a1*h0 + a0*h1)*2^32 + a0*h0、2^64 ≡ 8
+    high = (a1 * h1) << np.uint64(3)
+    middle = a1 * h0 + a0 * h1
+    middle = (middle >> np.uint64(29)) + ((middle & np.uint64((1 << 29) - 1)) << np.uint64(32))
+    result = _mod_mersenne(np, high + middle)
+    result = _mod_mersenne(np, result + _mod_mersenne(np, a0 * h0))
+    return _mod_mersenne(np, result + b)
+
+
+class MinHasher:
+    """MinHash 署名（num_perm 個のハッシュ関数それぞれの最小値。numpy でまとめて計算）"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        with timed_import("numpy"):
+            import numpy as np
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._a = np.array([a for a, _ in params], dtype=np.uint64).reshape(-1, 1)
+        self._b = np.array([b for _, b in params], dtype=np.uint64).reshape(-1, 1)
+
+    def signature(self, text: str) -> Optional[List[int]]:
+        import numpy as np
+        hashes = shingles(text)
+        if not hashes:
+            return None
+        values = _mod_mersenne(np, np.fromiter(hashes, dtype=np.uint64, count=len(hashes)))
+        signature = np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(values), _SHINGLE_CHUNK):
+            chunk = values[start:start + _SHINGLE_CHUNK].reshape(1, -1)
+            np.minimum(signature, _mul_add_mod(np, self._a, chunk, self._b).min(axis=1), out=signature)
+        return signature.tolist()
+
+    @staticmethod
+    def similarity(sig1: List[int], sig2: List[int]) -> float:
+        """推定Jaccard類似度"""
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+def audio_fingerprint(file_path: str, timeout: float = 120) -> Optional[dict]:
+    """
+    Chromaprint（fpcalc）で音声フィンガープリントを計算
+
+    fpcalc がインストールされていない場合はNone（テキストの比較のみ行う）
+    """
+    fpcalc = shutil.which("fpcalc")
+    if fpcalc is None:
+        return None
+    try:
+        completed = subprocess.run([fpcalc, "-raw", "-json", "-length", "600", file_path],
+                                   capture_output=True, text=True, timeout=timeout)
+        result = json.loads(completed.stdout)
+        return {"duration": float(result["duration"]), "fingerprint": [int(x) for x in result["fingerprint"]]}
+    except (OSError, subprocess.TimeoutExpired, ValueError, KeyError) as e:
+        print(f"音声フィンガープリント計算エラー: {e}")
+        return None
+
+
+def _bit_counts(np, values):
+    """uint32 配列の各要素の立っているビット数"""
+    if hasattr(np, "bitwise_count"):  # numpy 2.0 以降
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(len(values), 32).sum(axis=1)
+
+
+def fingerprint_similarity(fp1: List[int], fp2: List[int], max_offset: int = 80) -> float:
+    """
+    フィンガープリントの一致率（ずらし位置のうち最もビットが一致する位置での値）
+
+    max_offset: 前後にずらす最大フレーム数（約8フレーム/秒。冒頭・末尾のカットに対応）
+    """
+    with timed_import("numpy"):
+        import numpy as np
+    a = (np.asarray(fp1, dtype=np.int64) & 0xFFFFFFFF).astype(np.uint32)
+    b = (np.asarray(fp2, dtype=np.int64) & 0xFFFFFFFF).astype(np.uint32)
+    best = 0.0
+    for offset in range(-max_offset, max_offset + 1):
+        x = a[max(0, offset):]
+        y = b[max(0, -offset):]
+        n = min(len(x), len(y))
+        if n < 40:
+            continue
+        errors = int(_bit_counts(np, x[:n] ^ y[:n]).sum())
+        best = max(best, 1.0 - errors / (32 * n))
+    return best
+
+
+class DuplicateIndex:
+    """
+    似た入力（再エンコード・一部カットした同じ動画など）の検出
+
+    - 文字起こしテキスト: 文字 5-gram の MinHash 署名を LSH（bands × rows）で索引
+    - 音声: fpcalc のフィンガープリント（任意）を長さで絞り込んで比較
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, num_perm: int = 128, bands: int = 32,
+                 threshold: float = 0.6, audio_threshold: float = 0.85):
+        self.db_path = db_path
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.audio_threshold = audio_threshold
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _buckets(self, signature: List[int]):
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(struct.pack(f"<{self.rows}Q", *values), digest_size=8).digest()
+            yield band, int.from_bytes(digest, "little", signed=True)
+
+    def add_text(self, project_id: int, text: str):
+        """プロジェクトの文字起こしを登録（同じプロジェクトの既存の登録は置き換え）"""
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM minhash_bands WHERE project_id = ?", (project_id,))
+                conn.execute("INSERT OR REPLACE INTO minhash_signatures (project_id, signature, created_at)"
+                             " VALUES (?, ?, ?)",
+                             (project_id, struct.pack(f"<{len(signature)}Q", *signature), time.time()))
+                conn.executemany("INSERT INTO minhash_bands (band, bucket, project_id) VALUES (?, ?, ?)",
+                                 [(band, bucket, project_id) for band, bucket in self._buckets(signature)])
+        except sqlite3.Error as e:
+            print(f"類似検出インデックス更新エラー: {e}")
+
+    def find_text(self, text: str, exclude: Optional[int] = None, limit: int = 3) -> List[dict]:
+        """
+        似た文字起こしのプロジェクトを検索
+
+        Returns:
+            project_id, similarity の辞書のリスト（類似度の高い順）
+        """
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return []
+        try:
+            conn = self._connect()
+            candidates = set()
+            for band, bucket in self._buckets(signature):
+                for row in conn.execute("SELECT project_id FROM minhash_bands WHERE band = ? AND bucket = ?",
+                                        (band, bucket)):
+                    candidates.add(row["project_id"])
+            candidates.discard(exclude)
+            matches = []
+            for project_id in candidates:
+                row = conn.execute("SELECT signature FROM minhash_signatures WHERE project_id = ?",
+                                   (project_id,)).fetchone()
+                if row is None:
+                    continue
+                stored = list(struct.unpack(f"<{len(row['signature']) // 8}Q", row["signature"]))
+                similarity = MinHasher.similarity(signature, stored)
+                if similarity >= self.threshold:
+                    matches.append({"project_id": project_id, "similarity": similarity})
+        except sqlite3.Error as e:
+            print(f"類似検出エラー: {e}")
+            return []
+        matches.sort(key=lambda m: m["similarity"], reverse=True)
+        return matches[:limit]
+
+    def add_audio(self, project_id: int, fingerprint: dict):
+        """プロジェクトの音声フィンガープリントを登録"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO audio_fingerprints (project_id, duration, fingerprint)"
+                             " VALUES (?, ?, ?)",
+                             (project_id, fingerprint["duration"], json.dumps(fingerprint["fingerprint"])))
+        except sqlite3.Error as e:
+            print(f"音声フィンガープリント登録エラー: {e}")
+
+    def find_audio(self, fingerprint: dict, exclude: Optional[int] = None, limit: int = 3) -> List[dict]:
+        """似た音声のプロジェクトを検索（長さが0.8〜1.25倍のもののみ比較）"""
+        duration = fingerprint["duration"]
+        try:
+            rows = self._connect().execute(
+                "SELECT project_id, fingerprint FROM audio_fingerprints WHERE duration BETWEEN ? AND ?",
+                (duration * 0.8, duration * 1.25)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"音声類似検出エラー: {e}")
+            return []
+        matches = []
+        for row in rows:
+            if row["project_id"] == exclude:
+                continue
+            similarity = fingerprint_similarity(fingerprint["fingerprint"], json.loads(row["fingerprint"]))
+            if similarity >= self.audio_threshold:
+                matches.append({"project_id": row["project_id"], "similarity": similarity})
+        matches.sort(key=lambda m: m["similarity"], reverse=True)
+        return matches[:limit]
@@ -0,0 +1,307 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, List
+
+# 保存先（環境変数で上書き可能）
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB_PATH = os.path.join(_BASE_DIR, "projects.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    source_key TEXT,
+    character_set TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- ファイル名は部分一致（LIKE '%x%'）で絞り込むためインデックスは使えない（以前のDBからは削除）
+DROP INDEX IF EXISTS idx_projects_filename;
+CREATE INDEX IF NOT EXISTS idx_projects_updated_at ON projects(updated_at);
+CREATE INDEX IF NOT EXISTS idx_projects_character_set ON projects(character_set);
+CREATE INDEX IF NOT EXISTS idx_projects_source_key ON projects(source_key);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    current_version INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE(project_id, kind)
+);
+
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    artifact_id INTEGER NOT NULL REFERENCES artifacts(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    meta TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE(artifact_id, version)
+);
+"""
+
+# 成果物の種類（これ以外は save_artifact で保存しない）
+ARTIFACT_KINDS = ("transcribed_text", "transcript_timings", "formatted_text", "rewritten_text", "variations",
+                  "adopted_scenario", "sns_content")
+
+
+class ProjectStore:
+    """
+    プロジェクト（1本の動画・テキストの作業単位）と成果物のSQLiteストア
+
+    - projects: ファイル名・入力元・キャラクター構成・日時
+    - artifacts: プロジェクトごとの成果物（文字起こし・整形済みテキスト・シナリオ・SNSコンテンツなど）
+    - versions: 成果物の版（書き直しのたびに新しい版を追加）
+
+    DBエラーは画面の処理を止めないよう、ログ出力してNone/空を返す
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # スレッドごとに接続を持つ（Streamlitはセッションごとに別スレッドで実行される）
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def create_project(self, filename: str, source_type: str, source_key: Optional[str] = None,
+                       character_set: str = "") -> Optional[int]:
+        """プロジェクトを作成してIDを返す"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO projects (filename, source_type, source_key, character_set, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (filename, source_type, source_key, character_set, now, now)
+                )
+            return cur.lastrowid
+        except sqlite3.Error as e:
+            print(f"プロジェクト作成エラー: {e}")
+            return None
+
+    def update_project(self, project_id: int, **fields):
+        """プロジェクトのファイル名・キャラクター構成を更新"""
+        fields = {k: v for k, v in fields.items() if k in ("filename", "character_set") and v is not None}
+        if not fields:
+            return
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(f"UPDATE projects SET {assignments}, updated_at = ? WHERE id = ?",
+                             (*fields.values(), time.time(), project_id))
+        except sqlite3.Error as e:
+            print(f"プロジェクト更新エラー: {e}")
+
+    def save_artifact(self, project_id: int, kind: str, content, meta: Optional[dict] = None) -> Optional[int]:
+        """
+        成果物の新しい版を保存（内容が最新版と同じなら保存しない）
+
+        Args:
+            content: 文字列（variations はリストも可、JSONで保存）
+
+        Returns:
+            最新の版番号（失敗時・ARTIFACT_KINDS にない種類はNone）
+        """
+        if kind not in ARTIFACT_KINDS:
+            print(f"成果物保存エラー: 不明な種類です ({kind})")
+            return None
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                row = conn.execute(
+                    "SELECT a.id, a.current_version, v.content FROM artifacts a"
+                    " JOIN versions v ON v.artifact_id = a.id AND v.version = a.current_version"
+                    " WHERE a.project_id = ? AND a.kind = ?",
+                    (project_id, kind)
+                ).fetchone()
+                if row is not None and row["content"] == content:
+                    return row["current_version"]
+                if row is None:
+                    artifact_id = conn.execute(
+                        "INSERT INTO artifacts (project_id, kind, current_version, updated_at) VALUES (?, ?, 1, ?)",
+                        (project_id, kind, now)
+                    ).lastrowid
+                    version = 1
+                else:
+                    artifact_id = row["id"]
+                    version = row["current_version"] + 1
+                    conn.execute("UPDATE artifacts SET current_version = ?, updated_at = ? WHERE id = ?",
+                                 (version, now, artifact_id))
+                conn.execute(
+                    "INSERT INTO versions (artifact_id, version, content, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (artifact_id, version, content, json.dumps(meta, ensure_ascii=False) if meta else None, now)
+                )
+                conn.execute("UPDATE projects SET updated_at = ? WHERE id = ?", (now, project_id))
+            return version
+        except sqlite3.Error as e:
+            print(f"成果物保存エラー ({kind}): {e}")
+            return None
+
+    def list_projects(self, filename: Optional[str] = None, since: Optional[float] = None,
+                      character_set: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """プロジェクト一覧（更新日時の新しい順）"""
+        clauses, params = [], []
+        if filename:
+            clauses.append("filename LIKE ?")
+            params.append(f"%{filename}%")
+        if since is not None:
+            clauses.append("updated_at >= ?")
+            params.append(since)
+        if character_set:
+            clauses.append("character_set = ?")
+            params.append(character_set)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        try:
+            rows = self._connect().execute(
+                f"SELECT * FROM projects {where} ORDER BY updated_at DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+            return [dict(r) for r in rows]
+        except sqlite3.Error as e:
+            print(f"プロジェクト一覧取得エラー: {e}")
+            return []
+
+    def projects_with_artifact(self, kind: str, without: Optional[str] = None) -> List[dict]:
+        """
+        成果物 kind があるプロジェクトの id・ファイル名・更新日時（更新日時の新しい順、件数の上限なし）
+
+        without を指定すると、その成果物がまだないプロジェクトだけ。成果物の内容は読み込まない
+        """
+        sql = ("SELECT p.id, p.filename, p.updated_at FROM projects p"
+               " WHERE EXISTS (SELECT 1 FROM artifacts a WHERE a.project_id = p.id AND a.kind = ?)")
+        params = [kind]
+        if without:
+            sql += " AND NOT EXISTS (SELECT 1 FROM artifacts a WHERE a.project_id = p.id AND a.kind = ?)"
+            params.append(without)
+        try:
+            rows = self._connect().execute(sql + " ORDER BY p.updated_at DESC", params).fetchall()
+            return [dict(r) for r in rows]
+        except sqlite3.Error as e:
+            print(f"プロジェクト一覧取得エラー: {e}")
+            return []
+
+    def latest_contents(self, project_ids: List[int], kind: str) -> dict:
+        """複数プロジェクトの成果物 kind の最新版（project_id -> 内容。ないプロジェクトは含まない）"""
+        contents = {}
+        try:
+            conn = self._connect()
+            # SQLiteのパラメータ数の上限を超えないよう分けて取得
+            for start in range(0, len(project_ids), 500):
+                chunk = project_ids[start:start + 500]
+                rows = conn.execute(
+                    "SELECT a.project_id, v.content FROM artifacts a"
+                    " JOIN versions v ON v.artifact_id = a.id AND v.version = a.current_version"
+                    f" WHERE a.kind = ? AND a.project_id IN ({','.join('?' * len(chunk))})",
+                    (kind, *chunk)
+                ).fetchall()
+                contents.update((r["project_id"], r["content"]) for r in rows)
+        except sqlite3.Error as e:
+            print(f"成果物読み込みエラー ({kind}): {e}")
+        return contents
+
+    def character_sets(self) -> List[str]:
+        """保存済みプロジェクトのキャラクター構成一覧"""
+        try:
+            rows = self._connect().execute(
+                "SELECT DISTINCT character_set FROM projects WHERE character_set != '' ORDER BY character_set"
+            ).fetchall()
+            return [r["character_set"] for r in rows]
+        except sqlite3.Error as e:
+            print(f"キャラクター構成取得エラー: {e}")
+            return []
+
+    def find_by_source(self, source_key: str) -> Optional[dict]:
+        """同じ入力（ファイル・テキストのハッシュ）から作成した最新のプロジェクト"""
+        try:
+            row = self._connect().execute(
+                "SELECT * FROM projects WHERE source_key = ? ORDER BY updated_at DESC LIMIT 1", (source_key,)
+            ).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            print(f"プロジェクト検索エラー: {e}")
+            return None
+
+    def project_summary(self, project_id: int) -> Optional[dict]:
+        """
+        プロジェクトの各列と成果物の種類（成果物の内容は読み込まない）
+
+        Returns:
+            プロジェクトの各列 + "artifact_kinds"（成果物の種類の集合）
+        """
+        try:
+            conn = self._connect()
+            project = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if project is None:
+                return None
+            kinds = {row["kind"] for row in conn.execute("SELECT kind FROM artifacts WHERE project_id = ?",
+                                                         (project_id,))}
+        except sqlite3.Error as e:
+            print(f"プロジェクト読み込みエラー: {e}")
+            return None
+        return {**dict(project), "artifact_kinds": kinds}
+
+    def load_project(self, project_id: int) -> Optional[dict]:
+        """
+        プロジェクトと各成果物の最新版を取得
+
+        Returns:
+            プロジェクトの各列 + "artifacts"（種類 -> 内容、variations はリスト）
+            + "artifact_updated_at"（種類 -> 最終更新日時）
+        """
+        try:
+            conn = self._connect()
+            project = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if project is None:
+                return None
+            rows = conn.execute(
+                "SELECT a.kind, a.updated_at, v.content FROM artifacts a"
+                " JOIN versions v ON v.artifact_id = a.id AND v.version = a.current_version"
+                " WHERE a.project_id = ?",
+                (project_id,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"プロジェクト読み込みエラー: {e}")
+            return None
+
+        artifacts, updated_at = {}, {}
+        for row in rows:
+            content = row["content"]
+            if row["kind"] == "variations":
+                content = json.loads(content)
+            artifacts[row["kind"]] = content
+            updated_at[row["kind"]] = row["updated_at"]
+        return {**dict(project), "artifacts": artifacts, "artifact_updated_at": updated_at}
+
+    def versions(self, project_id: int, kind: str) -> List[dict]:
+        """成果物の全版（古い順）"""
+        try:
+            rows = self._connect().execute(
+                "SELECT v.version, v.content, v.meta, v.created_at FROM versions v"
+                " JOIN artifacts a ON a.id = v.artifact_id"
+                " WHERE a.project_id = ? AND a.kind = ? ORDER BY v.version",
+                (project_id, kind)
+            ).fetchall()
+            return [dict(r) for r in rows]
+        except sqlite3.Error as e:
+            print(f"版一覧取得エラー: {e}")
+            return []
@@ -0,0 +1,341 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Optional, List, Iterable, Tuple
+
+from utils.project_store import DEFAULT_DB_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    project_id INTEGER,
+    fingerprint TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_project_id ON documents(project_id);
+
+-- trigram: 日本語のように単語区切りのないテキストでも部分一致で検索できる
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(content, tokenize='trigram');
+-- 2文字の語（「申請」「退職」など）用: 内容を文字2-gramのトークン列にしたもの（rowid = documents.id）
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_bigram USING fts5(content, tokenize='unicode61');
+"""
+
+# 検索対象にする成果物の種類 -> 文書の種類
+SEARCHABLE_ARTIFACTS = {
+    "transcribed_text": "transcript",
+    "formatted_text": "transcript",
+    "adopted_scenario": "scenario",
+}
+# 同じプロジェクト・同じ種類になる成果物の最大数（重複を除く分だけ多めに取得する）
+_DOCUMENTS_PER_KIND = max(Counter(SEARCHABLE_ARTIFACTS.values()).values())
+
+
+# trigram で検索できる最短の語（これより短い語は2-gramのインデックスで検索）
+MIN_MATCH_CHARS = 3
+# 2-gramのインデックスで検索できる最短の語（1文字の語はLIKE検索にフォールバック）
+MIN_BIGRAM_CHARS = 2
+
+# 2-gramを作る文字の並び（unicode61 が区切りとして扱う記号・空白・_ で分ける）
+_WORD_RUN = re.compile(r"[^\W_]+")
+
+
+def bigram_tokens(text: str) -> List[str]:
+    """文字2-gramのトークン列（1文字だけの並びはその1文字）"""
+    tokens = []
+    for run in _WORD_RUN.findall((text or "").lower()):
+        tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+    return tokens
+
+
+def _bigram_text(text: str) -> str:
+    return " ".join(bigram_tokens(text))
+
+
+def _bigram_query(terms: List[str]) -> str:
+    """語ごとに連続する2-gramのフレーズにしてAND（「給付金」→ "給付 付金"）"""
+    return " ".join('"' + _bigram_text(term) + '"' for term in terms)
+
+
+class SearchIndex:
+    """
+    過去の文字起こし・シナリオの全文検索インデックス（SQLite FTS5）
+
+    documents に文書のメタデータと内容のハッシュを持ち、内容は documents_fts（rowid = documents.id）に格納する。
+    同じ source の内容が変わっていなければ再インデックスしない
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # 2-gramのインデックスがなかった頃の文書を登録
+        conn.execute("INSERT INTO documents_bigram (rowid, content)"
+                     " SELECT rowid, bigram_text(content) FROM documents_fts"
+                     " WHERE rowid NOT IN (SELECT rowid FROM documents_bigram)")
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.create_function("bigram_text", 1, _bigram_text, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def fingerprint(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _upsert(self, conn: sqlite3.Connection, source: str, kind: str, title: str, content: str,
+                project_id: Optional[int], fingerprint: str) -> bool:
+        row = conn.execute("SELECT id, fingerprint FROM documents WHERE source = ?", (source,)).fetchone()
+        if row is not None and row["fingerprint"] == fingerprint:
+            return False
+        now = time.time()
+        if row is None:
+            doc_id = conn.execute(
+                "INSERT INTO documents (source, kind, title, project_id, fingerprint, indexed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (source, kind, title, project_id, fingerprint, now)
+            ).lastrowid
+        else:
+            doc_id = row["id"]
+            conn.execute("UPDATE documents SET kind = ?, title = ?, project_id = ?, fingerprint = ?, indexed_at = ?"
+                         " WHERE id = ?", (kind, title, project_id, fingerprint, now, doc_id))
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+            conn.execute("DELETE FROM documents_bigram WHERE rowid = ?", (doc_id,))
+        conn.execute("INSERT INTO documents_fts (rowid, content) VALUES (?, ?)", (doc_id, content))
+        conn.execute("INSERT INTO documents_bigram (rowid, content) VALUES (?, ?)", (doc_id, _bigram_text(content)))
+        return True
+
+    def add(self, source: str, kind: str, title: str, content: str, project_id: Optional[int] = None) -> bool:
+        """
+        文書を追加・更新
+
+        Returns:
+            インデックスを更新した場合はTrue（内容が変わっていなければFalse）
+        """
+        if not content or not content.strip():
+            return False
+        try:
+            conn = self._connect()
+            with conn:
+                return self._upsert(conn, source, kind, title, content, project_id, self.fingerprint(content))
+        except sqlite3.Error as e:
+            print(f"検索インデックス更新エラー: {e}")
+            return False
+
+    def add_many(self, documents: Iterable[Tuple[str, str, str, str, Optional[int]]], batch_size: int = 500) -> int:
+        """
+        文書をまとめて追加（batch_size 件ごとにコミット）
+
+        Args:
+            documents: (source, kind, title, content, project_id) のイテラブル
+
+        Returns:
+            インデックスを更新した件数
+        """
+        items = ((source, kind, title, content, project_id, self.fingerprint(content or ""))
+                 for source, kind, title, content, project_id in documents)
+        return self._write_batches(items, batch_size)
+
+    def index_directory(self, directory: str, kind: str = "transcript", batch_size: int = 500) -> int:
+        """
+        ディレクトリ配下の .txt ファイルをインデックス（更新時刻・サイズが変わったファイルのみ読み込む）
+
+        Returns:
+            インデックスを更新した件数
+        """
+        try:
+            known = {row["source"]: row["fingerprint"] for row in self._connect().execute(
+                "SELECT source, fingerprint FROM documents WHERE source LIKE 'file:%'"
+            )}
+        except sqlite3.Error as e:
+            print(f"検索インデックス読み込みエラー: {e}")
+            return 0
+
+        def iter_files():
+            for root, _, files in os.walk(directory):
+                for name in sorted(files):
+                    if not name.endswith(".txt"):
+                        continue
+                    path = os.path.abspath(os.path.join(root, name))
+                    try:
+                        stat = os.stat(path)
+                    except OSError as e:
+                        print(f"検索インデックス: {path} を読み込めません: {e}")
+                        continue
+                    source = f"file:{path}"
+                    # 前回と同じ更新時刻・サイズならファイルを読まずにスキップ
+                    file_key = f"{stat.st_mtime_ns}:{stat.st_size}"
+                    if known.get(source, "").startswith(file_key + ":"):
+                        continue
+                    try:
+                        with open(path, "r", encoding="utf-8", errors="replace") as f:
+                            content = f.read()
+                    except OSError as e:
+                        print(f"検索インデックス: {path} を読み込めません: {e}")
+                        continue
+                    yield (source, kind, os.path.splitext(name)[0], content, None,
+                           f"{file_key}:{self.fingerprint(content)}")
+
+        return self._write_batches(iter_files(), batch_size)
+
+    def _write_batches(self, items, batch_size: int) -> int:
+        """(source, kind, title, content, project_id, fingerprint) を batch_size 件ごとにコミットしながら書き込む"""
+        updated = 0
+        pending = 0
+        conn = self._connect()
+        try:
+            for source, kind, title, content, project_id, fingerprint in items:
+                if not content or not content.strip():
+                    continue
+                if self._upsert(conn, source, kind, title, content, project_id, fingerprint):
+                    updated += 1
+                    pending += 1
+                if pending >= batch_size:
+                    conn.commit()
+                    pending = 0
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"検索インデックス一括更新エラー: {e}")
+        return updated
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """
+        全文検索（スペース区切りの語をすべて含む文書、関連度順）
+
+        2文字の語を含む場合は2-gramのインデックスで検索し、1文字の語を含む場合はLIKE検索（更新日時の新しい順）。
+        同じプロジェクトの同じ種類の文書（文字起こしと整形済みテキストなど）は、順位の高い1件だけを返す
+
+        Returns:
+            source, kind, title, project_id, snippet の辞書のリスト
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        kind_clause = " AND d.kind = ?" if kind else ""
+        kind_params = (kind,) if kind else ()
+        fetch = limit * _DOCUMENTS_PER_KIND
+        try:
+            conn = self._connect()
+            if all(len(t) >= MIN_MATCH_CHARS for t in terms):
+                match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+                rows = conn.execute(
+                    "SELECT d.source, d.kind, d.title, d.project_id,"
+                    " snippet(documents_fts, 0, '**', '**', '…', 24) AS snippet"
+                    " FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid"
+                    f" WHERE documents_fts MATCH ?{kind_clause} ORDER BY bm25(documents_fts) LIMIT ?",
+                    (match, *kind_params, fetch)
+                ).fetchall()
+                return _unique_documents([dict(r) for r in rows], limit)
+
+            if all(len(t) >= MIN_BIGRAM_CHARS and _WORD_RUN.fullmatch(t) for t in terms):
+                rows = conn.execute(
+                    "SELECT d.source, d.kind, d.title, d.project_id, f.content"
+                    " FROM documents_bigram b JOIN documents d ON d.id = b.rowid"
+                    " JOIN documents_fts f ON f.rowid = b.rowid"
+                    f" WHERE documents_bigram MATCH ?{kind_clause} ORDER BY bm25(documents_bigram) LIMIT ?",
+                    (_bigram_query(terms), *kind_params, fetch)
+                ).fetchall()
+            else:
+                like_clause = " AND ".join("f.content LIKE ? ESCAPE '\\'" for _ in terms)
+                like_params = tuple("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                                    for t in terms)
+                rows = conn.execute(
+                    "SELECT d.source, d.kind, d.title, d.project_id, f.content"
+                    " FROM documents_fts f JOIN documents d ON d.id = f.rowid"
+                    f" WHERE {like_clause}{kind_clause} ORDER BY d.indexed_at DESC LIMIT ?",
+                    (*like_params, *kind_params, fetch)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"検索エラー: {e}")
+            return []
+
+        results = []
+        for result in _unique_documents([dict(r) for r in rows], limit):
+            result["snippet"] = _snippet(result.pop("content"), terms[0])
+            results.append(result)
+        return results
+
+    def count(self) -> int:
+        try:
+            return self._connect().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"検索インデックス件数取得エラー: {e}")
+            return 0
+
+
+def _unique_documents(results: List[dict], limit: int) -> List[dict]:
+    """同じ (project_id, kind) の文書は最初（順位の高い方）の1件だけにして limit 件まで"""
+    seen = set()
+    unique = []
+    for result in results:
+        if result["project_id"] is not None:
+            key = (result["project_id"], result["kind"])
+            if key in seen:
+                continue
+            seen.add(key)
+        unique.append(result)
+        if len(unique) >= limit:
+            break
+    return unique
+
+
+def _snippet(content: str, term: str, width: int = 40) -> str:
+    """LIKE・2-gram検索の結果用に、語の前後を切り出して強調"""
+    index = content.lower().find(term.lower())
+    if index < 0:
+        return content[:width * 2]
+    start = max(0, index - width)
+    end = min(len(content), index + len(term) + width)
+    text = content[start:index] + f"**{content[index:index + len(term)]}**" + content[index + len(term):end]
+    return ("…" if start > 0 else "") + text.replace("\n", " ") + ("…" if end < len(content) else "")
+
+
+def project_documents(store, limit: int = 1000000):
+    """プロジェクトストアの成果物を (source, kind, title, content, project_id) として列挙"""
+    for project in store.list_projects(limit=limit):
+        loaded = store.load_project(project["id"])
+        if loaded is None:
+            continue
+        for artifact_kind, doc_kind in SEARCHABLE_ARTIFACTS.items():
+            content = loaded["artifacts"].get(artifact_kind)
+            if content:
+                yield (f"project:{project['id']}:{artifact_kind}", doc_kind, project["filename"],
+                       content, project["id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="過去の文字起こし・シナリオを検索インデックスに一括登録")
+    parser.add_argument("directories", nargs="*", help=".txt ファイルを含むディレクトリ")
+    parser.add_argument("--kind", default="transcript", help="文書の種類（transcript / scenario）")
+    parser.add_argument("--db", default=os.getenv("PROJECTS_DB_PATH", DEFAULT_DB_PATH), help="DBファイル")
+    parser.add_argument("--projects", action="store_true", help="プロジェクトストアの成果物もインデックス")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    started = time.perf_counter()
+    updated = 0
+    for directory in args.directories:
+        updated += index.index_directory(directory, kind=args.kind)
+    if args.projects:
+        from utils.project_store import ProjectStore
+        updated += index.add_many(project_documents(ProjectStore(args.db)))
+    print(f"{updated}件を更新しました（合計 {index.count()}件 / {time.perf_counter() - started:.1f}秒）")
+
+
+if __name__ == "__main__":
+    main()
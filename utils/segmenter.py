@@ -0,0 +1,209 @@
+import bisect
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils.transcription import Transcript
+
+# 時刻のないテキストの読み上げ速度の目安（文字/秒。句読点・空白は数えない）
+CHARS_PER_SECOND = 7.0
+# 時刻のないテキストで文末に入れる間（秒）
+SENTENCE_PAUSE = 0.3
+
+# 文の区切り（句点・感嘆符・疑問符の後と改行）
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])|\n")
+_CLAUSE_END = "、，,"
+_IGNORED_CATEGORIES = ("P", "Z", "S", "C")
+
+
+class Page(NamedTuple):
+    number: int
+    start: float
+    end: float
+    text: str
+
+
+def _significant(ch: str) -> bool:
+    # 句読点・記号・空白は時間の配分に数えない（整形で増減するため）
+    return not unicodedata.category(ch).startswith(_IGNORED_CATEGORIES)
+
+
+def _prefix_counts(text: str) -> List[int]:
+    """counts[i] = text[:i] の句読点・空白以外の文字数"""
+    counts = [0]
+    for ch in text:
+        counts.append(counts[-1] + _significant(ch))
+    return counts
+
+
+def _split_units(text: str, min_units: int) -> List[Tuple[int, int]]:
+    """
+    文単位の (開始位置, 終了位置) のリスト
+
+    min_units に足りない場合は、長い文から順に中央に近い読点で分割する
+    """
+    units = []
+    position = 0
+    for part in _SENTENCE_END.split(text):
+        start, end = position, position + len(part)
+        position = end + (1 if text[end:end + 1] == "\n" else 0)
+        if part.strip():
+            units.append((start, end))
+
+    while len(units) < min_units:
+        index = max(range(len(units)), key=lambda i: units[i][1] - units[i][0], default=None)
+        if index is None:
+            break
+        start, end = units[index]
+        middle = (start + end) / 2
+        cuts = [i + 1 for i in range(start, end - 1) if text[i] in _CLAUSE_END]
+        if not cuts:
+            break
+        cut = min(cuts, key=lambda i: abs(i - middle))
+        units[index:index + 1] = [(start, cut), (cut, end)]
+    return units
+
+
+class _TimeMap:
+    """文字起こしの時刻で、テキスト中の位置（句読点以外の文字数）を秒に変換"""
+
+    def __init__(self, transcript: Transcript, text_chars: int):
+        # 単語の時刻があれば単語単位、なければ発話単位で線形補間する
+        self.starts, self.ends, self.cumulative = [], [], [0]
+        for index in range(len(transcript)):
+            words = transcript.utterance_words(index)
+            if not words:
+                start, end, _, text = transcript.utterance(index)
+                words = [(text, start, end)]
+            for word, start, end in words:
+                chars = sum(map(_significant, word))
+                if chars:
+                    self.starts.append(start)
+                    self.ends.append(max(start, end))
+                    self.cumulative.append(self.cumulative[-1] + chars)
+        # 整形・編集で文字数が変わっていても全体の比率で対応させる
+        self.scale = self.cumulative[-1] / text_chars if text_chars else 0.0
+
+    def __bool__(self):
+        return len(self.starts) > 0
+
+    def time_at(self, chars: int, side: str) -> float:
+        """side="end" は位置の直前の語の終わり、"start" は位置の直後の語の始まり"""
+        position = chars * self.scale
+        if side == "end":
+            index = max(0, bisect.bisect_left(self.cumulative, position) - 1)
+        else:
+            index = min(len(self.starts) - 1, bisect.bisect_right(self.cumulative, position) - 1)
+        index = min(index, len(self.starts) - 1)
+        length = self.cumulative[index + 1] - self.cumulative[index]
+        ratio = min(1.0, max(0.0, (position - self.cumulative[index]) / length))
+        return self.starts[index] + (self.ends[index] - self.starts[index]) * ratio
+
+
+def _unit_times(text: str, units: List[Tuple[int, int]], counts: List[int],
+                transcript: Optional[Transcript]) -> List[Tuple[float, float]]:
+    time_map = _TimeMap(transcript, counts[-1]) if transcript is not None and len(transcript) else None
+    if time_map:
+        return [(time_map.time_at(counts[start], "start"), time_map.time_at(counts[end], "end"))
+                for start, end in units]
+
+    # 時刻がなければ文字数から読み上げ時間を見積もる
+    times = []
+    clock = 0.0
+    for start, end in units:
+        duration = (counts[end] - counts[start]) / CHARS_PER_SECOND
+        times.append((clock, clock + duration))
+        clock += duration
+        if text[start:end].rstrip().endswith(tuple("。！？!?")) or text[end:end + 1] == "\n":
+            clock += SENTENCE_PAUSE
+    return times
+
+
+def assign_speakers(transcript: Optional[Transcript], characters: List[dict]) -> Dict[int, str]:
+    """
+    話者分離した話者をキャラクターに割り当てる
+
+    発話時間の最も長い話者を主人公（characters[0]、説明する側）、残りを発話時間の長い順に質問者に割り当てる。
+    キャラクターより多い話者は割り当てない。話者が1人以下の場合は空の辞書
+
+    Returns:
+        話者番号 -> キャラクター名
+    """
+    if transcript is None or not characters:
+        return {}
+    durations = transcript.speaker_durations()
+    if len(durations) < 2:
+        return {}
+    speakers = sorted(durations, key=durations.get, reverse=True)
+    return {speaker: character["name"] for speaker, character in zip(speakers, characters)}
+
+
+def propose_pages(text: str, num_pages: int, transcript: Optional[Transcript] = None,
+                  speaker_names: Optional[Dict[int, str]] = None) -> List[Page]:
+    """
+    テキストを話す速さに合わせて num_pages ページに割り振る
+
+    各ページの長さ（秒）がなるべく均等になるよう、文の切れ目（間が長い位置を優先）でページを区切る。
+    transcript があれば実際の発話時刻、なければ文字数からの見積もりを使う。
+    文の数がページ数より少ない場合は、文の数だけのページを返す
+
+    Args:
+        speaker_names: 話者番号 -> キャラクター名（assign_speakers の結果）。
+            指定すると話者が変わる文の先頭に「【キャラ名】」を付ける
+
+    Returns:
+        Page のリスト（ページ番号は1から）
+    """
+    if not text or not text.strip() or num_pages < 1:
+        return []
+    units = _split_units(text, num_pages)
+    counts = _prefix_counts(text)
+    times = _unit_times(text, units, counts, transcript)
+    num_pages = min(num_pages, len(units))
+
+    begin, finish = times[0][0], times[-1][1]
+    total = max(finish - begin, 1e-6)
+    boundaries = []  # 各ページ（最後以外）の最後の文
+    previous = -1
+    for page in range(1, num_pages):
+        ideal = begin + total * page / num_pages
+        candidates = range(previous + 1, len(units) - (num_pages - page))
+
+        def score(i):
+            gap = min(1.0, max(0.0, times[i + 1][0] - times[i][1]))
+            return abs(times[i][1] - ideal) - gap * 0.5
+
+        previous = min(candidates, key=score)
+        boundaries.append(previous)
+    boundaries.append(len(units) - 1)
+
+    names = None
+    if speaker_names and transcript is not None and len(transcript):
+        names = [speaker_names.get(transcript.speaker_at((start + end) / 2)) for start, end in times]
+
+    pages = []
+    first = 0
+    for number, last in enumerate(boundaries, start=1):
+        if names is None:
+            page_text = text[units[first][0]:units[last][1]].strip()
+        else:
+            lines = []
+            previous_name = None
+            for i in range(first, last + 1):
+                label = f"【{names[i]}】" if names[i] and names[i] != previous_name else ""
+                lines.append(label + text[units[i][0]:units[i][1]].strip())
+                previous_name = names[i]
+            page_text = "\n".join(lines)
+        pages.append(Page(number, times[first][0], times[last][1], page_text))
+        first = last + 1
+    return pages
+
+
+def _clock(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_outline(pages: List[Page]) -> str:
+    """プロンプト・画面表示用のページ割り（「[P1 0:00〜0:04]」の見出し + 本文）"""
+    return "\n\n".join(f"[P{page.number} {_clock(page.start)}〜{_clock(page.end)}]\n{page.text}" for page in pages)
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional, Iterable, Tuple
+
+from utils.storage import JsonStore
+
+# 保存先（環境変数で上書き可能）
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SNAPSHOT_DIR = os.path.join(_BASE_DIR, "snapshots")
+
+_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def new_token() -> str:
+    """URLに載せるセッショントークン"""
+    return secrets.token_urlsafe(12)
+
+
+def valid_token(token: Optional[str]) -> bool:
+    return bool(token) and bool(_TOKEN_PATTERN.match(token))
+
+
+class SessionSnapshots:
+    """
+    セッションの作業状態（入力・設定・生成結果）のスナップショット
+
+    - トークンごとに JsonStore（変更ログ + 定期的なコンパクション）に保存し、変更のあった項目だけを追記する
+    - テキストは内容のハッシュをキーに圧縮して blobs/ に1回だけ書き、スナップショットにはハッシュだけを持つ
+    - サーバーが再起動してもトークンから状態を復元できる（APIは呼ばない）
+    - トークンごとの JsonStore は idle_seconds 以上使われなければ手放す
+    """
+
+    def __init__(self, directory: str = DEFAULT_SNAPSHOT_DIR, text_fields: Iterable[str] = (),
+                 compact_every: int = 100, idle_seconds: float = 3600):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.text_fields = set(text_fields)
+        self.compact_every = compact_every
+        self.idle_seconds = idle_seconds
+        self._stores = OrderedDict()  # token -> (JsonStore, 最後に使った時刻)。古い順
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def _store(self, token: str) -> JsonStore:
+        now = time.time()
+        with self._lock:
+            while self._stores:
+                oldest, (_, used_at) = next(iter(self._stores.items()))
+                if now - used_at < self.idle_seconds:
+                    break
+                del self._stores[oldest]
+            store = self._stores.pop(token, (None, None))[0]
+            if store is None:
+                store = JsonStore(os.path.join(self.directory, f"{token}.json"), default=None,
+                                  compact_every=self.compact_every)
+            self._stores[token] = (store, now)
+            return store
+
+    # ---------- テキスト ----------
+    def _put_blob(self, text: str) -> str:
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.blob_dir, digest + ".z")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data, 6))
+            os.replace(tmp_path, path)
+        return digest
+
+    def _get_blob(self, digest: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.blob_dir, digest + ".z"), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error) as e:
+            print(f"スナップショットのテキスト読み込みエラー: {e}")
+            return None
+
+    def _encode(self, field: str, value):
+        if field not in self.text_fields or value is None:
+            return value
+        if isinstance(value, list):
+            return {"$texts": [self._put_blob(v) for v in value]}
+        return {"$text": self._put_blob(value)}
+
+    def _decode(self, value):
+        if isinstance(value, dict) and "$text" in value:
+            return self._get_blob(value["$text"])
+        if isinstance(value, dict) and "$texts" in value:
+            return [self._get_blob(d) for d in value["$texts"]]
+        return value
+
+    @staticmethod
+    def fingerprint(value) -> str:
+        """項目の値が変わったかの判定用"""
+        return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    # ---------- 保存・復元 ----------
+    def save(self, token: str, values: dict, previous: Optional[dict] = None) -> dict:
+        """
+        前回から変わった項目だけを保存
+
+        Args:
+            values: 項目名 -> 値（text_fields の値は文字列か文字列のリスト）
+            previous: 前回 save が返した各項目のフィンガープリント
+
+        Returns:
+            今回の各項目のフィンガープリント（次回の previous に渡す）
+        """
+        previous = previous or {}
+        try:
+            fingerprints = {field: self.fingerprint(value) for field, value in values.items()}
+            changed = {field: value for field, value in values.items()
+                       if previous.get(field) != fingerprints[field]}
+            if not changed:
+                return fingerprints
+            encoded = {field: self._encode(field, value) for field, value in changed.items()}
+            encoded["_saved_at"] = time.time()
+            self._store(token).apply({"op": "update", "values": encoded})
+        except (OSError, ValueError, TypeError) as e:
+            # JSONにできない値が含まれていた場合も、画面の処理は続ける
+            print(f"スナップショット保存エラー: {type(e).__name__}: {e}")
+            return previous
+        return fingerprints
+
+    def load(self, token: str) -> Optional[Tuple[dict, dict]]:
+        """
+        スナップショットを復元
+
+        Returns:
+            (値, フィンガープリント) のタプル（スナップショットがなければNone）
+        """
+        if not os.path.exists(os.path.join(self.directory, f"{token}.json")) and \
+                not os.path.exists(os.path.join(self.directory, f"{token}.json.log")):
+            return None
+        saved = self._store(token).load()
+        if not saved:
+            return None
+        saved.pop("_saved_at", None)
+        values = {field: self._decode(value) for field, value in saved.items()}
+        return values, {field: self.fingerprint(value) for field, value in values.items()}
+
+    def _referenced_blobs(self, token: str) -> set:
+        """
+        スナップショットと変更ログが参照するテキストのハッシュ
+
+        JsonStore を作らずにファイルを直接読む（ロックファイルを作らず、キャッシュもしない）。
+        反映済みの変更ログの参照も含めるので、実際より多めになる
+        """
+        path = os.path.join(self.directory, f"{token}.json")
+        values = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                values.append(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"スナップショット読み込みエラー: {e}")
+        try:
+            with open(path + ".log", "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        values.append(json.loads(line).get("values"))
+                    except (ValueError, AttributeError):
+                        continue
+        except OSError:
+            pass
+        referenced = set()
+        for saved in values:
+            for value in (saved.values() if isinstance(saved, dict) else ()):
+                if isinstance(value, dict):
+                    referenced.update([value["$text"]] if "$text" in value else value.get("$texts", []))
+        return referenced
+
+    def prune(self, max_age_days: float = 14) -> int:
+        """
+        古いスナップショットと、どのスナップショットからも参照されないテキストを削除
+
+        Returns:
+            削除したスナップショット数
+        """
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        referenced = set()
+        tokens = {name.split(".json")[0] for name in os.listdir(self.directory)
+                  if name.endswith((".json", ".json.log"))}
+        for token in tokens:
+            path = os.path.join(self.directory, f"{token}.json")
+            newest = max(os.path.getmtime(p) for p in (path, path + ".log") if os.path.exists(p))
+            if newest < cutoff:
+                for suffix in ("", ".log", ".lock"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                with self._lock:
+                    self._stores.pop(token, None)
+                removed += 1
+                continue
+            referenced.update(self._referenced_blobs(token))
+        for name in os.listdir(self.blob_dir):
+            if name.endswith(".z") and name[:-2] not in referenced:
+                os.remove(os.path.join(self.blob_dir, name))
+        return removed
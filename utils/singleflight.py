@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import threading
+from typing import Callable, Awaitable, Hashable, Any
+
+from utils.metrics import metrics
+
+
+def prompt_key(model_name: str, method: str, prompt: str) -> str:
+    """同じモデル・メソッド・プロンプトの呼び出しを識別するキー"""
+    return hashlib.sha256(f"{model_name}\0{method}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def file_key(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """ファイル内容のハッシュ（一時ファイル名が違っても同じ内容なら同じキー）"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同じキーの同時呼び出しを1回にまとめる（同期版）
+
+    実行中の呼び出しと同じキーで呼ばれた場合は、新しく実行せずに実行中の呼び出しの結果（例外）を共有する。
+    完了後の呼び出しは新しく実行する（結果のキャッシュはしない）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], backend: str, method: str):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.count("coalesced", backend, method)
+            print(f"同じリクエストが実行中のため結果を共有します ({backend}.{method})")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    同じキーの同時呼び出しを1回にまとめる（非同期版）
+
+    待っている呼び出し元がすべてキャンセルした場合のみ、実行中の呼び出しもキャンセルする
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable], backend: str, method: str):
+        # タスクはイベントループに紐付くため、ループごとに分けて管理する
+        loop_key = (id(asyncio.get_running_loop()), key)
+        call = self._calls.get(loop_key)
+        if call is None:
+            call = _AsyncCall(asyncio.ensure_future(factory()))
+            self._calls[loop_key] = call
+            call.task.add_done_callback(lambda _: self._forget(loop_key, call))
+        else:
+            metrics.count("coalesced", backend, method)
+            print(f"同じリクエストが実行中のため結果を共有します ({backend}.{method})")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 以降の同じキーの呼び出しがキャンセル中のタスクを待たないよう先に外す
+                self._forget(loop_key, call)
+                call.task.cancel()
+
+    def _forget(self, loop_key, call: _AsyncCall):
+        if self._calls.get(loop_key) is call:
+            del self._calls[loop_key]
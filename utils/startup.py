@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+# 遅延読み込みしたモジュールの読み込み時間（秒）
+_import_times = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed_import(name: str):
+    """遅延読み込みの所要時間を記録"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _import_times.setdefault(name, elapsed)
+        print(f"{name} を読み込みました ({elapsed * 1000:.0f}ms)")
+
+
+def lazy_import_times() -> List[dict]:
+    """このプロセスで遅延読み込みしたモジュールと所要時間"""
+    with _lock:
+        return [{"module": name, "ms": seconds * 1000} for name, seconds in _import_times.items()]
+
+
+def importtime_report(modules: List[str], top: int = 15) -> List[dict]:
+    """
+    python -X importtime で modules を読み込んだときの内訳（累積時間の大きい順）
+
+    現在のプロセスの読み込み状況に影響されないよう、別プロセスで計測する
+    """
+    code = "; ".join(f"import {m}" for m in modules)
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=cwd, capture_output=True, text=True, timeout=120
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"起動プロファイル計測エラー: {e}")
+        return []
+
+    rows = []
+    for line in completed.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+            rows.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+        except ValueError:
+            continue
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
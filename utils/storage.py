@@ -0,0 +1,276 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """
+    プロセス間のファイルロック（POSIX: flock / Windows: msvcrt.locking）
+
+    同一プロセス内のスレッド間はthreading.Lockで排他する
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._file = open(self.path, "a+b")
+            if os.name == "nt":
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK は約10秒で諦めるので取得できるまで繰り返す
+                        time.sleep(0.1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if os.name == "nt":
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+
+def atomic_write_json(path: str, value: Any):
+    """一時ファイルに書いてからリネーム（書き込み途中でクラッシュしても元のファイルは壊れない）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class JsonStore:
+    """
+    JSONファイルの保存・読み込み（複数セッション・複数プロセスから安全に使える）
+
+    - 本体ファイル（path）はこれまでと同じJSON形式のスナップショット
+    - 変更は追記専用の変更ログ（path + ".log"、JSON Lines）に追記し、
+      compact_every 件たまったらスナップショットに反映してログを空にする
+    - 変更ログの先頭行には、ログを書き始めたときのスナップショットのハッシュを記録する。
+      スナップショットが書き換わっていれば（コンパクションでスナップショットを書いた後、ログを消す前に
+      クラッシュした場合）ログは反映済みなので再生しない
+    - 読み込み結果はファイルの更新時刻・サイズが変わるまでキャッシュする
+
+    変更ログの操作:
+        {"op": "set", "value": ...}          全体を置き換え
+        {"op": "append", "item": ...}        リストに追加
+        {"op": "remove", "key": "name", "value": ...}  リストから一致する要素を削除
+        {"op": "update", "values": {...}}    辞書のキーを更新
+        {"op": "base", "snapshot": ハッシュ}  先頭行（ログを書き始めたときのスナップショット。ないときはnull）
+    """
+
+    # 壊れていたスナップショットのハッシュの代わり
+    _CORRUPT = "corrupt"
+
+    def __init__(self, path: str, default: Any, compact_every: int = 50):
+        self.path = path
+        self.log_path = path + ".log"
+        self.default = default
+        self.compact_every = compact_every
+        self.lock = FileLock(path + ".lock")
+        self.last_error: Optional[str] = None
+        self._cache_key = None
+        self._cache_value = None
+        self._cache_log_entries = 0
+        self._cache_digest = None
+        self._cache_stale_log = False
+
+    # ---------- 読み込み ----------
+    def _file_state(self):
+        states = []
+        for p in (self.path, self.log_path):
+            try:
+                st = os.stat(p)
+                states.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                states.append(None)
+        return tuple(states)
+
+    def _read_snapshot(self):
+        """(値, スナップショットのハッシュ)。ファイルがなければハッシュはNone、壊れていれば _CORRUPT"""
+        if not os.path.exists(self.path):
+            return copy.deepcopy(self.default), None
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            return json.loads(data.decode("utf-8")), hashlib.sha256(data).hexdigest()[:16]
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # 壊れたファイルは退避して、黙って空データで上書きしないようにする
+            backup = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup)
+            self.last_error = f"{os.path.basename(self.path)} が破損していたため {os.path.basename(backup)} に退避しました: {e}"
+            print(f"保存ファイル読み込みエラー: {self.last_error}")
+            return copy.deepcopy(self.default), self._CORRUPT
+
+    def _read_log(self):
+        entries = []
+        if not os.path.exists(self.log_path):
+            return entries
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 追記途中でクラッシュした最後の行は無視する
+                    print(f"変更ログの不完全な行を無視しました: {self.log_path}")
+        return entries
+
+    @staticmethod
+    def _apply(value, entry):
+        op = entry.get("op")
+        if op == "set":
+            return entry["value"]
+        if op == "append":
+            return list(value or []) + [entry["item"]]
+        if op == "remove":
+            return [item for item in (value or []) if item.get(entry["key"]) != entry["value"]]
+        if op == "update":
+            return {**(value or {}), **entry["values"]}
+        print(f"不明な変更ログ操作を無視しました: {op}")
+        return value
+
+    def load(self):
+        """現在の値を取得（呼び出し側で変更しても保存内容には影響しない）"""
+        state = self._file_state()
+        if state != self._cache_key:
+            with self.lock:
+                value, digest = self._read_snapshot()
+                entries = self._read_log()
+                stale = False
+                if entries and entries[0].get("op") == "base":
+                    base = entries.pop(0).get("snapshot")
+                    # スナップショットが壊れていた場合は、ログだけでも復元できるよう再生する
+                    if base != digest and digest != self._CORRUPT:
+                        print(f"コンパクション済みの変更ログを無視しました: {self.log_path}")
+                        entries, stale = [], True
+                for entry in entries:
+                    value = self._apply(value, entry)
+                if digest == self._CORRUPT:
+                    # 復元できた内容をスナップショットにして、退避前のハッシュを記録したログを残さない
+                    atomic_write_json(self.path, value)
+                    if os.path.exists(self.log_path):
+                        os.remove(self.log_path)
+                    entries = []
+                    _, digest = self._read_snapshot()
+                self._cache_value = value
+                self._cache_log_entries = len(entries)
+                self._cache_digest = digest
+                self._cache_stale_log = stale
+                self._cache_key = self._file_state()
+        return copy.deepcopy(self._cache_value)
+
+    # ---------- 書き込み ----------
+    def _repair_log_tail(self):
+        """
+        改行で終わらない最後の行（追記途中のクラッシュ）を直す（ロック内で呼ぶ）
+
+        そのまま追記すると次の変更が同じ行に書かれて読めなくなるため、
+        JSONとして完結していれば改行を補い、途中までしかなければ切り詰める
+        """
+        try:
+            f = open(self.log_path, "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # 最後の改行の位置を後ろから探す
+            start = size
+            while start > 0:
+                end = start
+                start = max(0, start - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    start += newline + 1
+                    break
+            f.seek(start)
+            tail = f.read(size - start)
+            try:
+                json.loads(tail.decode("utf-8"))
+                f.seek(size)
+                f.write(b"\n")
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                f.truncate(start)
+                print(f"変更ログの不完全な最後の行を削除しました: {self.log_path}")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def apply(self, entry: dict):
+        """変更を変更ログに追記（一定件数ごとにスナップショットへ反映）"""
+        line = json.dumps(entry, ensure_ascii=False)
+        with self.lock:
+            self._cache_key = None
+            self.load()
+            if self._cache_stale_log:
+                os.remove(self.log_path)
+            self._repair_log_tail()
+            if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0:
+                base = json.dumps({"op": "base", "snapshot": self._cache_digest})
+                line = base + "\n" + line
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._cache_key = None
+            self.load()
+            if self._cache_log_entries >= self.compact_every:
+                self.compact()
+
+    def save(self, value):
+        """全体を置き換え（内容が変わらなければ書き込まない）"""
+        if value == self.load():
+            return
+        self.apply({"op": "set", "value": value})
+
+    def compact(self):
+        """変更ログをスナップショットに反映してログを空にする"""
+        with self.lock:
+            value = self.load()
+            atomic_write_json(self.path, value)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._cache_key = None
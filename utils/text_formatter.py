@@ -1,22 +1,331 @@
-import google.generativeai as genai
+import asyncio
+import math
+import re
+import threading
+from collections import deque
 from typing import Optional, List
 
+from utils.async_runner import run_sync
+from utils.circuit_breaker import breakers, CircuitOpenError, is_backend_failure
+from utils.hedging import hedged, gemini_hedge_policy
+from utils.metrics import metrics, record_usage
+from utils.singleflight import SingleFlight, AsyncSingleFlight, prompt_key
+from utils.startup import timed_import
+
+# google.generativeai（grpc / protobuf を含み読み込みが重いため、初回使用時に読み込む）
+genai = None
+
+
+def _genai():
+    global genai
+    if genai is None:
+        with timed_import("google.generativeai"):
+            import google.generativeai as module
+        genai = module
+    return genai
+
+# 同じプロンプトの同時リクエストは1回にまとめる（ダブルクリック・同じ動画を同時に処理した場合など）
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+
+# genai.configure はプロセス全体の設定なので、APIキーが変わったときだけ呼び直す
+_configured_key = None
+_configure_lock = threading.Lock()
+
+
+def _configure(api_key: str):
+    global _configured_key
+    if _configured_key == api_key:
+        return
+    with _configure_lock:
+        if _configured_key != api_key:
+            _genai().configure(api_key=api_key)
+            _configured_key = api_key
+
+
+# シナリオのページ区切り（「--- P1 ---」）
+_PAGE_HEADER = re.compile(r"^-{3}\s*P\d+\s*-{3}\s*$", re.MULTILINE)
+
+
+def count_pages(scenario: str) -> int:
+    """シナリオのページ数"""
+    return len(_PAGE_HEADER.findall(scenario or ""))
+
+
+# シナリオ1ページあたりの出力トークン数（実測値がまだないときの値。ト書き・テロップ・セリフ2〜3行の
+# 日本語で300トークン前後になるため、その倍の余裕を見る）
+TOKENS_PER_PAGE = 600
+# 実測した1ページあたりの出力トークン数に掛ける余裕
+PAGE_TOKEN_MARGIN = 1.5
+# モデルの出力トークン数の上限（gemini-2.0-flash / gemini-1.5-flash）
+MAX_OUTPUT_TOKENS = 8192
+# 出力の上限で切れたときに続きを生成する最大回数
+MAX_CONTINUATIONS = 3
+
+_VARIATION_SEPARATOR = "===VARIATION==="
+_PAGE_NUMBER = re.compile(r"^-{3}\s*P(\d+)\s*-{3}\s*$", re.MULTILINE)
+
+
+class PageTokenEstimate:
+    """
+    シナリオ1ページあたりの出力トークン数の実測値
+
+    最後まで生成できた（出力の上限で切れていない）シナリオの usage_metadata から求め、
+    直近 window 件の最大値に PAGE_TOKEN_MARGIN を掛けた値を使う。実測値がなければ TOKENS_PER_PAGE
+    """
+
+    def __init__(self, window: int = 20):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, response, text: Optional[str]):
+        """レスポンスの出力トークン数とページ数を記録（切れたもの・数えられないものは記録しない）"""
+        if text is None or is_truncated(response):
+            return
+        usage = getattr(response, "usage_metadata", None)
+        tokens = getattr(usage, "candidates_token_count", None)
+        pages = count_pages(text)
+        if not tokens or not pages:
+            return
+        with self._lock:
+            self._samples.append(tokens / pages)
+
+    def per_page(self) -> int:
+        with self._lock:
+            if not self._samples:
+                return TOKENS_PER_PAGE
+            return math.ceil(max(self._samples) * PAGE_TOKEN_MARGIN)
+
+
+page_tokens = PageTokenEstimate()
+
+
+def scenario_generation_config(num_pages: int, num_variations: int = 1) -> dict:
+    """
+    シナリオ生成の generation_config
+
+    - max_output_tokens: ページ数 × パターン数 × 1ページあたりの出力トークン数（page_tokens の実測値）。
+      指定より長く書き続けないようにする。上限は MAX_OUTPUT_TOKENS
+    - temperature: 1パターンなら抑えめ、複数パターンは違いが出るよう高め
+    - stop_sequences: 1パターンなら指定ページ数の次のページ見出しで止める
+    """
+    pages = max(1, num_pages) * max(1, num_variations)
+    config = {
+        "max_output_tokens": min(MAX_OUTPUT_TOKENS, pages * page_tokens.per_page() + 256),
+        "temperature": 0.7 if num_variations <= 1 else 0.9,
+    }
+    if num_variations <= 1:
+        config["stop_sequences"] = [f"--- P{num_pages + 1} ---"]
+    return config
+
+
+def is_truncated(response) -> bool:
+    """出力トークン数の上限で生成が打ち切られたか（finish_reason が MAX_TOKENS）"""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return False
+    reason = getattr(candidates[0], "finish_reason", None)
+    return getattr(reason, "name", reason) in ("MAX_TOKENS", 2)
+
+
+def _continuation(prompt: str, text: str, num_variations: int):
+    """
+    途中で切れた出力の続きを生成するプロンプト
+
+    最後のページは途中で切れている可能性があるため、最後のページ見出しの手前までを残し、そのページから生成し直す
+
+    Returns:
+        (残す出力, 続きを生成するプロンプト)
+    """
+    headers = list(_PAGE_NUMBER.finditer(text))
+    separator = text.rfind(_VARIATION_SEPARATOR)
+    if separator >= 0 and (not headers or separator > headers[-1].start()):
+        # パターンの区切りの直後で切れた場合は、次のパターンの最初のページから
+        kept = text[:separator + len(_VARIATION_SEPARATOR)]
+        page = 1
+    elif headers:
+        kept = text[:headers[-1].start()].rstrip()
+        page = int(headers[-1].group(1))
+    else:
+        kept, page = "", 1
+    position = f"「--- P{page} ---」"
+    if num_variations > 1:
+        position = f"パターン{kept.count(_VARIATION_SEPARATOR) + 1}の{position}"
+    return kept, f"""{prompt}
+
+【途中までの出力】
+{kept}
+
+【続きの出力】
+上の出力は出力の上限で途中で切れています。{position}から続きを出力してください。
+途中までの出力は繰り返さず、続きの部分だけを同じ形式で出力してください。
+"""
+
+
+# SNSメタデータ（タイトル・紹介文・ハッシュタグ）のルールと出力フォーマット（1件ずつ・一括で共通）
+_METADATA_RULES = """【ルール】
+1. タイトル案：3つ提案（各30字以内、【見出し】本文 の形式）
+2. 紹介文案：3つ提案（各100字前後）
+3. ハッシュタグ：5つ提案"""
+
+_METADATA_FORMAT = """【タイトル案（『【見出し】本文』／各30字以内）】
+
+1）……
+
+2）……
+
+3）……
+
+【紹介文案（各100字前後）】
+
+1）……
+
+2）……
+
+3）……
+
+【ハッシュタグ（5つ）】
+
+#〇〇 #〇〇 #〇〇 #〇〇 #〇〇"""
+
+# 一括生成で各項目の先頭に付ける区切り（「=== ITEM 1 ===」）
+_METADATA_ITEM = re.compile(r"^[*#\s]*={2,}\s*ITEM\s*(\d+)\s*={2,}[*\s]*$", re.MULTILINE | re.IGNORECASE)
+
+
+def _input_section(text: str, outline: Optional[str], num_pages: int) -> str:
+    """プロンプトの入力テキスト部分（ページ割りがあればページ割り済みのテキスト）"""
+    if not outline:
+        return f"""【入力テキスト】
+{text}"""
+    return f"""【入力テキスト（ページ割りの目安）】
+入力テキストを実際に話す時間に合わせて{num_pages}ページに割り振ったものです。[P番号 開始〜終了] は元の動画での時間です。
+各ページの内容はこの割り振りを目安にしてください（テロップ・セリフへの書き直しや、保存促進・誘導文のための調整は自由です）。
+{outline}"""
+
 
 class GeminiFormatter:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        # gemini-2.0-flash または gemini-1.5-flash を使用
-        try:
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
-        except:
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+    # 非同期APIのメソッドごとのデフォルトタイムアウト（秒）
+    DEFAULT_TIMEOUTS = {
+        "format_text": 60,
+        "generate_filename": 20,
+        "generate_metadata": 60,
+        "rewrite_scenario": 300,
+        "generate_variations": 600,
+        "generate_metadata_batch": 180,
+    }
+
+    DEFAULT_MODEL = "gemini-2.0-flash"
+    # 主モデルが障害のとき（サーキットブレーカーが開いている・5xx / 429）に使うモデル
+    FALLBACK_MODEL = "gemini-1.5-flash"
+
+    # ヘッジ（遅い応答に同じリクエストをもう1つ送る）の対象。入力が短く、普段はすぐに返るメソッド
+    HEDGED_METHODS = ("format_text", "generate_filename")
+
+    # generate_variations で一度に生成するパターン数の上限
+    MAX_VARIATIONS = 5
+
+    # generate_metadata_batch で1リクエストにまとめるテキスト数
+    METADATA_BATCH_SIZE = 8
+
+    def __init__(self, api_key: str, model_name: Optional[str] = None,
+                 fallback_model_name: Optional[str] = FALLBACK_MODEL, hedge: bool = False):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.fallback_model_name = fallback_model_name
+        self.hedge = hedge
+        self._model = None
+        self._fallback_models = {}
+
+    @property
+    def model(self):
+        """GenerativeModel（SDKの読み込みを避けるため初回使用時に作成）"""
+        if self._model is None:
+            _configure(self.api_key)
+            # 指定がなければ gemini-2.0-flash または gemini-1.5-flash を使用
+            try:
+                self._model = _genai().GenerativeModel(self.model_name or self.DEFAULT_MODEL)
+            except:
+                self._model = _genai().GenerativeModel(self.FALLBACK_MODEL)
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+
+    def _model_names(self) -> List[str]:
+        """呼び出すモデル名（主モデル、代替モデルの順）"""
+        primary = self.model_name or self.DEFAULT_MODEL
+        if self.fallback_model_name and self.fallback_model_name != primary:
+            return [primary, self.fallback_model_name]
+        return [primary]
+
+    def _get_model(self, model_name: str):
+        if model_name == (self.model_name or self.DEFAULT_MODEL):
+            return self.model
+        if model_name not in self._fallback_models:
+            self._fallback_models[model_name] = _genai().GenerativeModel(model_name)
+        return self._fallback_models[model_name]
+
+    def _next_model(self, method: str, model_name: str, error: Optional[Exception]) -> Optional[Exception]:
+        """
+        model_name を呼び出してよいか確認（サーキットブレーカー）
 
-    def format_text(self, text: str) -> Optional[str]:
+        Returns:
+            呼び出さない場合は CircuitOpenError、呼び出す場合はNone
         """
-        テキストを読みやすく整形（句読点と改行の調整）
-        重要: 元の発言内容は1文字も変えず、句読点と改行のみを調整
+        breaker = breakers.get(f"gemini:{model_name}")
+        if not breaker.allow():
+            metrics.count("short_circuited", "gemini", method)
+            return CircuitOpenError(breaker.name, breaker.retry_in())
+        if error is not None:
+            metrics.count("fallbacks", "gemini", method)
+            print(f"{type(error).__name__} のため代替モデル {model_name} で呼び出します")
+        return None
+
+    def _generate_content(self, method: str, prompt: str, generation_config: Optional[dict] = None):
+        """generate_contentを計測付きで呼び出し（同じプロンプトの同時呼び出しは1回にまとめる）"""
+        key = prompt_key(self.model_name or "", method, prompt)
+        return _flight.do(key, lambda: self._call_generate_content(method, prompt, generation_config),
+                          "gemini", method)
+
+    def _call_generate_content(self, method: str, prompt: str, generation_config: Optional[dict] = None):
+        """
+        generate_contentを計測付きで呼び出し（レイテンシ・トークン数・エラー）
+
+        主モデルのサーキットブレーカーが開いている、または障害（5xx / 429 など）で失敗した場合は代替モデルで呼び出す。
+        ヘッジする場合は、遅い方をキャンセルできるよう非同期APIで呼び出す
         """
-        prompt = f"""あなたは厳格な校正者です。以下のテキストを整形してください。
+        if self._hedges(method):
+            return run_sync(self._call_hedged_async(method, prompt, generation_config=generation_config))
+        _configure(self.api_key)
+        kwargs = {"generation_config": generation_config} if generation_config else {}
+        error = None
+        for model_name in self._model_names():
+            skipped = self._next_model(method, model_name, error)
+            if skipped is not None:
+                error = error or skipped
+                continue
+            breaker = breakers.get(f"gemini:{model_name}")
+            try:
+                with metrics.track("gemini", method) as record:
+                    response = self._get_model(model_name).generate_content(prompt, **kwargs)
+                    record_usage(record, response)
+                    if not getattr(response, "candidates", None):
+                        record.fail("EmptyResponse")
+            except Exception as e:
+                failed = is_backend_failure(e)
+                breaker.record(not failed)
+                if not failed:
+                    raise
+                error = e
+                continue
+            breaker.record(True)
+            return response
+        raise error
+
+    def _format_text_prompt(self, text: str) -> str:
+        """整形用プロンプトを構築"""
+        return f"""あなたは厳格な校正者です。以下のテキストを整形してください。
 
 【手順】
 1. まず、テキストに句読点（句点「。」と読点「、」）がない場合は、文の意味に合った適切な位置に句読点を付けてください
@@ -46,9 +355,16 @@ class GeminiFormatter:
 整形後のテキストのみを出力してください。説明や追加コメントは不要です。
 """
 
+    def format_text(self, text: str) -> Optional[str]:
+        """
+        テキストを読みやすく整形（句読点と改行の調整）
+        重要: 元の発言内容は1文字も変えず、句読点と改行のみを調整
+        """
+        prompt = self._format_text_prompt(text)
+
         try:
             print(f"Gemini APIリクエスト中... (テキスト長: {len(text)}文字)")
-            response = self.model.generate_content(prompt)
+            response = self._generate_content("format_text", prompt)
             print(f"Gemini APIレスポンス受信完了")
 
             # レスポンスの内容を確認
@@ -68,14 +384,12 @@ class GeminiFormatter:
             traceback.print_exc()
             return None
 
-    def generate_filename(self, formatted_text: str) -> Optional[str]:
-        """
-        整形済みテキストの1〜3行目から、20文字以内の適切なファイル名を生成
-        """
+    def _generate_filename_prompt(self, formatted_text: str) -> str:
+        """ファイル名生成用プロンプトを構築"""
         lines = formatted_text.split('\n')
         first_lines = '\n'.join(lines[:3])
 
-        prompt = f"""以下のテキストから、適切なファイル名を生成してください。
+        return f"""以下のテキストから、適切なファイル名を生成してください。
 
 【ルール】
 1. 20文字以内
@@ -91,18 +405,29 @@ class GeminiFormatter:
 拡張子（.txtや.wav）は付けないでください。
 """
 
+    @staticmethod
+    def _clean_filename(text: str) -> str:
+        """生成されたファイル名から使えない文字を除去して20文字に制限"""
+        filename = text.strip()
+        # 不適切な文字を削除
+        filename = filename.replace('/', '').replace('\\', '').replace(':', '').replace('*', '')
+        filename = filename.replace('?', '').replace('"', '').replace('<', '').replace('>', '')
+        filename = filename.replace('|', '').replace('\n', '').replace('\r', '')
+        return filename[:20]  # 20文字制限
+
+    def generate_filename(self, formatted_text: str) -> Optional[str]:
+        """
+        整形済みテキストの1〜3行目から、20文字以内の適切なファイル名を生成
+        """
+        prompt = self._generate_filename_prompt(formatted_text)
+
         try:
             print(f"Gemini APIでファイル名生成中...")
-            response = self.model.generate_content(prompt)
+            response = self._generate_content("generate_filename", prompt)
             print(f"ファイル名生成レスポンス受信完了")
 
             if hasattr(response, 'text'):
-                filename = response.text.strip()
-                # 不適切な文字を削除
-                filename = filename.replace('/', '').replace('\\', '').replace(':', '').replace('*', '')
-                filename = filename.replace('?', '').replace('"', '').replace('<', '').replace('>', '')
-                filename = filename.replace('|', '').replace('\n', '').replace('\r', '')
-                result = filename[:20]  # 20文字制限
+                result = self._clean_filename(response.text)
                 print(f"生成されたファイル名: {result}")
                 return result
             else:
@@ -117,51 +442,34 @@ class GeminiFormatter:
             traceback.print_exc()
             return None
 
-    def generate_metadata(self, text: str) -> Optional[str]:
-        """
-        テキストからタイトル案、紹介文案、ハッシュタグを生成
-
-        Returns:
-            フォーマット済みのメタデータ文字列
-        """
-        prompt = f"""以下のテキストから、TikTok/SNS投稿用のタイトル、紹介文、ハッシュタグを生成してください。
+    def _generate_metadata_prompt(self, text: str) -> str:
+        """メタデータ生成用プロンプトを構築"""
+        return f"""以下のテキストから、TikTok/SNS投稿用のタイトル、紹介文、ハッシュタグを生成してください。
 
-【ルール】
-1. タイトル案：3つ提案（各30字以内、【見出し】本文 の形式）
-2. 紹介文案：3つ提案（各100字前後）
-3. ハッシュタグ：5つ提案
+{_METADATA_RULES}
 
 【入力テキスト】
 {text}
 
 【出力フォーマット（このフォーマット厳守）】
-【タイトル案（『【見出し】本文』／各30字以内）】
-
-1）……
-
-2）……
-
-3）……
-
-【紹介文案（各100字前後）】
-
-1）……
-
-2）……
-
-3）……
-
-【ハッシュタグ（5つ）】
-
-#〇〇 #〇〇 #〇〇 #〇〇 #〇〇
+{_METADATA_FORMAT}
 
 上記のフォーマットに従って、テキストの内容に基づいた魅力的なメタデータを生成してください。
 説明や追加コメントは不要です。フォーマット通りに出力してください。
 """
 
+    def generate_metadata(self, text: str) -> Optional[str]:
+        """
+        テキストからタイトル案、紹介文案、ハッシュタグを生成
+
+        Returns:
+            フォーマット済みのメタデータ文字列
+        """
+        prompt = self._generate_metadata_prompt(text)
+
         try:
             print(f"Gemini APIでメタデータ生成中... (テキスト長: {len(text)}文字)")
-            response = self.model.generate_content(prompt)
+            response = self._generate_content("generate_metadata", prompt)
             print(f"メタデータ生成レスポンス受信完了")
 
             if hasattr(response, 'text'):
@@ -180,6 +488,93 @@ class GeminiFormatter:
             traceback.print_exc()
             return None
 
+    def _generate_metadata_batch_prompt(self, texts: List[str]) -> str:
+        """メタデータ一括生成用プロンプトを構築（ルールと出力フォーマットは1回だけ書く）"""
+        items = "\n\n".join(f"=== ITEM {i} ===\n{text.strip()}" for i, text in enumerate(texts, 1))
+        return f"""以下の{len(texts)}件のテキストそれぞれについて、TikTok/SNS投稿用のタイトル、紹介文、ハッシュタグを生成してください。
+
+{_METADATA_RULES}
+4. 各テキストは別々の動画です。他のテキストの内容を混ぜないでください
+
+【入力テキスト（{len(texts)}件。各テキストは「=== ITEM 番号 ===」の行で始まります）】
+{items}
+
+【出力フォーマット（このフォーマット厳守）】
+各テキストの結果を、入力と同じ「=== ITEM 番号 ===」の行で始めて、ITEM 1 から ITEM {len(texts)} まで番号順にすべて出力してください。
+各結果は以下のフォーマットで書いてください。
+
+=== ITEM 番号 ===
+{_METADATA_FORMAT}
+
+説明や追加コメントは不要です。フォーマット通りに出力してください。
+"""
+
+    @staticmethod
+    def _split_metadata_batch(response, count: int) -> List[Optional[str]]:
+        """
+        一括生成の出力を項目ごとに分割
+
+        区切りの番号で対応付ける（順番の入れ替わり・余分な空白や装飾は許容）。
+        見つからない・形式を満たさない項目と、出力の上限で切れた最後の項目はNone
+        """
+        raw = GeminiFormatter._response_text(response) if response is not None else None
+        results: List[Optional[str]] = [None] * count
+        if not raw:
+            return results
+        raw = re.sub(r"^```\w*\s*$", "", raw, flags=re.MULTILINE)
+        headers = list(_METADATA_ITEM.finditer(raw))
+        for header, following in zip(headers, headers[1:] + [None]):
+            index = int(header.group(1)) - 1
+            if not 0 <= index < count or results[index] is not None:
+                continue
+            body = raw[header.end():following.start() if following else len(raw)].strip()
+            if "タイトル" in body and "#" in body:
+                results[index] = body
+        if headers and is_truncated(response):
+            index = int(headers[-1].group(1)) - 1
+            if 0 <= index < count:
+                results[index] = None
+        return results
+
+    def _metadata_batches(self, texts: List[str], batch_size: Optional[int]) -> List[List[int]]:
+        """一括生成するテキストの番号を batch_size 件ずつに分ける"""
+        size = max(1, batch_size or self.METADATA_BATCH_SIZE)
+        return [list(range(start, min(len(texts), start + size))) for start in range(0, len(texts), size)]
+
+    def generate_metadata_batch(self, texts: List[str], batch_size: Optional[int] = None) -> List[Optional[str]]:
+        """
+        複数のテキストのメタデータを、batch_size 件ずつ1回のリクエストにまとめて生成
+
+        ルール・出力フォーマットの指示は1リクエストに1回だけ送る。
+        一括生成で結果が得られなかった項目は generate_metadata で1件ずつ生成し直す
+
+        Returns:
+            texts と同じ順番のメタデータ（失敗した項目はNone）
+        """
+        results: List[Optional[str]] = [None] * len(texts)
+        for batch in self._metadata_batches(texts, batch_size):
+            if len(batch) == 1:
+                results[batch[0]] = self.generate_metadata(texts[batch[0]])
+                continue
+            try:
+                print(f"Gemini APIでメタデータを{len(batch)}件まとめて生成中...")
+                response = self._generate_content("generate_metadata_batch",
+                                                  self._generate_metadata_batch_prompt([texts[i] for i in batch]))
+                print("メタデータ一括生成レスポンス受信完了")
+                items = self._split_metadata_batch(response, len(batch))
+            except Exception as e:
+                print(f"メタデータ一括生成エラー: {type(e).__name__}: {e}")
+                items = [None] * len(batch)
+            failed = [i for i, item in zip(batch, items) if item is None]
+            for i, item in zip(batch, items):
+                results[i] = item
+            if failed:
+                metrics.count("batch_fallbacks", "gemini", "generate_metadata_batch", len(failed))
+                print(f"一括生成で得られなかった{len(failed)}件を1件ずつ生成します")
+                for i in failed:
+                    results[i] = self.generate_metadata(texts[i])
+        return results
+
     def rephrase_text(self, text: str, politeness: str = None, emotion: str = None, style: str = None) -> Optional[str]:
         """
         テキストのニュアンスを変更
@@ -242,7 +637,7 @@ class GeminiFormatter:
         try:
             nuance_desc = f"丁寧度={politeness}, 感情={emotion}, 話し方={style}"
             print(f"Gemini APIでニュアンス変更中... ({nuance_desc})")
-            response = self.model.generate_content(prompt)
+            response = self._generate_content("rephrase_text", prompt)
             print(f"ニュアンス変更レスポンス受信完了")
 
             if hasattr(response, 'text'):
@@ -261,8 +656,13 @@ class GeminiFormatter:
             traceback.print_exc()
             return None
 
-    def _build_character_prompt(self, characters: List[dict] = None) -> str:
-        """キャラクター情報からプロンプト用のセクションを構築（役割システム付き）"""
+    def _build_character_prompt(self, characters: List[dict] = None, speakers_assigned: bool = False) -> str:
+        """
+        キャラクター情報からプロンプト用のセクションを構築（役割システム付き）
+
+        speakers_assigned: 入力テキストのセリフに話者（【キャラ名】）が割り当て済み。
+            役割の推測に使う説明と掛け合いの例を省略する
+        """
         if not characters:
             return ""
 
@@ -288,7 +688,12 @@ class GeminiFormatter:
         all_names = "、".join(c['name'] for c in characters)
 
         # 役割ルール（ソロ/マルチで分岐）
-        if len(characters) == 1:
+        if speakers_assigned and questioners:
+            role_rules = f"""
+【キャラクターの役割】
+- 入力テキストの【キャラ名】は元の動画の話者を割り当てたものです。この割り当てに沿ってセリフを書いてください。
+- {protagonist['name']}が回答者・主人公、{"、".join(c['name'] for c in questioners)}が質問者です。"""
+        elif len(characters) == 1:
             role_rules = f"""
 【キャラクターの役割】
 - {protagonist['name']} が1人で語るモノローグ形式です。
@@ -321,8 +726,7 @@ class GeminiFormatter:
 - テロップのみのページ: 重要な情報や煽りを画面テキストだけで見せる
 - セリフのみのページ: キャラクターの会話・掛け合いで進行する
 - テロップ＋セリフのページ: 重要ポイントをテロップで示しつつ、キャラがリアクションする（内容は被らせない）
-
-【良い例】""" + (f"""
+""" + ("" if speakers_assigned and questioners else "\n【良い例】" + (f"""
 --- P1 ---
 （ト書き: 暗い背景に衝撃的なテキストが表示される）
 【テロップ】知らないと絶対損する、退職前にやるべきこと。
@@ -355,29 +759,16 @@ class GeminiFormatter:
 （ト書き: {protagonist['name']}が指を立てて説明する）
 【テロップ】最大240日分の失業手当が受け取れる。
 【{protagonist['name']}】しかも条件を満たせば、すぐに申請できるんだよ。
-""")
-
-    def rewrite_scenario(self, text: str, politeness: str = None, emotion: str = None,
-                         style: str = None, custom_instruction: str = None,
-                         characters: List[dict] = None,
-                         lead_templates: str = None,
-                         num_pages: int = 15) -> Optional[str]:
-        """
-        漫画動画シナリオの書き直し（ページ構成・ト書き付き）
-
-        Args:
-            text: 整形済みテキスト
-            politeness: 丁寧度（casual/polite/formal）
-            emotion: 感情（gentle/strong/cool）
-            style: 話し方（explanatory/conversational/narrative）
-            custom_instruction: 自由指示テキスト
-            characters: キャラクター情報のリスト（[0]=回答者、[1:]= 質問者）
-            lead_templates: 誘導文テンプレート
-            num_pages: ページ数
-
-        Returns:
-            書き直し後のテキスト
-        """
+"""))
+
+    def _rewrite_scenario_prompt(self, text: str, politeness: str = None, emotion: str = None,
+                                style: str = None, custom_instruction: str = None,
+                                characters: List[dict] = None,
+                                lead_templates: str = None,
+                                num_pages: int = 15,
+                                outline: str = None,
+                                speakers_assigned: bool = False) -> str:
+        """シナリオ書き直し用プロンプトを構築"""
         # ニュアンス指示を構築
         nuance_instructions = []
 
@@ -413,7 +804,7 @@ class GeminiFormatter:
             custom_section = f"\n【追加指示】\n{custom_instruction.strip()}\n"
 
         # キャラクター指示
-        character_section = self._build_character_prompt(characters)
+        character_section = self._build_character_prompt(characters, speakers_assigned and bool(outline))
 
         # 誘導文テンプレート
         lead_section = ""
@@ -428,7 +819,7 @@ class GeminiFormatter:
 {lead_templates.strip()}
 """
 
-        prompt = f"""あなたはTikTok漫画動画のシナリオライターです。以下のテキストを{num_pages}ページの漫画動画シナリオに書き直してください。
+        return f"""あなたはTikTok漫画動画のシナリオライターです。以下のテキストを{num_pages}ページの漫画動画シナリオに書き直してください。
 
 {nuance_text}
 {custom_section}
@@ -514,13 +905,40 @@ class GeminiFormatter:
 【ナミ】これ、最大18ヶ月も受け取れるの。
 【ナミ】一番受け取りやすい制度だから、絶対チェックして。
 
-【入力テキスト】
-{text}
+{_input_section(text, outline, num_pages)}
 
 【出力】
 {num_pages}ページの漫画動画シナリオのみを出力してください。説明や追加コメントは不要です。
 """
 
+    def rewrite_scenario(self, text: str, politeness: str = None, emotion: str = None,
+                         style: str = None, custom_instruction: str = None,
+                         characters: List[dict] = None,
+                         lead_templates: str = None,
+                         num_pages: int = 15,
+                         outline: str = None,
+                         speakers_assigned: bool = False) -> Optional[str]:
+        """
+        漫画動画シナリオの書き直し（ページ構成・ト書き付き）
+
+        Args:
+            text: 整形済みテキスト
+            politeness: 丁寧度（casual/polite/formal）
+            emotion: 感情（gentle/strong/cool）
+            style: 話し方（explanatory/conversational/narrative）
+            custom_instruction: 自由指示テキスト
+            characters: キャラクター情報のリスト（[0]=回答者、[1:]= 質問者）
+            lead_templates: 誘導文テンプレート
+            num_pages: ページ数
+            outline: ページ割り済みのテキスト（segmenter.format_outline の出力）
+            speakers_assigned: outline のセリフに話者（【キャラ名】）が割り当て済み
+
+        Returns:
+            書き直し後のテキスト
+        """
+        prompt = self._rewrite_scenario_prompt(text, politeness, emotion, style, custom_instruction,
+                                               characters, lead_templates, num_pages, outline, speakers_assigned)
+
         try:
             desc_parts = []
             if politeness:
@@ -537,18 +955,13 @@ class GeminiFormatter:
                 desc_parts.append(f"指示={custom_instruction[:20]}")
             desc = ", ".join(desc_parts) if desc_parts else "デフォルト"
             print(f"Gemini APIでシナリオ書き直し中... ({desc})")
-            response = self.model.generate_content(prompt)
+            result = self._generate_scenario("rewrite_scenario", prompt, num_pages)
             print(f"シナリオ書き直しレスポンス受信完了")
 
-            if hasattr(response, 'text'):
-                result = response.text.strip()
+            if result is not None:
                 print(f"シナリオ書き直し結果: {len(result)}文字")
-                return result
-            else:
-                print(f"レスポンスにtextが含まれていません: {response}")
-                if hasattr(response, 'prompt_feedback'):
-                    print(f"Prompt feedback: {response.prompt_feedback}")
-                return None
+                self._check_page_count("rewrite_scenario", [result], num_pages)
+            return result
 
         except Exception as e:
             print(f"シナリオ書き直しエラー: {type(e).__name__}: {e}")
@@ -556,31 +969,15 @@ class GeminiFormatter:
             traceback.print_exc()
             return None
 
-    def generate_variations(self, text: str, num_variations: int = 3,
-                            politeness: str = None, emotion: str = None,
-                            style: str = None, custom_instruction: str = None,
-                            characters: List[dict] = None,
-                            lead_templates: str = None,
-                            num_pages: int = 15) -> Optional[List[str]]:
-        """
-        複数パターンの漫画動画シナリオを一括生成
-
-        Args:
-            text: 整形済みテキスト
-            num_variations: 生成パターン数（1〜3）
-            politeness: 丁寧度
-            emotion: 感情
-            style: 話し方
-            custom_instruction: 自由指示テキスト
-            characters: キャラクター情報のリスト（[0]=回答者、[1:]=質問者）
-            lead_templates: 誘導文テンプレート
-            num_pages: ページ数
-
-        Returns:
-            バリエーションのリスト
-        """
-        num_variations = max(1, min(3, num_variations))
-
+    def _generate_variations_prompt(self, text: str, num_variations: int = 3,
+                                  politeness: str = None, emotion: str = None,
+                                  style: str = None, custom_instruction: str = None,
+                                  characters: List[dict] = None,
+                                  lead_templates: str = None,
+                                  num_pages: int = 15,
+                                  outline: str = None,
+                                  speakers_assigned: bool = False) -> str:
+        """複数パターン生成用プロンプトを構築"""
         # ニュアンス指示を構築
         nuance_instructions = []
 
@@ -616,7 +1013,7 @@ class GeminiFormatter:
             custom_section = f"\n【追加指示】\n{custom_instruction.strip()}\n"
 
         # キャラクター指示
-        character_section = self._build_character_prompt(characters)
+        character_section = self._build_character_prompt(characters, speakers_assigned and bool(outline))
 
         # 誘導文テンプレート
         lead_section = ""
@@ -635,7 +1032,7 @@ class GeminiFormatter:
         protagonist_name = characters[0]['name'] if characters else "太郎"
         questioner_name = characters[1]['name'] if characters and len(characters) > 1 else "花子"
 
-        prompt = f"""あなたはTikTok漫画動画のシナリオライターです。以下のテキストを{num_variations}パターン、各{num_pages}ページの漫画動画シナリオに書き直してください。
+        return f"""あなたはTikTok漫画動画のシナリオライターです。以下のテキストを{num_variations}パターン、各{num_pages}ページの漫画動画シナリオに書き直してください。
 
 {nuance_text}
 {custom_section}
@@ -721,37 +1118,333 @@ class GeminiFormatter:
 【テロップ】退職後のお金、9割の人が損してます。
 ...（以下同様にP2〜P5）
 
-【入力テキスト】
-{text}
+{_input_section(text, outline, num_pages)}
 
 【出力】
 {num_variations}パターンを ===VARIATION=== で区切って、各{num_pages}ページで出力してください。
 """
 
+    @staticmethod
+    def _response_text(response) -> Optional[str]:
+        """レスポンスのテキスト（textを含まない場合はNone）"""
+        if hasattr(response, 'text'):
+            return response.text.strip()
+        print(f"レスポンスにtextが含まれていません: {response}")
+        if hasattr(response, 'prompt_feedback'):
+            print(f"Prompt feedback: {response.prompt_feedback}")
+        return None
+
+    @staticmethod
+    def _continue_scenario(method: str, prompt: str, text: str, num_variations: int):
+        """出力の上限で切れたシナリオの続きを生成するプロンプト（ログ・メトリクス付き）"""
+        kept, continuation_prompt = _continuation(prompt, text, num_variations)
+        metrics.count("continuations", "gemini", method)
+        print(f"出力の上限で切れたため、完成した{count_pages(kept)}ページの続きから生成します")
+        return kept, continuation_prompt
+
+    @staticmethod
+    def _join_continuation(kept: str, continued: str) -> str:
+        return f"{kept}\n\n{continued}".strip() if kept else continued
+
+    def _generate_scenario(self, method: str, prompt: str, num_pages: int,
+                           num_variations: int = 1) -> Optional[str]:
+        """
+        シナリオを生成（ページ数に合わせた generation_config 付き）
+
+        出力の上限で切れた場合は、最初からやり直さず、最後の完成したページから続きを生成する（MAX_CONTINUATIONS 回まで）
+        """
+        config = scenario_generation_config(num_pages, num_variations)
+        response = self._generate_content(method, prompt, config)
+        text = self._response_text(response)
+        page_tokens.observe(response, text)
+        for _ in range(MAX_CONTINUATIONS):
+            if text is None or not is_truncated(response):
+                return text
+            kept, continuation_prompt = self._continue_scenario(method, prompt, text, num_variations)
+            response = self._generate_content(method, continuation_prompt, config)
+            continued = self._response_text(response)
+            if continued is None:
+                return text
+            text = self._join_continuation(kept, continued)
+        if is_truncated(response):
+            print(f"{MAX_CONTINUATIONS}回続きを生成しても出力が完結しませんでした")
+        return text
+
+    @staticmethod
+    def _check_page_count(method: str, scenarios: List[str], num_pages: int):
+        """指定したページ数にならなかったシナリオを記録"""
+        for scenario in scenarios:
+            pages = count_pages(scenario)
+            if pages != num_pages:
+                print(f"ページ数が指定と異なります: {pages}ページ（指定 {num_pages}ページ）")
+                metrics.count("page_count_mismatch", "gemini", method)
+
+    @staticmethod
+    def _split_variations(raw_result: str) -> List[str]:
+        """===VARIATION=== 区切りの出力をパターンごとに分割"""
+        # ===VARIATION=== で分割
+        variations = [v.strip() for v in raw_result.split("===VARIATION===")]
+        # 空のバリエーションを除去
+        return [v for v in variations if v]
+
+    def generate_variations(self, text: str, num_variations: int = 3,
+                            politeness: str = None, emotion: str = None,
+                            style: str = None, custom_instruction: str = None,
+                            characters: List[dict] = None,
+                            lead_templates: str = None,
+                            num_pages: int = 15,
+                            outline: str = None,
+                            speakers_assigned: bool = False) -> Optional[List[str]]:
+        """
+        複数パターンの漫画動画シナリオを一括生成
+
+        Args:
+            text: 整形済みテキスト
+            num_variations: 生成パターン数（1〜MAX_VARIATIONS）
+            politeness: 丁寧度
+            emotion: 感情
+            style: 話し方
+            custom_instruction: 自由指示テキスト
+            characters: キャラクター情報のリスト（[0]=回答者、[1:]=質問者）
+            lead_templates: 誘導文テンプレート
+            num_pages: ページ数
+            outline: ページ割り済みのテキスト（segmenter.format_outline の出力）
+            speakers_assigned: outline のセリフに話者（【キャラ名】）が割り当て済み
+
+        Returns:
+            バリエーションのリスト
+        """
+        num_variations = max(1, min(self.MAX_VARIATIONS, num_variations))
+
+        prompt = self._generate_variations_prompt(text, num_variations, politeness, emotion, style,
+                                                  custom_instruction, characters, lead_templates, num_pages,
+                                                  outline, speakers_assigned)
+
         try:
             print(f"Gemini APIで{num_variations}パターン生成中...")
-            response = self.model.generate_content(prompt)
+            raw_result = self._generate_scenario("generate_variations", prompt, num_pages, num_variations)
             print(f"バリエーション生成レスポンス受信完了")
 
-            if hasattr(response, 'text'):
-                raw_result = response.text.strip()
-                print(f"バリエーション生成結果: {len(raw_result)}文字")
+            if raw_result is None:
+                return None
+            print(f"バリエーション生成結果: {len(raw_result)}文字")
 
-                # ===VARIATION=== で分割
-                variations = [v.strip() for v in raw_result.split("===VARIATION===")]
-                # 空のバリエーションを除去
-                variations = [v for v in variations if v]
+            variations = self._split_variations(raw_result)
 
-                print(f"生成されたバリエーション数: {len(variations)}")
-                return variations
-            else:
-                print(f"レスポンスにtextが含まれていません: {response}")
-                if hasattr(response, 'prompt_feedback'):
-                    print(f"Prompt feedback: {response.prompt_feedback}")
-                return None
+            print(f"生成されたバリエーション数: {len(variations)}")
+            self._check_page_count("generate_variations", variations, num_pages)
+            return variations
 
         except Exception as e:
             print(f"バリエーション生成エラー: {type(e).__name__}: {e}")
             import traceback
             traceback.print_exc()
             return None
+
+    # ===========================================
+    # 非同期API（generate_content_async）
+    # キャンセルされると実行中のリクエストも中断される
+    # ===========================================
+    async def _generate_content_async(self, method: str, prompt: str, timeout: Optional[float] = None,
+                                      generation_config: Optional[dict] = None):
+        """
+        generate_content_asyncを計測付きで呼び出し（同じプロンプトの同時呼び出しは1回にまとめる）
+
+        まとめられた呼び出しには、最初の呼び出しのタイムアウトが適用される
+        """
+        key = prompt_key(self.model_name or "", method, prompt)
+        if self._hedges(method):
+            return await _async_flight.do(
+                key, lambda: self._call_hedged_async(method, prompt, timeout, generation_config), "gemini", method)
+        return await _async_flight.do(
+            key, lambda: self._call_generate_content_async(method, prompt, timeout, generation_config),
+            "gemini", method)
+
+    def _hedges(self, method: str) -> bool:
+        return self.hedge and method in self.HEDGED_METHODS
+
+    async def _call_hedged_async(self, method: str, prompt: str, timeout: Optional[float] = None,
+                                 generation_config: Optional[dict] = None):
+        """直近の p90 を超えても応答がなければ同じリクエストをもう1つ送り、先に返った方を使う（予算あり）"""
+        return await hedged(lambda: self._call_generate_content_async(method, prompt, timeout, generation_config),
+                            gemini_hedge_policy, "gemini", method)
+
+    async def _call_generate_content_async(self, method: str, prompt: str, timeout: Optional[float] = None,
+                                           generation_config: Optional[dict] = None):
+        """
+        generate_content_asyncを計測付きで呼び出し（タイムアウト付き）
+
+        障害時の代替モデルは同期版と同じ。ただしタイムアウトした場合は待ち時間が倍にならないよう代替モデルは使わない
+        """
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUTS.get(method)
+        _configure(self.api_key)
+        request_options = {"timeout": timeout} if timeout else None
+        kwargs = {"generation_config": generation_config} if generation_config else {}
+        error = None
+        for model_name in self._model_names():
+            skipped = self._next_model(method, model_name, error)
+            if skipped is not None:
+                error = error or skipped
+                continue
+            breaker = breakers.get(f"gemini:{model_name}")
+            try:
+                with metrics.track("gemini", method) as record:
+                    response = await asyncio.wait_for(
+                        self._get_model(model_name).generate_content_async(prompt, request_options=request_options,
+                                                                     **kwargs),
+                        timeout
+                    )
+                    record_usage(record, response)
+                    if not getattr(response, "candidates", None):
+                        record.fail("EmptyResponse")
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                failed = is_backend_failure(e)
+                breaker.record(not failed)
+                if not failed or isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+                    raise
+                error = e
+                continue
+            breaker.record(True)
+            return response
+        raise error
+
+    async def _request_response_async(self, method: str, prompt: str, label: str,
+                                      timeout: Optional[float] = None, generation_config: Optional[dict] = None):
+        """
+        非同期呼び出しの共通処理
+
+        失敗・タイムアウト時はNoneを返す。キャンセル（CancelledError）は呼び出し元に伝播させる
+        """
+        try:
+            print(f"Gemini APIで{label}中...（非同期）")
+            response = await self._generate_content_async(method, prompt, timeout, generation_config)
+            print(f"{label}レスポンス受信完了")
+            return response
+        except asyncio.CancelledError:
+            print(f"{label}をキャンセルしました")
+            raise
+        except asyncio.TimeoutError:
+            print(f"{label}タイムアウト: {timeout or self.DEFAULT_TIMEOUTS.get(method)}秒以内に応答がありませんでした")
+            return None
+        except Exception as e:
+            print(f"{label}エラー: {type(e).__name__}: {e}")
+            return None
+
+    async def _request_text_async(self, method: str, prompt: str, label: str,
+                                  timeout: Optional[float] = None) -> Optional[str]:
+        """非同期呼び出しの共通処理（レスポンスのテキストを返す）"""
+        response = await self._request_response_async(method, prompt, label, timeout)
+        return self._response_text(response) if response is not None else None
+
+    async def _request_scenario_async(self, method: str, prompt: str, label: str, num_pages: int,
+                                      num_variations: int = 1, timeout: Optional[float] = None) -> Optional[str]:
+        """_generate_scenario の非同期版（タイムアウトは1回の呼び出しごと）"""
+        config = scenario_generation_config(num_pages, num_variations)
+        response = await self._request_response_async(method, prompt, label, timeout, config)
+        text = self._response_text(response) if response is not None else None
+        page_tokens.observe(response, text)
+        for _ in range(MAX_CONTINUATIONS):
+            if text is None or not is_truncated(response):
+                return text
+            kept, continuation_prompt = self._continue_scenario(method, prompt, text, num_variations)
+            response = await self._request_response_async(method, continuation_prompt, f"{label}（続き）",
+                                                          timeout, config)
+            continued = self._response_text(response) if response is not None else None
+            if continued is None:
+                return text
+            text = self._join_continuation(kept, continued)
+        if is_truncated(response):
+            print(f"{MAX_CONTINUATIONS}回続きを生成しても出力が完結しませんでした")
+        return text
+
+    async def format_text_async(self, text: str, timeout: Optional[float] = None) -> Optional[str]:
+        """format_text の非同期版"""
+        return await self._request_text_async("format_text", self._format_text_prompt(text),
+                                               "テキスト整形", timeout)
+
+    async def generate_filename_async(self, formatted_text: str,
+                                      timeout: Optional[float] = None) -> Optional[str]:
+        """generate_filename の非同期版"""
+        result = await self._request_text_async("generate_filename",
+                                                self._generate_filename_prompt(formatted_text),
+                                                "ファイル名生成", timeout)
+        return self._clean_filename(result) if result is not None else None
+
+    async def generate_metadata_async(self, text: str, timeout: Optional[float] = None) -> Optional[str]:
+        """generate_metadata の非同期版"""
+        return await self._request_text_async("generate_metadata", self._generate_metadata_prompt(text),
+                                               "メタデータ生成", timeout)
+
+    async def generate_metadata_batch_async(self, texts: List[str], batch_size: Optional[int] = None,
+                                            timeout: Optional[float] = None) -> List[Optional[str]]:
+        """generate_metadata_batch の非同期版（各リクエスト・1件ずつの生成し直しは同時に実行）"""
+
+        async def one_batch(batch):
+            if len(batch) == 1:
+                return batch, None
+            response = await self._request_response_async(
+                "generate_metadata_batch", self._generate_metadata_batch_prompt([texts[i] for i in batch]),
+                f"メタデータ一括生成（{len(batch)}件）", timeout)
+            return batch, self._split_metadata_batch(response, len(batch))
+
+        results: List[Optional[str]] = [None] * len(texts)
+        singles, failed = [], []
+        for batch, items in await asyncio.gather(*(one_batch(b) for b in self._metadata_batches(texts, batch_size))):
+            if items is None:
+                singles.extend(batch)
+                continue
+            for i, item in zip(batch, items):
+                results[i] = item
+                if item is None:
+                    failed.append(i)
+        if failed:
+            metrics.count("batch_fallbacks", "gemini", "generate_metadata_batch", len(failed))
+            print(f"一括生成で得られなかった{len(failed)}件を1件ずつ生成します")
+        retry = singles + failed
+        for i, item in zip(retry, await asyncio.gather(*(self.generate_metadata_async(texts[i], timeout)
+                                                         for i in retry))):
+            results[i] = item
+        return results
+
+    async def rewrite_scenario_async(self, text: str, politeness: str = None, emotion: str = None,
+                                     style: str = None, custom_instruction: str = None,
+                                     characters: List[dict] = None,
+                                     lead_templates: str = None,
+                                     num_pages: int = 15,
+                                     outline: str = None,
+                                     speakers_assigned: bool = False,
+                                     timeout: Optional[float] = None) -> Optional[str]:
+        """rewrite_scenario の非同期版"""
+        prompt = self._rewrite_scenario_prompt(text, politeness, emotion, style, custom_instruction,
+                                               characters, lead_templates, num_pages, outline, speakers_assigned)
+        result = await self._request_scenario_async("rewrite_scenario", prompt, "シナリオ書き直し", num_pages,
+                                                    timeout=timeout)
+        if result is not None:
+            self._check_page_count("rewrite_scenario", [result], num_pages)
+        return result
+
+    async def generate_variations_async(self, text: str, num_variations: int = 3,
+                                        politeness: str = None, emotion: str = None,
+                                        style: str = None, custom_instruction: str = None,
+                                        characters: List[dict] = None,
+                                        lead_templates: str = None,
+                                        num_pages: int = 15,
+                                        outline: str = None,
+                                        speakers_assigned: bool = False,
+                                        timeout: Optional[float] = None) -> Optional[List[str]]:
+        """generate_variations の非同期版"""
+        num_variations = max(1, min(self.MAX_VARIATIONS, num_variations))
+        prompt = self._generate_variations_prompt(text, num_variations, politeness, emotion, style,
+                                                  custom_instruction, characters, lead_templates, num_pages,
+                                                  outline, speakers_assigned)
+        result = await self._request_scenario_async("generate_variations", prompt, f"{num_variations}パターン生成",
+                                                    num_pages, num_variations, timeout)
+        if result is None:
+            return None
+        variations = self._split_variations(result)
+        self._check_page_count("generate_variations", variations, num_pages)
+        return variations
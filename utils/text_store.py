@@ -0,0 +1,193 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Optional, Union, List
+
+
+class TextRef:
+    """
+    TextStore に保存したテキストへの参照
+
+    同じ内容のテキストには同じ TextRef が返される。どのセッションからも参照されなくなると本体も削除される
+    """
+
+    __slots__ = ("digest", "length", "__weakref__")
+
+    def __init__(self, digest: str, length: int):
+        self.digest = digest
+        self.length = length
+
+    def __repr__(self):
+        return f"TextRef({self.digest[:12]}, {self.length}文字)"
+
+
+class TextStore:
+    """
+    セッション間で共有する内容アドレス方式のテキストストア
+
+    - 同じ内容のテキストは1つだけ保持する（セッション内・セッション間で重複しない）
+    - compress_threshold バイト以上のテキストはzlibで圧縮して保持する
+    - idle_seconds 以上参照されていないテキストはディスクに退避し、次に参照されたときに読み戻す
+      （退避先は指定がなければプロセスごとの一時ディレクトリ。プロセス終了時に削除する）
+    - 展開済みのテキストは直近 cache_size 件だけメモリに残す
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None, compress_threshold: int = 1024,
+                 idle_seconds: float = 600, cache_size: int = 64):
+        if spill_dir is None:
+            # 他のプロセスと同じファイル名（内容のハッシュ）で退避先を共有しないよう、プロセスごとに分ける
+            spill_dir = tempfile.mkdtemp(prefix="tiktok-scenario-texts-")
+            weakref.finalize(self, shutil.rmtree, spill_dir, ignore_errors=True)
+        self.spill_dir = spill_dir
+        self.compress_threshold = compress_threshold
+        self.idle_seconds = idle_seconds
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._refs = weakref.WeakValueDictionary()  # digest -> TextRef
+        self._blobs = {}  # digest -> (圧縮済みか, bytes)
+        self._spilled = set()
+        self._last_access = {}
+        self._cache = OrderedDict()  # digest -> str
+        self._last_spill_check = time.time()
+
+    def put(self, text: Optional[str]) -> Optional[TextRef]:
+        """テキストを保存して参照を返す"""
+        if text is None:
+            return None
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            ref = self._refs.get(digest)
+            if ref is None:
+                ref = TextRef(digest, len(text))
+                self._refs[digest] = ref
+                weakref.finalize(ref, self._discard, digest)
+                if len(data) >= self.compress_threshold:
+                    self._blobs[digest] = (True, zlib.compress(data, 6))
+                else:
+                    self._blobs[digest] = (False, data)
+                self._remember(digest, text)
+            self._last_access[digest] = time.time()
+        return ref
+
+    def get(self, ref: Optional[TextRef]) -> Optional[str]:
+        """参照からテキストを取得（退避したテキストを読み戻せなかった場合はNone）"""
+        if ref is None:
+            return None
+        digest = ref.digest
+        with self._lock:
+            self._last_access[digest] = time.time()
+            text = self._cache.get(digest)
+            if text is not None:
+                self._cache.move_to_end(digest)
+                return text
+            if digest in self._spilled and not self._load_spilled(digest):
+                return None
+            if digest not in self._blobs:
+                return None
+            compressed, data = self._blobs[digest]
+            text = (zlib.decompress(data) if compressed else data).decode("utf-8")
+            self._remember(digest, text)
+            return text
+
+    def _remember(self, digest: str, text: str):
+        self._cache[digest] = text
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _spill_path(self, digest: str) -> str:
+        return os.path.join(self.spill_dir, digest + ".z")
+
+    def _load_spilled(self, digest: str) -> bool:
+        """退避したテキストを読み戻す。読み戻せなかった場合はFalse（そのテキストは失われる）"""
+        self._spilled.discard(digest)
+        try:
+            with open(self._spill_path(digest), "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"退避したテキストの読み込みエラー: {e}")
+            return False
+        self._blobs[digest] = (True, data)
+        try:
+            os.remove(self._spill_path(digest))
+        except OSError:
+            pass
+        return True
+
+    def _discard(self, digest: str):
+        # 参照がなくなったテキストを削除（weakref.finalize から呼ばれる）
+        with self._lock:
+            if digest in self._refs:
+                return
+            self._blobs.pop(digest, None)
+            self._cache.pop(digest, None)
+            self._last_access.pop(digest, None)
+            if digest in self._spilled:
+                self._spilled.discard(digest)
+                try:
+                    os.remove(self._spill_path(digest))
+                except OSError:
+                    pass
+
+    def spill_idle(self, force: bool = False) -> int:
+        """
+        一定時間参照されていないテキストをディスクに退避
+
+        Returns:
+            退避した件数
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_spill_check < min(60.0, self.idle_seconds):
+                return 0
+            self._last_spill_check = now
+            idle = [d for d, t in self._last_access.items()
+                    if now - t >= self.idle_seconds and d not in self._spilled and d in self._blobs]
+            if not idle:
+                return 0
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                for digest in idle:
+                    compressed, data = self._blobs[digest]
+                    with open(self._spill_path(digest), "wb") as f:
+                        f.write(data if compressed else zlib.compress(data, 6))
+                    del self._blobs[digest]
+                    self._cache.pop(digest, None)
+                    self._spilled.add(digest)
+            except OSError as e:
+                print(f"テキスト退避エラー: {e}")
+            return len(idle)
+
+    def stats(self) -> dict:
+        """保持しているテキストの件数・サイズ"""
+        with self._lock:
+            return {
+                "texts": len(self._refs),
+                "chars": sum(ref.length for ref in self._refs.values()),
+                "stored_bytes": sum(len(data) for _, data in self._blobs.values()),
+                "cached": len(self._cache),
+                "spilled": len(self._spilled),
+            }
+
+
+def put_texts(store: TextStore, value: Union[str, List[str], None]):
+    """テキスト（またはテキストのリスト）を保存して参照に置き換える"""
+    if isinstance(value, list):
+        return [store.put(v) for v in value]
+    return store.put(value)
+
+
+def get_texts(store: TextStore, value):
+    """参照（または参照のリスト）をテキストに戻す"""
+    if isinstance(value, list):
+        return [store.get(v) for v in value]
+    if isinstance(value, TextRef):
+        return store.get(value)
+    return value
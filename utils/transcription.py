@@ -1,23 +1,283 @@
-import requests
-import time
-from typing import Optional
+import abc
+import asyncio
+import bisect
+import ipaddress
+import json
+import mimetypes
+import os
+from array import array
+from typing import Optional, Iterable, List, Tuple, TYPE_CHECKING
+from urllib.parse import urlsplit, urlunsplit
 
+from utils.async_runner import run_sync
+from utils.audio_splitter import AudioChunk, split_audio, remove_chunks
+from utils.circuit_breaker import breakers, CircuitOpenError, is_backend_failure
+from utils.metrics import metrics
+from utils.singleflight import AsyncSingleFlight, file_key
+from utils.startup import timed_import
 
-class GladiaAPI:
-    def __init__(self, api_key: str):
+if TYPE_CHECKING:
+    import httpx
+
+# 同じファイルのアップロード・同じ音声の文字起こしの同時リクエストは1回にまとめる
+_flight = AsyncSingleFlight()
+
+# Gladia に直接渡すメディアURLの最大長
+MAX_MEDIA_URL_LENGTH = 2048
+
+
+def normalize_media_url(url: str) -> Optional[str]:
+    """
+    Gladia に直接取得させるメディアURLを検証して正規化
+
+    http / https 以外、ホストのないもの、空白を含むもの、ローカル・プライベートアドレス
+    （Gladia から取得できない）はNone。フラグメント（#以降）は取り除く
+    """
+    url = (url or "").strip()
+    if not url or len(url) > MAX_MEDIA_URL_LENGTH or any(ch.isspace() for ch in url):
+        return None
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        parts.port  # 不正なポート番号はここで ValueError
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ("http", "https") or not host:
+        return None
+    if host == "localhost" or host.endswith(".local"):
+        return None
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        address = None
+    if address is not None and not address.is_global:
+        return None
+    return urlunsplit((parts.scheme.lower(), parts.netloc, parts.path or "/", parts.query, ""))
+
+
+class Transcript:
+    """
+    時刻・話者付きの文字起こし（発話単位）
+
+    発話ごとの値は辞書のリストではなく列ごとの配列で持つ（長い動画でもメモリを抑えるため）。
+    単語の時刻は全発話分を連結して持ち、発話 i の単語は word_offsets[i]〜word_offsets[i + 1] の範囲。
+    話者が不明な発話の speaker は -1
+    """
+
+    __slots__ = ("text", "starts", "ends", "speakers", "texts",
+                 "words", "word_starts", "word_ends", "word_offsets")
+
+    def __init__(self, text: str = "", starts: Iterable[float] = (), ends: Iterable[float] = (),
+                 speakers: Iterable[int] = (), texts: Iterable[str] = (), words: Iterable[str] = (),
+                 word_starts: Iterable[float] = (), word_ends: Iterable[float] = (),
+                 word_offsets: Optional[Iterable[int]] = None):
+        self.text = text
+        self.starts = array("d", starts)
+        self.ends = array("d", ends)
+        self.speakers = array("h", speakers)
+        self.texts = list(texts)
+        self.words = list(words)
+        self.word_starts = array("d", word_starts)
+        self.word_ends = array("d", word_ends)
+        self.word_offsets = array("I", word_offsets if word_offsets is not None else [0] * (len(self.texts) + 1))
+
+    def add_utterance(self, start: float, end: float, speaker: int, text: str,
+                      words: Iterable[Tuple[str, float, float]] = ()):
+        """発話を末尾に追加（words は (単語, 開始秒, 終了秒)）"""
+        self.starts.append(start)
+        self.ends.append(end)
+        self.speakers.append(speaker)
+        self.texts.append(text)
+        for word, word_start, word_end in words:
+            self.words.append(word)
+            self.word_starts.append(word_start)
+            self.word_ends.append(word_end)
+        self.word_offsets.append(len(self.words))
+
+    @classmethod
+    def from_gladia(cls, transcription: dict) -> "Transcript":
+        """Gladia の result.transcription から作成"""
+        transcript = cls()
+        for utterance in transcription.get("utterances") or []:
+            text = (utterance.get("text") or "").strip()
+            if not text:
+                continue
+            speaker = utterance.get("speaker")
+            words = [((w.get("word") or "").strip(), float(w.get("start") or 0.0), float(w.get("end") or 0.0))
+                     for w in utterance.get("words") or []]
+            transcript.add_utterance(float(utterance.get("start") or 0.0), float(utterance.get("end") or 0.0),
+                                     int(speaker) if speaker is not None else -1, text, words)
+        transcript.text = transcription.get("full_transcript") or "".join(transcript.texts)
+        return transcript
+
+    @classmethod
+    def concat(cls, parts: Iterable[Tuple[float, "Transcript"]]) -> "Transcript":
+        """
+        区間ごとの文字起こしを順に連結
+
+        Args:
+            parts: (区間の開始秒, 区間の文字起こし)。時刻は開始秒だけずらして元の音声の時刻にする
+        """
+        parts = list(parts)
+        merged = cls()
+        for offset, part in parts:
+            for index in range(len(part)):
+                start, end, speaker, text = part.utterance(index)
+                words = [(word, word_start + offset, word_end + offset)
+                         for word, word_start, word_end in part.utterance_words(index)]
+                merged.add_utterance(start + offset, end + offset, speaker, text, words)
+        merged.text = "".join(part.text for _, part in parts)
+        return merged
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def duration(self) -> float:
+        return self.ends[-1] if self.ends else 0.0
+
+    def utterance(self, index: int) -> Tuple[float, float, int, str]:
+        """(開始秒, 終了秒, 話者, テキスト)"""
+        return self.starts[index], self.ends[index], self.speakers[index], self.texts[index]
+
+    def speaker_at(self, seconds: float) -> int:
+        """その時刻に話している（直前に話し始めた）発話の話者"""
+        index = bisect.bisect_right(self.starts, seconds) - 1
+        return self.speakers[max(0, index)] if self.speakers else -1
+
+    def speaker_durations(self) -> dict:
+        """話者 -> 発話時間の合計（秒）。話者不明の発話は含めない"""
+        durations = {}
+        for start, end, speaker in zip(self.starts, self.ends, self.speakers):
+            if speaker >= 0:
+                durations[speaker] = durations.get(speaker, 0.0) + max(0.0, end - start)
+        return durations
+
+    def utterance_words(self, index: int) -> list:
+        """発話内の (単語, 開始秒, 終了秒) のリスト（単語の時刻がなければ空）"""
+        begin, end = self.word_offsets[index], self.word_offsets[index + 1]
+        return list(zip(self.words[begin:end], self.word_starts[begin:end], self.word_ends[begin:end]))
+
+    def to_json(self) -> str:
+        """保存用のJSON（列ごとのリスト）"""
+        return json.dumps({
+            "text": self.text, "starts": self.starts.tolist(), "ends": self.ends.tolist(),
+            "speakers": self.speakers.tolist(), "texts": self.texts, "words": self.words,
+            "word_starts": self.word_starts.tolist(), "word_ends": self.word_ends.tolist(),
+            "word_offsets": self.word_offsets.tolist(),
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: Optional[str]) -> Optional["Transcript"]:
+        """to_json の出力から復元（読み込めなければNone）"""
+        if not data:
+            return None
+        try:
+            return cls(**json.loads(data))
+        except (ValueError, TypeError) as e:
+            print(f"文字起こしデータ読み込みエラー: {e}")
+            return None
+
+
+class TranscriptionBackend(abc.ABC):
+    """
+    文字起こしバックエンドの共通インターフェース
+
+    ファイルを文字起こしして Transcript を返す。失敗時はNone（例外は送出しない）
+    """
+
+    name = ""
+    # 話者分離に対応しているか
+    supports_diarization = False
+
+    def available(self) -> bool:
+        """このプロセスで使えるか（依存ライブラリ・APIキーがあるか）"""
+        return True
+
+    @abc.abstractmethod
+    def transcribe_file(self, file_path: str, language: str = "ja", diarization: bool = False,
+                        num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """ファイルを文字起こし（失敗時はNone）"""
+
+
+class AsyncGladiaAPI:
+    """
+    Gladia APIの非同期クライアント
+
+    1つのイベントループから多数の文字起こしジョブを同時にポーリングできる。
+    HTTP接続はクライアント内で共有し、同時リクエスト数はセマフォで制限する。
+    ※ 最初に使ったイベントループ上でのみ使用すること
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 20,
+                 transport: Optional["httpx.AsyncBaseTransport"] = None):
         self.api_key = api_key
         self.base_url = "https://api.gladia.io/v2"
         self.headers = {
             "x-gladia-key": api_key,
             "Content-Type": "application/json"
         }
+        # ポーリング間隔（秒）
+        self.poll_interval = 3
+        # 長い音声を分割して同時に文字起こしする区間の長さ（秒。0なら分割しない）
+        self.segment_seconds = 120
+        # 同時に文字起こしする区間の数
+        self.max_parallel_segments = 8
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
 
-    def upload_file(self, file_path: str) -> Optional[str]:
-        """動画ファイルをアップロードしてURLを取得"""
+    def _get_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            # httpx は初回リクエスト時に読み込む
+            with timed_import("httpx"):
+                import httpx
+            self._client = httpx.AsyncClient(
+                transport=self._transport,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def _request(self, method: str, url: str, **kwargs) -> "httpx.Response":
+        """
+        APIを呼び出す（障害が続いている間はサーキットブレーカーで呼ばずに CircuitOpenError）
+
+        通信エラー・タイムアウト・429・5xx を障害として記録する
+        """
+        breaker = breakers.get("gladia")
+        if not breaker.allow():
+            metrics.count("short_circuited", "gladia", "request")
+            raise CircuitOpenError(breaker.name, breaker.retry_in())
+        client = self._get_client()
+        try:
+            async with self._semaphore:
+                response = await client.request(method, url, **kwargs)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record(not is_backend_failure(e))
+            raise
+        breaker.record(response.status_code != 429 and response.status_code < 500)
+        return response
+
+    async def upload_file(self, file_path: str) -> Optional[str]:
+        """動画ファイルをアップロードしてURLを取得（同じ内容のファイルの同時アップロードは1回にまとめる）"""
         try:
-            import os
-            import mimetypes
+            # 大きな動画のハッシュ計算でイベントループを止めないよう別スレッドで行う
+            key = await asyncio.to_thread(file_key, file_path)
+        except OSError as e:
+            print(f"ファイル読み込みエラー: {e}")
+            return None
+        return await _flight.do(("upload", self.api_key, key), lambda: self._upload_file(file_path),
+                                "gladia", "upload")
 
+    async def _upload_file(self, file_path: str) -> Optional[str]:
+        try:
             filename = os.path.basename(file_path)
             # ファイルタイプを自動判定
             mime_type, _ = mimetypes.guess_type(file_path)
@@ -29,14 +289,16 @@ class GladiaAPI:
             with open(file_path, "rb") as f:
                 # ファイル名とMIMEタイプを明示的に指定
                 files = {"audio": (filename, f, mime_type)}
-                response = requests.post(
-                    f"{self.base_url}/upload",
-                    headers={"x-gladia-key": self.api_key},
-                    files=files
-                )
+                with metrics.track("gladia", "upload"):
+                    response = await self._request(
+                        "POST",
+                        f"{self.base_url}/upload",
+                        headers={"x-gladia-key": self.api_key},
+                        files=files
+                    )
 
-                print(f"アップロードレスポンス: {response.status_code}")
-                response.raise_for_status()
+                    print(f"アップロードレスポンス: {response.status_code}")
+                    response.raise_for_status()
 
                 result = response.json()
                 audio_url = result.get("audio_url")
@@ -50,8 +312,27 @@ class GladiaAPI:
                 print(f"詳細: {response.text}")
             return None
 
-    def transcribe(self, audio_url: str, language: str = "ja") -> Optional[str]:
-        """音声ファイルを文字起こし"""
+    async def transcribe(self, audio_url: str, language: str = "ja") -> Optional[str]:
+        """音声ファイルを文字起こし（同じ音声の同時リクエストは1回にまとめる）"""
+        transcript = await self.transcribe_detailed(audio_url, language)
+        return transcript.text if transcript is not None else None
+
+    async def transcribe_detailed(self, audio_url: str, language: str = "ja", diarization: bool = False,
+                                  num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """
+        音声ファイルを文字起こし（発話ごとの時刻・話者付き）
+
+        Args:
+            diarization: 話者分離を行う（発話ごとの speaker が話者番号になる）
+            num_speakers: 話者数（Noneなら自動判定）
+        """
+        num_speakers = num_speakers if diarization else None
+        return await _flight.do(("transcribe", self.api_key, audio_url, language, diarization, num_speakers),
+                                lambda: self._transcribe(audio_url, language, diarization, num_speakers),
+                                "gladia", "transcribe")
+
+    async def _transcribe(self, audio_url: str, language: str, diarization: bool = False,
+                          num_speakers: Optional[int] = None) -> Optional[Transcript]:
         try:
             # 文字起こしリクエストを送信
             payload = {
@@ -60,13 +341,19 @@ class GladiaAPI:
                     "languages": [language]
                 }
             }
+            if diarization:
+                payload["diarization"] = True
+                if num_speakers:
+                    payload["diarization_config"] = {"number_of_speakers": num_speakers}
 
-            response = requests.post(
-                f"{self.base_url}/pre-recorded",
-                headers=self.headers,
-                json=payload
-            )
-            response.raise_for_status()
+            with metrics.track("gladia", "transcribe"):
+                response = await self._request(
+                    "POST",
+                    f"{self.base_url}/pre-recorded",
+                    headers=self.headers,
+                    json=payload
+                )
+                response.raise_for_status()
             result = response.json()
 
             # 結果IDを取得
@@ -76,51 +363,165 @@ class GladiaAPI:
                 return None
 
             # 結果を取得（ポーリング）
-            return self._poll_result(result_id)
+            return await self._poll_result(result_id)
 
         except Exception as e:
             print(f"文字起こしエラー: {e}")
             print(f"詳細: {response.text if 'response' in locals() else '不明'}")
             return None
 
-    def _poll_result(self, result_id: str, max_attempts: int = 60) -> Optional[str]:
+    async def _poll_result(self, result_id: str, max_attempts: int = 60) -> Optional[Transcript]:
         """文字起こし結果をポーリングして取得"""
+        # ジョブ全体（キュー待ち〜完了）の所要時間を記録
+        with metrics.track("gladia", "transcription_job") as job:
+            result = await self._poll_loop(result_id, max_attempts, job)
+            if result is None:
+                job.fail(job.error_class or "JobFailed")
+            return result
+
+    async def _poll_loop(self, result_id: str, max_attempts: int, job) -> Optional[Transcript]:
         for attempt in range(max_attempts):
+            job.retries = attempt
             try:
-                response = requests.get(
-                    f"{self.base_url}/pre-recorded/{result_id}",
-                    headers=self.headers
-                )
-                response.raise_for_status()
+                with metrics.track("gladia", "poll"):
+                    response = await self._request(
+                        "GET",
+                        f"{self.base_url}/pre-recorded/{result_id}",
+                        headers=self.headers
+                    )
+                    response.raise_for_status()
                 result = response.json()
 
                 status = result.get("status")
                 print(f"ポーリング {attempt + 1}/{max_attempts}: ステータス = {status}")
 
                 if status == "done":
-                    # テキストを抽出
+                    # テキストと発話ごとの時刻・話者を抽出
                     transcription = result.get("result", {}).get("transcription", {})
-                    full_transcript = transcription.get("full_transcript", "")
-                    return full_transcript
+                    return Transcript.from_gladia(transcription)
                 elif status == "error":
                     error_msg = result.get("error", "不明なエラー")
                     print(f"文字起こしエラー: {error_msg}")
+                    job.fail("GladiaJobError")
                     return None
 
-                # 処理中の場合は待機
-                time.sleep(3)
+                # 処理中の場合は待機（スレッドは占有しない）
+                await asyncio.sleep(self.poll_interval)
 
             except Exception as e:
                 print(f"結果取得エラー: {e}")
                 print(f"詳細: {response.text if 'response' in locals() else '不明'}")
+                job.fail(type(e).__name__)
                 return None
 
         print("タイムアウト: 文字起こしが完了しませんでした")
+        job.fail("Timeout")
         return None
 
-    def transcribe_from_file(self, file_path: str, language: str = "ja") -> Optional[str]:
+    async def transcribe_from_file(self, file_path: str, language: str = "ja") -> Optional[str]:
         """ファイルから直接文字起こし（便利メソッド）"""
-        audio_url = self.upload_file(file_path)
+        audio_url = await self.upload_file(file_path)
         if audio_url:
-            return self.transcribe(audio_url, language)
+            return await self.transcribe(audio_url, language)
         return None
+
+    async def transcribe_file(self, file_path: str, language: str = "ja", diarization: bool = False,
+                              num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """
+        ファイルをアップロードして文字起こし
+
+        segment_seconds より長い音声は無音の位置で区間に分け、区間ごとに同時に文字起こしして
+        時刻をずらしながら順に連結する（処理時間が音声の長さではなく区間の長さで決まる）。
+        話者分離する場合は区間ごとに話者番号が変わってしまうため分割しない
+        """
+        chunks = None
+        if self.segment_seconds and not diarization:
+            try:
+                # デコード・無音検出はCPUを使うため別スレッドで行う
+                chunks = await asyncio.to_thread(split_audio, file_path, self.segment_seconds)
+            except Exception as e:
+                print(f"音声の分割エラー（分割せずに文字起こしします）: {e}")
+        try:
+            if chunks is not None and len(chunks) > 1:
+                return await self._transcribe_chunks(chunks, language)
+            audio_url = await self.upload_file(file_path)
+            if not audio_url:
+                return None
+            return await self.transcribe_detailed(audio_url, language, diarization, num_speakers)
+        finally:
+            remove_chunks(chunks, file_path)
+
+    async def _transcribe_chunks(self, chunks: List[AudioChunk], language: str) -> Optional[Transcript]:
+        limit = asyncio.Semaphore(self.max_parallel_segments)
+
+        async def one(chunk: AudioChunk) -> Optional[Transcript]:
+            async with limit:
+                audio_url = await self.upload_file(chunk.path)
+                if not audio_url:
+                    return None
+                return await self.transcribe_detailed(audio_url, language)
+
+        with metrics.track("gladia", "transcribe_segments") as record:
+            parts = await asyncio.gather(*(one(chunk) for chunk in chunks))
+            failed = sum(part is None for part in parts)
+            if failed:
+                print(f"{len(chunks)}区間のうち{failed}区間の文字起こしに失敗しました")
+                record.fail("SegmentFailed")
+                return None
+        return Transcript.concat((chunk.offset, part) for chunk, part in zip(chunks, parts))
+
+    async def aclose(self):
+        """コネクションプールを閉じる"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class GladiaAPI(TranscriptionBackend):
+    """
+    Gladia APIの同期クライアント
+
+    AsyncGladiaAPI の薄いラッパー。処理はプロセス共通のイベントループ上で実行されるため、
+    複数スレッドから呼ばれてもコネクションプールを共有する
+    """
+
+    name = "gladia"
+    supports_diarization = True
+
+    def __init__(self, api_key: str, max_concurrency: int = 20,
+                 transport: Optional["httpx.AsyncBaseTransport"] = None):
+        self.api_key = api_key
+        self.client = AsyncGladiaAPI(api_key, max_concurrency=max_concurrency, transport=transport)
+
+    @property
+    def poll_interval(self) -> float:
+        return self.client.poll_interval
+
+    @poll_interval.setter
+    def poll_interval(self, value: float):
+        self.client.poll_interval = value
+
+    def upload_file(self, file_path: str) -> Optional[str]:
+        """動画ファイルをアップロードしてURLを取得"""
+        return run_sync(self.client.upload_file(file_path))
+
+    def transcribe(self, audio_url: str, language: str = "ja") -> Optional[str]:
+        """音声ファイルを文字起こし"""
+        return run_sync(self.client.transcribe(audio_url, language))
+
+    def transcribe_detailed(self, audio_url: str, language: str = "ja", diarization: bool = False,
+                            num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """音声ファイルを文字起こし（発話ごとの時刻・話者付き）"""
+        return run_sync(self.client.transcribe_detailed(audio_url, language, diarization, num_speakers))
+
+    def transcribe_from_file(self, file_path: str, language: str = "ja") -> Optional[str]:
+        """ファイルから直接文字起こし（便利メソッド）"""
+        return run_sync(self.client.transcribe_from_file(file_path, language))
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def transcribe_file(self, file_path: str, language: str = "ja", diarization: bool = False,
+                        num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """ファイルをアップロードして文字起こし（長い音声は分割して同時に処理。TranscriptionBackend）"""
+        return run_sync(self.client.transcribe_file(file_path, language, diarization, num_speakers))
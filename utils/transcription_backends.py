@@ -0,0 +1,169 @@
+import importlib.util
+import os
+import threading
+from typing import Optional, Dict, List, Tuple
+
+from utils.audio_splitter import media_duration
+from utils.circuit_breaker import CircuitBreaker, OPEN
+from utils.metrics import metrics
+from utils.startup import timed_import
+from utils.transcription import Transcript, TranscriptionBackend
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    faster-whisper によるローカル（CPU）文字起こし
+
+    - int8 量子化したモデルをプロセス内で共有する（読み込みは初回のみ）
+    - batch_size > 1 の場合は BatchedInferencePipeline で音声区間をまとめてデコードする
+    - 話者分離は行わない（speaker は -1）
+    faster-whisper がインストールされていない場合は available() が False になる
+    """
+
+    name = "whisper"
+    supports_diarization = False
+
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_size: str = "small", cpu_threads: int = 0, batch_size: int = 8,
+                 compute_type: str = "int8"):
+        self.model_size = model_size
+        self.cpu_threads = cpu_threads or (os.cpu_count() or 4)
+        self.batch_size = batch_size
+        self.compute_type = compute_type
+
+    @staticmethod
+    def installed() -> bool:
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def available(self) -> bool:
+        return self.installed()
+
+    def _pipeline(self):
+        """(WhisperModel, BatchedInferencePipeline) を取得（設定ごとにプロセス内で共有）"""
+        key = (self.model_size, self.compute_type, self.cpu_threads)
+        with self._models_lock:
+            cached = self._models.get(key)
+            if cached is None:
+                with timed_import("faster_whisper"):
+                    from faster_whisper import WhisperModel, BatchedInferencePipeline
+                print(f"Whisperモデル読み込み中: {self.model_size} ({self.compute_type}, {self.cpu_threads}スレッド)")
+                model = WhisperModel(self.model_size, device="cpu", compute_type=self.compute_type,
+                                     cpu_threads=self.cpu_threads)
+                cached = (model, BatchedInferencePipeline(model=model))
+                self._models[key] = cached
+            return cached
+
+    def transcribe_file(self, file_path: str, language: str = "ja", diarization: bool = False,
+                        num_speakers: Optional[int] = None) -> Optional[Transcript]:
+        """ファイルをローカルで文字起こし（diarization / num_speakers は無視する）"""
+        try:
+            with metrics.track("whisper", "transcribe") as record:
+                model, batched = self._pipeline()
+                if self.batch_size > 1:
+                    segments, info = batched.transcribe(file_path, language=language, batch_size=self.batch_size,
+                                                        word_timestamps=True)
+                else:
+                    segments, info = model.transcribe(file_path, language=language, beam_size=1,
+                                                      vad_filter=True, word_timestamps=True)
+                # segments はジェネレータで、デコードは取り出すときに行われる
+                transcript = Transcript()
+                for segment in segments:
+                    text = segment.text.strip()
+                    if text:
+                        words = [(w.word.strip(), w.start, w.end) for w in segment.words or []]
+                        transcript.add_utterance(segment.start, segment.end, -1, text, words)
+                transcript.text = "".join(transcript.texts)
+                if not transcript.text:
+                    record.fail("EmptyTranscript")
+                metrics.count("audio_seconds", "whisper", "transcribe", int(round(info.duration)))
+            print(f"ローカル文字起こし完了: {info.duration:.1f}秒の音声 / {record.duration:.1f}秒")
+            return transcript
+        except Exception as e:
+            print(f"ローカル文字起こしエラー: {type(e).__name__}: {e}")
+            return None
+
+
+class TranscriptionRouter:
+    """
+    クリップの長さとバックエンドの状態で文字起こしバックエンドを選ぶ
+
+    - 話者分離が必要 → Gladia を優先（ローカルは話者分離しない）
+    - local_max_seconds 以下の短いクリップ → ローカルを優先（アップロード・キュー待ち・ポーリングを省く）
+    - それ以外・長さが分からない場合 → Gladia を優先
+    失敗したら次のバックエンドで再試行する。failure_threshold 回続けて失敗したバックエンドは
+    サーキットブレーカーで cooldown 秒間使わない（その後は half-open の試行回数の範囲でだけ試す）
+    """
+
+    def __init__(self, backends: Dict[str, TranscriptionBackend], mode: str = "auto",
+                 local_max_seconds: float = 90, failure_threshold: int = 2, cooldown: float = 120):
+        self.backends = backends
+        self.mode = mode
+        self.local_max_seconds = local_max_seconds
+        # 直近 failure_threshold 回がすべて失敗したら開く（= 連続失敗）
+        self._breakers = {name: CircuitBreaker(f"transcribe:{name}", window=failure_threshold, failure_rate=1.0,
+                                               min_calls=failure_threshold, open_seconds=cooldown)
+                          for name in backends}
+
+    def healthy(self, name: str) -> bool:
+        return self._breakers[name].state != OPEN
+
+    def order(self, duration: Optional[float], diarization: bool = False) -> List[str]:
+        """試す順のバックエンド名（使えないものは除く。停止中のものは後ろ）"""
+        if self.mode != "auto":
+            preferred = [self.mode]
+        elif duration is not None and duration <= self.local_max_seconds and not diarization:
+            preferred = ["whisper", "gladia"]
+        else:
+            preferred = ["gladia", "whisper"]
+        usable = [name for name in preferred if name in self.backends and self.backends[name].available()]
+        # 停止中のものは後回し（すべて停止中ならそのまま試す）
+        return [name for name in usable if self.healthy(name)] + [name for name in usable if not self.healthy(name)]
+
+    def transcribe_file(self, file_path: str, language: str = "ja", diarization: bool = False,
+                        num_speakers: Optional[int] = None) -> Tuple[Optional[Transcript], Optional[str]]:
+        """
+        選んだバックエンドで文字起こし（失敗したら次のバックエンド）
+
+        Returns:
+            (Transcript, 使ったバックエンド名)。すべて失敗・停止中の場合は (None, None)
+        """
+        duration = media_duration(file_path)
+        previous = None
+        for name in self.order(duration, diarization):
+            breaker = self._breakers[name]
+            # 停止中（half-open の試行枠を使い切った場合も含む）のバックエンドは呼ばない
+            if not breaker.allow():
+                metrics.count("short_circuited", name, "transcribe")
+                print(f"{name} は停止中のため使いません（あと{breaker.retry_in():.0f}秒）")
+                continue
+            if previous is not None:
+                metrics.count("fallbacks", "router", "transcribe")
+                print(f"{previous} で失敗したため {name} で文字起こしします")
+            try:
+                transcript = self.backends[name].transcribe_file(file_path, language, diarization, num_speakers)
+            except BaseException:
+                breaker.release()
+                raise
+            ok = transcript is not None and bool(transcript.text)
+            breaker.record(ok)
+            if ok:
+                metrics.count("routed", name, "transcribe")
+                return transcript, name
+            previous = name
+        return None, None
+
+    def health(self) -> List[dict]:
+        """バックエンドごとの状態（画面表示用）"""
+        rows = []
+        for name, backend in self.backends.items():
+            snapshot = self._breakers[name].snapshot()
+            rows.append({
+                "backend": name,
+                "available": backend.available(),
+                "healthy": snapshot["state"] != OPEN,
+                "failures": round(snapshot["failure_rate"] * snapshot["calls"]),
+                "retry_in": snapshot["retry_in"],
+            })
+        return rows
@@ -0,0 +1,183 @@
+import re
+import statistics
+import unicodedata
+from typing import List, NamedTuple, Optional
+
+# 合計スコアの重み（形式の守り具合・元テキストの強い表現の使用率・長さのバランス）
+WEIGHTS = {"format": 0.5, "coverage": 0.3, "balance": 0.2}
+# テロップとセリフが同じ内容とみなす文字2-gramの重なり（テロップ側から見た割合）
+DUPLICATE_OVERLAP = 0.6
+# 元テキストから拾う強い表現の最大数
+MAX_PHRASES = 30
+
+_PAGE_HEADER = re.compile(r"^-{3}\s*P\d+\s*-{3}\s*$", re.MULTILINE)
+_LINE = re.compile(r"^【(.+?)】(.*)$")
+_STAGE_DIRECTION = re.compile(r"^[（(]\s*ト書き")
+# 数字を含む表現（「200万円」「18ヶ月」「6割」「11選」など）
+_NUMBER_PHRASE = re.compile(r"\d[\d,.]*\s*(?:万|千|億)?(?:円|%|ヶ月|か月|カ月|年|日分|日|歳|選|つ|人|倍|割|回|時間|分)")
+# カタカナ語（「ゼニゲバ」など。3文字以上）
+_KATAKANA = re.compile(r"[ァ-ヴー]{3,}")
+# かぎ括弧で強調された表現
+_QUOTED = re.compile(r"「([^」]{2,20})」")
+_IGNORED_CATEGORIES = ("P", "Z", "S", "C")
+
+
+class VariationScore(NamedTuple):
+    index: int
+    score: float
+    format: float
+    coverage: float
+    balance: float
+    issues: List[str]
+
+
+def _normalize(text: str) -> str:
+    """比較用に正規化（NFKC・小文字化・句読点と空白の除去）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith(_IGNORED_CATEGORIES))
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+
+
+def parse_pages(scenario: str) -> List[dict]:
+    """
+    シナリオをページごとに分解
+
+    Returns:
+        {"stage": ト書きがあるか, "telops": テロップのリスト, "lines": セリフのリスト, "raw": 行のリスト} のリスト
+    """
+    pages = []
+    for body in _PAGE_HEADER.split(scenario or "")[1:]:
+        page = {"stage": False, "telops": [], "lines": [], "raw": []}
+        for line in body.strip().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            page["raw"].append(line)
+            if _STAGE_DIRECTION.match(line):
+                page["stage"] = True
+                continue
+            match = _LINE.match(line)
+            if match:
+                speaker, content = match.groups()
+                (page["telops"] if speaker == "テロップ" else page["lines"]).append(content.strip())
+        pages.append(page)
+    return pages
+
+
+def impact_phrases(source_text: str) -> List[str]:
+    """元テキストのインパクトのある表現（数字を含む表現・カタカナ語・かぎ括弧の表現）"""
+    text = unicodedata.normalize("NFKC", source_text or "")
+    found = []
+    for pattern in (_NUMBER_PHRASE, _QUOTED, _KATAKANA):
+        for match in pattern.finditer(text):
+            phrase = _normalize(match.group(1) if pattern.groups else match.group(0))
+            if len(phrase) >= 2 and phrase not in found:
+                found.append(phrase)
+    return found[:MAX_PHRASES]
+
+
+def _is_duplicate(telop: str, lines: List[str]) -> bool:
+    """テロップとページ内のセリフが同じ内容か（見出し・数字だけの短いテロップは対象外）"""
+    telop = _normalize(telop)
+    if len(telop) < 6:
+        return False
+    telop_grams = _bigrams(telop)
+    for line in lines:
+        line = _normalize(line)
+        if telop in line or len(telop_grams & _bigrams(line)) / len(telop_grams) >= DUPLICATE_OVERLAP:
+            return True
+    return False
+
+
+def _format_score(pages: List[dict], num_pages: int, issues: List[str]) -> float:
+    """形式の守り具合（ページ数・テロップとセリフの重複・読点での改行・ト書き）"""
+    page_score = max(0.0, 1 - abs(len(pages) - num_pages) / max(1, num_pages))
+    if len(pages) != num_pages:
+        issues.append(f"ページ数 {len(pages)}/{num_pages}")
+
+    # P1はテロップだけのページなので重複の対象外
+    telops = [(telop, page["lines"]) for page in pages[1:] for telop in page["telops"]]
+    duplicates = sum(_is_duplicate(telop, lines) for telop, lines in telops)
+    if duplicates:
+        issues.append(f"テロップとセリフの重複 {duplicates}件")
+
+    contents = [content for page in pages for content in page["telops"] + page["lines"]]
+    comma_breaks = sum(content.rstrip().endswith(("、", "，", ",")) for content in contents)
+    if comma_breaks:
+        issues.append(f"読点での改行 {comma_breaks}行")
+
+    missing_stage = sum(not page["stage"] for page in pages)
+    if missing_stage:
+        issues.append(f"ト書きなし {missing_stage}ページ")
+
+    checks = [
+        page_score,
+        1 - duplicates / len(telops) if telops else 1.0,
+        1 - comma_breaks / len(contents) if contents else 0.0,
+        1 - missing_stage / len(pages) if pages else 0.0,
+    ]
+    return sum(checks) / len(checks)
+
+
+def _coverage_score(scenario: str, phrases: List[str], issues: List[str]) -> float:
+    """元テキストの強い表現をどれだけ使っているか"""
+    if not phrases:
+        return 1.0
+    text = _normalize(scenario)
+    missing = [phrase for phrase in phrases if phrase not in text]
+    if missing:
+        issues.append("未使用の表現: " + "、".join(missing[:5]) + ("…" if len(missing) > 5 else ""))
+    return 1 - len(missing) / len(phrases)
+
+
+def _balance_score(pages: List[dict], length: int, reference_length: Optional[float]) -> float:
+    """ページごとの長さのばらつき（P1を除く）と、パターン間での長さの差"""
+    lengths = [sum(len(_normalize(c)) for c in page["telops"] + page["lines"]) for page in pages[1:]]
+    if len(lengths) >= 2 and statistics.mean(lengths) > 0:
+        evenness = max(0.0, 1 - statistics.pstdev(lengths) / statistics.mean(lengths))
+    else:
+        evenness = 0.0 if not lengths else 1.0
+    if not reference_length:
+        return evenness
+    relative = max(0.0, 1 - abs(length - reference_length) / reference_length)
+    return (evenness + relative) / 2
+
+
+def score_variation(scenario: str, num_pages: int, phrases: List[str], index: int = 0,
+                    reference_length: Optional[float] = None) -> VariationScore:
+    """
+    1パターンのスコア（0〜1）
+
+    Args:
+        scenario: シナリオ
+        num_pages: 指定したページ数
+        phrases: impact_phrases で拾った元テキストの表現
+        index: パターンの番号（0始まり）
+        reference_length: 比べるパターン全体の長さの中央値（なければパターン間の比較はしない）
+    """
+    issues = []
+    pages = parse_pages(scenario)
+    length = len(_normalize(scenario or ""))
+    format_score = _format_score(pages, num_pages, issues)
+    coverage = _coverage_score(scenario or "", phrases, issues)
+    balance = _balance_score(pages, length, reference_length)
+    score = (WEIGHTS["format"] * format_score + WEIGHTS["coverage"] * coverage
+             + WEIGHTS["balance"] * balance)
+    return VariationScore(index, score, format_score, coverage, balance, issues)
+
+
+def rank_variations(variations: List[str], source_text: str, num_pages: int) -> List[VariationScore]:
+    """
+    複数パターンをローカルで採点し、スコアの高い順に並べる（モデルは呼び出さない）
+
+    同点の場合は元の順番（パターン番号の小さい方）を優先する
+    """
+    if not variations:
+        return []
+    phrases = impact_phrases(source_text)
+    reference = statistics.median(len(_normalize(v or "")) for v in variations) if len(variations) > 1 else None
+    scores = [score_variation(v, num_pages, phrases, i, reference) for i, v in enumerate(variations)]
+    return sorted(scores, key=lambda s: (-s.score, s.index))